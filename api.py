@@ -0,0 +1,557 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from graph import get_workflow
+from instrumentation import metrics_snapshot, prometheus_text
+from patient_input import validate_record
+from plan_cache import get_plan_cache
+from runner import DONE, aresume_with_events, arun_with_events
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = int(os.environ.get('DIET_API_WORKERS', 32))       # plans running at once
+DEFAULT_QUEUE_SIZE = int(os.environ.get('DIET_API_QUEUE', 1000))    # plans waiting for a worker
+MAX_BODY_BYTES = int(os.environ.get('DIET_API_MAX_BODY', 64 * 1024))  # larger request bodies get 413
+MAX_WAIT_SECONDS = 30.0          # longest long-poll
+JOB_TTL_SECONDS = 3600.0         # finished jobs are kept this long for download
+MAX_FINISHED_JOBS = 10000
+DEFAULT_PLAN_SECONDS = 30.0      # assumed plan duration until real ones have been measured
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """
+    Raised by JobService.submit() when the admission queue is full.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Job:
+    """
+    One submitted plan: its status, the node events of its run and, once finished, its result.
+
+    Waiters block on the job's own condition, so a change to one job wakes only its pollers.
+    """
+
+    def __init__(self, state: dict, configurable: dict):
+        self.id = uuid.uuid4().hex
+        self.state = state
+        self.configurable = configurable
+        self.status = QUEUED
+        self.events = []
+        self.result = None
+        self.pdf = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.task = None
+        self.resumed = False
+        self.changed = threading.Condition()
+
+    def update(self, **changes) -> None:
+        with self.changed:
+            for key, value in changes.items():
+                setattr(self, key, value)
+            self.changed.notify_all()
+
+    def put(self, event) -> None:
+        """
+        Receives the runner's NodeEvents (the job is passed to arun_with_events() as its event queue).
+        """
+        if event.kind == DONE:
+            return
+        with self.changed:
+            self.events.append({'kind': event.kind, 'node': event.node, 'elapsed': round(event.elapsed, 3),
+                                'at': round(event.at, 3), 'detail': event.detail})
+            self.changed.notify_all()
+
+    def wait(self, after: int, timeout: float) -> None:
+        """
+        Blocks until the job has more than `after` events or has finished, or until timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while len(self.events) <= after and self.status not in FINISHED_STATES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self.changed.wait(remaining)
+
+    def view(self, after: int = 0, position: int = None) -> dict:
+        with self.changed:
+            view = {
+                'job_id': self.id,
+                'status': self.status,
+                'events': self.events[after:],
+                'next': len(self.events),
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished,
+                'error': self.error,
+            }
+        if position is not None:
+            view['queue_position'] = position
+        if view['status'] == SUCCEEDED:
+            view['links'] = {'pdf': f"/jobs/{self.id}/pdf", 'result': f"/jobs/{self.id}/result"}
+        return view
+
+
+class JobService:
+    """
+    Runs submitted plans on one background event loop with at most `workers` running at once.
+
+    Plans wait in a FIFO admission queue of at most `queue_size` jobs; beyond that, submit()
+    raises QueueFull with a Retry-After estimate derived from the measured plan duration. Every
+    worker runs the async workflow through the plan cache, so a plan holds no thread while it
+    waits for the LLM.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 workflow_options: dict = None, configurable: dict = None):
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        # checkpointed, so POST /jobs/{id}/resume can continue a failed job
+        self.workflow_options = dict(workflow_options or {}, async_mode=True, checkpoint=True)
+        self.configurable = dict(configurable or {})    # server-wide run settings (model, provider, ...)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._waiting = OrderedDict()           # queued job ids, for queue positions
+        self._running = 0
+        self._plan_seconds = DEFAULT_PLAN_SECONDS
+        self._counters = {'submitted': 0, 'rejected': 0, 'succeeded': 0, 'failed': 0, 'cancelled': 0}
+        self._loop = None
+        self._queue = None
+        self._thread = None
+
+    # ---- lifecycle -------------------------------------------------------
+
+    def start(self) -> None:
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._queue = asyncio.Queue()
+            for i in range(self.workers):
+                self._loop.create_task(self._worker(), name=f'plan-worker-{i}')
+            started.set()
+            self._loop.run_forever()
+
+        get_workflow(**self.workflow_options)
+        self._thread = threading.Thread(target=run, name='job-service', daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def shutdown(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    # ---- admission -------------------------------------------------------
+
+    def _retry_after(self) -> int:
+        # time until enough running and queued plans have finished for one more to fit
+        return max(1, math.ceil(self._plan_seconds * (len(self._waiting) + 1) / self.workers))
+
+    def submit(self, state: dict, configurable: dict = None) -> Job:
+        """
+        Queues a plan for a validated input state.
+
+        Args:
+            state (dict): The workflow's input state.
+            configurable (dict): Per-run settings, e.g. the user's api_key.
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            QueueFull: If the admission queue is full.
+        """
+        job = Job(state, configurable or {})
+        with self._lock:
+            self._evict_finished()
+            if len(self._waiting) >= self.queue_size:
+                self._counters['rejected'] += 1
+                raise QueueFull(self._retry_after())
+            self._jobs[job.id] = job
+            self._waiting[job.id] = job
+            self._counters['submitted'] += 1
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return job
+
+    def resume(self, job: Job) -> bool:
+        """
+        Queues a failed or cancelled job again, to continue from its last checkpoint.
+
+        Returns:
+            bool: False when the job did not fail and was not cancelled.
+
+        Raises:
+            QueueFull: If the admission queue is full.
+        """
+        with self._lock:
+            if job.status not in (FAILED, CANCELLED):
+                return False
+            if len(self._waiting) >= self.queue_size:
+                self._counters['rejected'] += 1
+                raise QueueFull(self._retry_after())
+            job.update(status=QUEUED, resumed=True, error=None, started=None, finished=None)
+            self._waiting[job.id] = job
+            self._jobs.move_to_end(job.id)
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return True
+
+    def _evict_finished(self) -> None:
+        # called with the lock held; jobs are in submission order, so the oldest come first
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.status in FINISHED_STATES]
+        excess = len(finished) - MAX_FINISHED_JOBS
+        for job in finished:
+            if excess <= 0 and now - job.finished < JOB_TTL_SECONDS:
+                break
+            del self._jobs[job.id]
+            excess -= 1
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> int:
+        """
+        Returns the job's 1-based place in the admission queue, or None when it is not waiting.
+        """
+        with self._lock:
+            if job.id not in self._waiting:
+                return None
+            return next(i for i, job_id in enumerate(self._waiting, start=1) if job_id == job.id)
+
+    def cancel(self, job: Job) -> bool:
+        """
+        Cancels a queued or running job.
+
+        Returns:
+            bool: False when the job had already finished.
+        """
+        with self._lock:
+            if job.status in FINISHED_STATES:
+                return False
+            if self._waiting.pop(job.id, None) is not None:
+                job.update(status=CANCELLED, finished=time.time())
+                self._counters['cancelled'] += 1
+                return True
+            if job.task is not None:
+                self._loop.call_soon_threadsafe(job.task.cancel)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(queued=len(self._waiting), running=self._running, jobs=len(self._jobs),
+                         workers=self.workers, queue_size=self.queue_size, plan_seconds=round(self._plan_seconds, 2))
+        return stats
+
+    # ---- execution -------------------------------------------------------
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            with self._lock:
+                if self._waiting.pop(job.id, None) is None:
+                    continue        # cancelled while queued
+                self._running += 1
+                # a task per job, so cancelling it never reaches the worker or the next job
+                job.task = asyncio.ensure_future(self._run(job))
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                job.update(status=CANCELLED, finished=time.time())
+                with self._lock:
+                    self._counters['cancelled'] += 1
+            finally:
+                with self._lock:
+                    job.task = None
+                    self._running -= 1
+
+    async def _run(self, job: Job) -> None:
+        job.update(status=RUNNING, started=time.time())
+        config = {'configurable': {**self.configurable, **job.configurable, 'thread_id': job.id}}
+        graph = get_workflow(**self.workflow_options)
+
+        async def run():
+            if job.resumed:
+                try:
+                    return await aresume_with_events(graph, config, job)
+                except LookupError:
+                    # cancelled before it started, or its checkpoints were pruned
+                    logger.info("job %s has no checkpoint; running it from the start", job.id)
+            return await arun_with_events(graph, job.state, config, job)
+
+        try:
+            result = await get_plan_cache().aget_or_run(job.state, run, config=config)
+            if not result.get('diet_plan_pdf'):
+                raise RuntimeError("the workflow produced no PDF")
+        except Exception as e:
+            logger.error("job %s failed: %s", job.id, e)
+            job.update(status=FAILED, error=f"{type(e).__name__}: {e}", finished=time.time())
+            with self._lock:
+                self._counters['failed'] += 1
+            return
+
+        finished = time.time()
+        with self._lock:
+            self._counters['succeeded'] += 1
+            # moving average of plan durations, for Retry-After
+            self._plan_seconds = 0.9 * self._plan_seconds + 0.1 * (finished - job.started)
+        job.update(
+            status=SUCCEEDED, finished=finished, pdf=result['diet_plan_pdf'], state=None,
+            result={key: value for key, value in result.items() if key != 'diet_plan_pdf'},
+        )
+
+
+# ---- HTTP layer ------------------------------------------------------------
+
+
+_JOB_PATH = re.compile(r'^/jobs/([0-9a-f]{32})(?:/(pdf|result))?$')
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """
+    HTTP endpoints of the job API:
+
+        POST   /jobs                 submit a profile (JSON body); 202 with the job id, 429 when full
+        GET    /jobs/{id}?after=N&wait=S
+                                     status and node events after the N-th; waits up to S seconds
+                                     for a new event or the end of the run (long-poll)
+        GET    /jobs/{id}/pdf        the plan PDF once the job has succeeded
+        GET    /jobs/{id}/result     the final state as JSON
+        POST   /jobs/{id}/resume     run a failed or cancelled job again from its last completed node
+        DELETE /jobs/{id}            cancel a queued or running job
+        GET    /healthz              queue and worker counters
+        GET    /metrics              node metrics in the Prometheus text format (?format=json for JSON)
+
+    The Google API key for the run may be sent in the X-Api-Key header; otherwise the server's
+    GOOGLE_API_KEY is used.
+    """
+
+    server_version = 'DietPlanAPI/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self) -> JobService:
+        return self.server.service
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _json(self, status: int, payload, headers: dict = None) -> None:
+        self._send(status, json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8'),
+                   'application/json; charset=utf-8', headers)
+
+    def _error(self, status: int, message: str, headers: dict = None) -> None:
+        self._json(status, {'error': message}, headers)
+
+    def _job(self, job_id: str) -> Job:
+        job = self.service.get(job_id)
+        if job is None:
+            self._error(404, f"unknown job {job_id}")
+        return job
+
+    def _read_body(self):
+        """
+        Reads the request body, or answers 400/413 and returns None when Content-Length is
+        missing a sane value or exceeds the server's max_body_bytes.
+        """
+        limit = self.server.max_body_bytes
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            # the body cannot be skipped without a length, so the connection cannot be reused
+            self.close_connection = True
+            self._error(400, "invalid Content-Length")
+            return None
+        if length > limit:
+            self.close_connection = True
+            self._error(413, f"body larger than {limit} bytes")
+            return None
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        body = self._read_body()
+        if body is None:
+            return
+        path = urlsplit(self.path).path
+        if path.endswith('/resume'):
+            return self._resume(path[:-len('/resume')])
+        if path != '/jobs':
+            return self._error(404, "not found")
+        try:
+            profile = json.loads(body or b'null')
+            if not isinstance(profile, dict):
+                raise ValueError("expected a JSON object")
+            state = validate_record(profile)
+        except ValueError as e:
+            return self._error(400, str(e))
+
+        configurable = {'api_key': self.headers['X-Api-Key']} if self.headers.get('X-Api-Key') else {}
+        try:
+            job = self.service.submit(state, configurable)
+        except QueueFull as e:
+            return self._error(429, str(e), {'Retry-After': str(e.retry_after)})
+        self._json(202, job.view(position=self.service.position(job)), {'Location': f"/jobs/{job.id}"})
+
+    def _resume(self, path: str) -> None:
+        match = _JOB_PATH.match(path)
+        if match is None or match.group(2) is not None:
+            return self._error(404, "not found")
+        job = self._job(match.group(1))
+        if job is None:
+            return
+        try:
+            if not self.service.resume(job):
+                return self._error(409, f"job is {job.status}")
+        except QueueFull as e:
+            return self._error(429, str(e), {'Retry-After': str(e.retry_after)})
+        self._json(202, job.view(position=self.service.position(job)))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/healthz':
+            return self._json(200, self.service.stats())
+        if url.path == '/metrics':
+            if query.get('format') == ['json']:
+                return self._json(200, metrics_snapshot())
+            return self._send(200, prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4')
+
+        match = _JOB_PATH.match(url.path)
+        if match is None:
+            return self._error(404, "not found")
+        job = self._job(match.group(1))
+        if job is None:
+            return
+
+        if match.group(2) is None:
+            try:
+                after = max(0, int(query.get('after', ['0'])[0]))
+                wait = min(MAX_WAIT_SECONDS, max(0.0, float(query.get('wait', ['0'])[0])))
+            except ValueError:
+                return self._error(400, "after and wait must be numbers")
+            if wait:
+                job.wait(after, wait)
+            return self._json(200, job.view(after, self.service.position(job)))
+
+        if job.status != SUCCEEDED:
+            return self._error(409, f"job is {job.status}")
+        if match.group(2) == 'pdf':
+            return self._send(200, job.pdf, 'application/pdf',
+                              {'Content-Disposition': f'attachment; filename="diet_plan_{job.id}.pdf"'})
+        return self._json(200, job.result)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_DELETE(self):
+        match = _JOB_PATH.match(urlsplit(self.path).path)
+        if match is None or match.group(2) is not None:
+            return self._error(404, "not found")
+        job = self._job(match.group(1))
+        if job is None:
+            return
+        if not self.service.cancel(job):
+            return self._error(409, f"job is {job.status}")
+        self._json(202, job.view(position=None))
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # long-polls hold a connection each; let bursts of them queue instead of being refused
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple, service: JobService, max_body_bytes: int = MAX_BODY_BYTES):
+        super().__init__(address, ApiHandler)
+        self.service = service
+        self.max_body_bytes = max_body_bytes
+
+
+def serve(host: str = '127.0.0.1', port: int = 8000, workers: int = DEFAULT_WORKERS,
+          queue_size: int = DEFAULT_QUEUE_SIZE, workflow_options: dict = None, configurable: dict = None,
+          max_body_bytes: int = MAX_BODY_BYTES) -> None:
+    """
+    Starts the job service and serves the HTTP API until interrupted.
+
+    Args:
+        host (str): Interface to listen on.
+        port (int): Port to listen on.
+        workers (int): Plans running at once.
+        queue_size (int): Plans that may wait for a worker before submissions get 429.
+        workflow_options (dict): Get_workflow() options, e.g. {"fused": True}.
+        configurable (dict): Run settings shared by every job (model, provider, llm_overrides, ...).
+        max_body_bytes (int): Largest request body accepted; larger ones get 413.
+    """
+    service = JobService(workers, queue_size, workflow_options, configurable)
+    service.start()
+    server = ApiServer((host, port), service, max_body_bytes)
+    logger.info("serving the diet plan API on http://%s:%d (%d workers, queue of %d)", host, server.server_port, workers, queue_size)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the diet plan generator as an HTTP job API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Plans running at once")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="Plans waiting before 429")
+    parser.add_argument("--max-body", type=int, default=MAX_BODY_BYTES, help="Largest request body in bytes")
+    parser.add_argument("--model", help="Model name")
+    parser.add_argument("--provider", help="Model provider")
+    parser.add_argument("--fused", action="store_true", help="Answer the five profile nodes with one LLM request")
+    args = parser.parse_args()
+
+    configurable = {key: value for key, value in (('model', args.model), ('provider', args.provider)) if value}
+
+    logging.basicConfig(level=os.environ.get("DIET_LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    serve(args.host, args.port, args.workers, args.queue_size, {'fused': args.fused}, configurable, args.max_body)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import argparse
+import concurrent.futures
+import csv
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from checkpoints import checkpoint_config
+from patient_input import LIST_FIELDS, validate_record
+
+
+ID_FIELDS = ('id', 'patient_id', 'record_id')
+
+DONE = 'done'
+FAILED = 'failed'
+INVALID = 'invalid'
+
+
+# ---- reading records -----------------------------------------------------
+
+
+def _csv_value(key: str, value: str):
+    value = value.strip()
+    if key in LIST_FIELDS and value.lower() != 'no':
+        separator = ';' if ';' in value else ','
+        return [item.strip() for item in value.split(separator) if item.strip()]
+    return value
+
+
+def read_records(path: str, fmt: str = None):
+    """
+    Streams patient records from a JSONL or CSV file, one at a time.
+
+    In CSV files list fields are separated by ";" (or "," when there is no ";"). Empty cells
+    are left out, so the Dietplan_State default applies.
+
+    Args:
+        path (str): The input file.
+        fmt (str): "jsonl" or "csv"; guessed from the extension by default.
+
+    Yields:
+        tuple: (record id, line number, record dict or the ValueError that made the line unreadable)
+    """
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    with open(path, newline='' if fmt == 'csv' else None, encoding='utf-8-sig') as f:
+        if fmt == 'csv':
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                record = {key.strip(): _csv_value(key.strip(), value) for key, value in row.items()
+                          if key and value is not None and value.strip()}
+                yield record_id(record, line), line, record
+            return
+
+        for line, text in enumerate(f, start=1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                yield f"line-{line}", line, ValueError(f"unreadable JSON: {e}")
+                continue
+            yield record_id(record, line), line, record
+
+
+def record_id(record: dict, line: int) -> str:
+    """
+    Returns the record's id (its id/patient_id/record_id field, else the line number), safe for file names.
+    """
+    for key in ID_FIELDS:
+        if record.get(key) not in (None, ''):
+            return re.sub(r'[^A-Za-z0-9._-]+', '_', str(record[key]))[:100]
+    return f"line-{line}"
+
+
+# ---- manifest --------------------------------------------------------------
+
+
+class Manifest:
+    """
+    Records the outcome of every record in an SQLite file next to the outputs, so an interrupted
+    batch can be resumed: records already marked done are skipped on the next run.
+
+    Lookups go to the database rather than an in-memory set, so memory does not grow with the
+    size of the cohort.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS records ('
+            'id TEXT PRIMARY KEY, status TEXT NOT NULL, line INTEGER, pdf TEXT, state TEXT, '
+            'error TEXT, seconds REAL, updated REAL NOT NULL)'
+        )
+
+    def status(self, record_id: str) -> str:
+        row = self._db.execute('SELECT status FROM records WHERE id = ?', (record_id,)).fetchone()
+        return row[0] if row else None
+
+    def record(self, record_id: str, status: str, line: int, pdf: str = None, state: str = None,
+               error: str = None, seconds: float = None) -> None:
+        self._db.execute(
+            'INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (record_id, status, line, pdf, state, error, seconds, time.time()),
+        )
+
+    def counts(self) -> dict:
+        return dict(self._db.execute('SELECT status, COUNT(*) FROM records GROUP BY status').fetchall())
+
+    def close(self) -> None:
+        self._db.close()
+
+
+# ---- workers ---------------------------------------------------------------
+
+
+_WORKER = {}
+
+
+def _init_worker(configurable: dict, fused: bool, workers: int, log_level: int) -> None:
+    """
+    Prepares a worker process: its compiled workflow, its run config and its share of the LLM quota.
+    """
+    logging.basicConfig(level=log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    from graph import get_workflow
+    from rate_limiter import configure_rate_limiter
+
+    # every process has its own limiter, so each gets an equal part of the quota
+    rpm, tpm = os.environ.get('DIET_LLM_RPM'), os.environ.get('DIET_LLM_TPM')
+    if rpm or tpm:
+        configure_rate_limiter(float(rpm) / workers if rpm else None, float(tpm) / workers if tpm else None)
+    _WORKER['graph'] = get_workflow(fused=fused, checkpoint=True)
+    _WORKER['configurable'] = configurable
+
+
+def _write(path: str, data: bytes) -> None:
+    # write-then-rename, so a crash never leaves a truncated file behind
+    temp = f"{path}.tmp"
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+def _generate(record_id: str, state: dict, output_dir: str) -> dict:
+    """
+    Runs the workflow for one record in a worker process and writes its PDF and state JSON.
+
+    Runs are checkpointed under the record id, so a record that failed in an earlier batch
+    continues from its last completed node, as long as its input has not changed since.
+
+    Returns:
+        dict: {"status", "pdf", "state", "error", "seconds"} for the manifest.
+    """
+    start = time.perf_counter()
+    try:
+        graph = _WORKER['graph']
+        config = checkpoint_config({'configurable': dict(_WORKER['configurable'], thread_id=record_id)})
+        snapshot = graph.get_state(config)
+        resume = bool(snapshot.next) and all(snapshot.values.get(key) == value for key, value in state.items())
+        if not resume:
+            # a fresh run must not inherit state keys from an earlier run of this record
+            graph.checkpointer.delete_thread(record_id)
+        result = graph.invoke(None if resume else state, config=config)
+        graph.checkpointer.delete_thread(record_id)
+        pdf = result.get('diet_plan_pdf')
+        if not pdf:
+            raise RuntimeError("the workflow produced no PDF")
+        pdf_path = os.path.join(output_dir, 'pdf', f"{record_id}.pdf")
+        state_path = os.path.join(output_dir, 'state', f"{record_id}.json")
+        _write(pdf_path, pdf)
+        final = {key: value for key, value in result.items() if key != 'diet_plan_pdf'}
+        _write(state_path, json.dumps(final, ensure_ascii=False, indent=2, default=str).encode('utf-8'))
+    except Exception as e:
+        return {'status': FAILED, 'error': f"{type(e).__name__}: {e}", 'seconds': time.perf_counter() - start}
+    return {'status': DONE, 'pdf': pdf_path, 'state': state_path, 'seconds': time.perf_counter() - start}
+
+
+# ---- driver ----------------------------------------------------------------
+
+
+def run_batch(input_path: str, output_dir: str, workers: int = None, max_in_flight: int = None, fmt: str = None,
+              configurable: dict = None, fused: bool = False, log_level: int = logging.WARNING) -> dict:
+    """
+    Generates a plan for every record of a JSONL or CSV file on a pool of worker processes.
+
+    Records are read one at a time and at most max_in_flight of them are submitted but not yet
+    finished, so memory stays flat however long the file is. Each worker writes its plan's PDF
+    to <output_dir>/pdf/<id>.pdf and the final state to <output_dir>/state/<id>.json as soon as
+    it finishes; the outcome goes to <output_dir>/manifest.sqlite3. Running the same command
+    again skips the records the manifest marks done.
+
+    Args:
+        input_path (str): The JSONL or CSV file of patient records.
+        output_dir (str): Directory for the PDFs, state files and manifest.
+        workers (int): Worker processes; defaults to the CPU count.
+        max_in_flight (int): Records submitted at once; defaults to twice the workers.
+        fmt (str): "jsonl" or "csv"; guessed from the extension by default.
+        configurable (dict): The runs' "configurable" settings (api_key, model, llm_overrides, ...).
+        fused (bool): Use the fused profile_analysis workflow.
+        log_level (int): Logging level inside the workers.
+
+    Returns:
+        dict: Counts of this run ("done", "failed", "invalid", "skipped").
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    max_in_flight = max(workers, max_in_flight or 2 * workers)
+    for sub in ('pdf', 'state'):
+        os.makedirs(os.path.join(output_dir, sub), exist_ok=True)
+    manifest = Manifest(os.path.join(output_dir, 'manifest.sqlite3'))
+    counts = {DONE: 0, FAILED: 0, INVALID: 0, 'skipped': 0}
+    pending = {}
+    started = time.perf_counter()
+
+    def finish(future):
+        record, line = pending.pop(future)
+        try:
+            outcome = future.result()
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            outcome = {'status': FAILED, 'error': f"{type(e).__name__}: {e}"}
+        manifest.record(record, outcome['status'], line, outcome.get('pdf'), outcome.get('state'),
+                        outcome.get('error'), outcome.get('seconds'))
+        counts[outcome['status']] += 1
+        if outcome['status'] == DONE:
+            print(f"[{sum(counts.values())}] {record} done in {outcome['seconds']:.1f}s")
+        else:
+            print(f"[{sum(counts.values())}] {record} failed: {outcome['error']}")
+
+    def drain(limit):
+        while len(pending) > limit:
+            done, _ = concurrent.futures.wait(list(pending), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                finish(future)
+
+    pool = concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(configurable or {}, fused, workers, log_level),
+    )
+    try:
+        for record, line, data in read_records(input_path, fmt):
+            if manifest.status(record) == DONE or any(record == queued for queued, _ in pending.values()):
+                counts['skipped'] += 1
+                continue
+            if isinstance(data, Exception):
+                error = str(data)
+            else:
+                try:
+                    state = validate_record(data)
+                    error = None
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                manifest.record(record, INVALID, line, error=error)
+                counts[INVALID] += 1
+                print(f"line {line}: {record} is invalid: {error}")
+                continue
+
+            drain(max_in_flight - 1)
+            pending[pool.submit(_generate, record, state, output_dir)] = (record, line)
+        drain(0)
+    except (KeyboardInterrupt, BrokenProcessPool) as e:
+        pool.shutdown(wait=False, cancel_futures=True)
+        print(f"batch stopped ({type(e).__name__}); run the same command again to resume")
+        raise
+    finally:
+        pool.shutdown(wait=True)
+        elapsed = time.perf_counter() - started
+        print(f"{counts[DONE]} done, {counts[FAILED]} failed, {counts[INVALID]} invalid, "
+              f"{counts['skipped']} skipped in {elapsed:.1f}s; manifest totals: {manifest.counts()}")
+        manifest.close()
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Generate diet plans for a JSONL or CSV file of patient records.",
+        epilog="Example: python batch_cli.py cohort.csv --output-dir plans/ --workers 8",
+    )
+    parser.add_argument("input", help="JSONL or CSV file with one patient per line/row")
+    parser.add_argument("--output-dir", default="batch_output", help="Directory for PDFs, state JSON and the manifest")
+    parser.add_argument("--format", choices=('jsonl', 'csv'), help="Input format (default: from the extension)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--max-in-flight", type=int, help="Records submitted at once (default: 2 x workers)")
+    parser.add_argument("--api-key", help="Google API key (default: GOOGLE_API_KEY)")
+    parser.add_argument("--model", help="Model name")
+    parser.add_argument("--provider", help="Model provider")
+    parser.add_argument("--llm-overrides", nargs='*', default=[], help="Nodes to ask the LLM instead of computing locally")
+    parser.add_argument("--fused", action="store_true", help="Answer the five profile nodes with one LLM request")
+    parser.add_argument("--verbose", action="store_true", help="Log node timings from the workers")
+    args = parser.parse_args()
+
+    configurable = {key: value for key, value in (('api_key', args.api_key), ('model', args.model), ('provider', args.provider)) if value}
+    if args.llm_overrides:
+        configurable['llm_overrides'] = args.llm_overrides
+    try:
+        counts = run_batch(args.input, args.output_dir, args.workers, args.max_in_flight, args.format, configurable,
+                           args.fused, logging.INFO if args.verbose else logging.WARNING)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    sys.exit(1 if counts[FAILED] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_MS = 20
+DEFAULT_MAX_BATCH = 16
+DEFAULT_TIMEOUT = 120.0
+# Batches dispatched at the same time; later windows keep collecting while earlier ones are in flight.
+DEFAULT_MAX_INFLIGHT_BATCHES = 4
+MAX_BATCHERS = 64
+# How long the collector of a batcher dropped from the registry waits for late prompts before exiting.
+RETIRED_IDLE_SECONDS = 5.0
+
+_STOP = object()
+_WAKE = object()
+
+
+class MicroBatcher:
+    """
+    Collects prompts sent to one chat model from concurrent sessions and sends them together.
+
+    The first pending prompt opens a window of window_ms milliseconds; everything that arrives
+    before it closes (or until max_batch prompts are waiting) goes out in a single llm.batch()
+    call, and each result is routed back to the caller that submitted it. A caller that stops
+    waiting (timeout or cancellation) before its batch is dispatched is left out of it.
+    A retired batcher keeps serving whoever still holds it; once nothing has arrived for
+    RETIRED_IDLE_SECONDS its collector thread exits and its executor is shut down (a later
+    prompt starts both again).
+    """
+
+    def __init__(self, llm, window_ms: float = DEFAULT_WINDOW_MS, max_batch: int = DEFAULT_MAX_BATCH,
+                 timeout: float = DEFAULT_TIMEOUT, max_inflight_batches: int = DEFAULT_MAX_INFLIGHT_BATCHES):
+        self.llm = llm
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.timeout = timeout
+
+        self._queue = queue.Queue()
+        self.max_inflight_batches = max_inflight_batches
+        self._executor = None
+        self._thread = None
+        self._retired = False
+        self._lock = threading.Lock()
+        self._counters = {'prompts': 0, 'batches': 0, 'abandoned': 0, 'errors': 0}
+
+    def _collect(self) -> None:
+        """
+        Dispatcher loop: waits for a first prompt, fills the window, hands the batch to the executor.
+        """
+        while True:
+            try:
+                first = self._queue.get(timeout=RETIRED_IDLE_SECONDS if self._retired else None)
+            except queue.Empty:
+                # submit() queues under the same lock, so no prompt can be left behind unserved
+                with self._lock:
+                    if self._queue.empty():
+                        self._thread = None
+                        executor, self._executor = self._executor, None
+                    else:
+                        continue
+                # batches already dispatched still finish; the idle worker threads go away
+                executor.shutdown(wait=False)
+                return
+            if first is _STOP:
+                return
+            if first is _WAKE:
+                continue
+            pending = [first]
+            deadline = time.monotonic() + self.window
+            stop = False
+            while len(pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                if item is not _WAKE:
+                    pending.append(item)
+            self._executor.submit(self._dispatch, pending)
+            if stop:
+                return
+
+    def _dispatch(self, pending: list) -> None:
+        # drop callers that gave up while the window was open
+        live = [(prompt, future) for prompt, future in pending if future.set_running_or_notify_cancel()]
+        with self._lock:
+            self._counters['abandoned'] += len(pending) - len(live)
+            self._counters['batches'] += bool(live)
+        if not live:
+            return
+
+        try:
+            results = self.llm.batch([prompt for prompt, _ in live], return_exceptions=True)
+        except Exception as e:
+            results = [e] * len(live)
+
+        for (_, future), result in zip(live, results):
+            if isinstance(result, BaseException):
+                with self._lock:
+                    self._counters['errors'] += 1
+                future.set_exception(result)
+            else:
+                future.set_result(result.content)
+
+    def submit(self, prompt: str) -> concurrent.futures.Future:
+        """
+        Queues a prompt for the next batch.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the response text.
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._counters['prompts'] += 1
+            self._queue.put((prompt, future))
+            if self._thread is None:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_inflight_batches, thread_name_prefix='llm-batch')
+                self._thread = threading.Thread(target=self._collect, name='llm-batcher', daemon=True)
+                self._thread.start()
+        return future
+
+    def invoke(self, prompt: str, timeout: float = None) -> str:
+        """
+        Sends a prompt through the batcher and waits for its response.
+
+        Args:
+            prompt (str): The prompt.
+            timeout (float): Seconds to wait; defaults to the batcher's timeout.
+
+        Returns:
+            str: The response content.
+        """
+        future = self.submit(prompt)
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"LLM batch did not answer within {timeout or self.timeout}s")
+
+    async def ainvoke(self, prompt: str, timeout: float = None) -> str:
+        """
+        Async variant of invoke(); waits without blocking the event loop.
+        """
+        future = self.submit(prompt)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"LLM batch did not answer within {timeout or self.timeout}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+        stats['queued'] = self._queue.qsize()
+        stats['mean_batch_size'] = (stats['prompts'] - stats['abandoned'] - stats['queued']) / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+    def retire(self) -> None:
+        """
+        Lets the collector exit once idle, without refusing prompts from callers that still hold the batcher.
+        """
+        self._retired = True
+        self._queue.put(_WAKE)
+
+    def shutdown(self) -> None:
+        """
+        Stops collecting; prompts already queued are still dispatched.
+        """
+        thread = self._thread
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+        executor = self._executor
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+# id(llm) -> (llm, batcher); the llm is kept so its id cannot be reused while the entry exists.
+_BATCHERS = OrderedDict()
+_BATCHERS_LOCK = threading.Lock()
+
+
+def get_batcher(llm, **options) -> MicroBatcher:
+    """
+    Returns the shared batcher for a chat model, creating it with the given options on first use.
+
+    Args:
+        llm (BaseChatModel): The pooled chat model.
+        **options: window_ms, max_batch, timeout and max_inflight_batches for a new batcher.
+
+    Returns:
+        MicroBatcher: The batcher every session using this model shares.
+    """
+    key = id(llm)
+    with _BATCHERS_LOCK:
+        entry = _BATCHERS.get(key)
+        if entry is None:
+            entry = (llm, MicroBatcher(llm, **options))
+            _BATCHERS[key] = entry
+        _BATCHERS.move_to_end(key)
+        evicted = []
+        while len(_BATCHERS) > MAX_BATCHERS:
+            evicted.append(_BATCHERS.popitem(last=False)[1][1])
+    # other sessions may still hold an evicted batcher, so it is retired rather than shut down
+    for batcher in evicted:
+        batcher.retire()
+    return entry[1]
+
+
+@functools.lru_cache(maxsize=None)
+def has_batch_endpoint(model_type: type) -> bool:
+    """
+    Tells whether a chat model class sends batch()/abatch() as one request.
+
+    LangChain's default implementations (BaseChatModel inherits them from Runnable) only run
+    invoke() per prompt on a thread pool, so batching those would add the window's latency
+    without saving any requests. That includes ChatGoogleGenerativeAI, the client the app uses
+    in production: until it gains a synchronous batch call (Gemini's Batch API is an offline job
+    service, too slow for interactive plans), "batching" has no effect with it and only helps
+    models such as benchmarks/fake_llm.FakeChatModel that answer a batch in one request.
+
+    Args:
+        model_type (type): The chat model class.
+
+    Returns:
+        bool: True when batch or abatch is overridden outside langchain_core.
+    """
+    for name in ('batch', 'abatch'):
+        owner = next((cls for cls in model_type.__mro__ if name in vars(cls)), None)
+        if owner is not None and not owner.__module__.startswith('langchain_core.'):
+            return True
+    logger.info("%s has no batch endpoint; its calls bypass the micro-batcher", model_type.__name__)
+    return False
+
+
+def _batching_setting(config: dict) -> dict:
+    setting = (config or {}).get('configurable', {}).get('batching')
+    if not setting:
+        return None
+    return setting if isinstance(setting, dict) else {}
+
+
+def batcher_for(llm, config: dict = None):
+    """
+    Returns the batcher a run should send its prompts through, or None when batching is off.
+
+    Batching is enabled per run with {"configurable": {"batching": True}} or with a dict of
+    get_batcher() options, e.g. {"batching": {"window_ms": 20, "max_batch": 8, "timeout": 60}}.
+    The window options apply when the model's batcher is created; "timeout" applies per call.
+    Models without a real batch endpoint (see has_batch_endpoint()) are never batched.
+    """
+    setting = _batching_setting(config)
+    if setting is None or not has_batch_endpoint(type(llm)):
+        return None
+    return get_batcher(llm, **{key: value for key, value in setting.items() if key != 'timeout'})
+
+
+def batch_timeout(config: dict = None) -> float:
+    """
+    Returns the run's per-call batching timeout in seconds, or None for the batcher's default.
+    """
+    return (_batching_setting(config) or {}).get('timeout')
+
+
+def clear_batchers() -> None:
+    """
+    Shuts down and drops every batcher.
+    """
+    with _BATCHERS_LOCK:
+        batchers = [batcher for _, batcher in _BATCHERS.values()]
+        _BATCHERS.clear()
+    for batcher in batchers:
+        batcher.shutdown()
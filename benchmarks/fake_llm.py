@@ -0,0 +1,240 @@
+"""
+A deterministic, offline stand-in for the chat model, for benchmarking the whole workflow.
+
+FakeChatModel recognises which node a prompt belongs to from the JSON shape the prompt asks for
+(or from the schema quoted in a repair prompt), answers with a valid canned reply for that node
+and the report markdown for the PDF prompt. Latency is drawn from a log-normal distribution
+(time to first token) plus a per-token generation time, optionally with stalled requests,
+retryable 503 errors and malformed replies. Every draw is seeded from the prompt and how often
+it has been seen, so a run produces the same latencies and failures regardless of thread timing.
+
+Pass it to a run as {"configurable": {"llm": FakeChatModel(...)}}; see pipeline.py.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from methods import FUSED_SECTIONS
+from prompts import estimate_tokens
+from schemas import NODE_SCHEMAS
+
+
+REPLIES = {
+    'goal_class': {"goal_class": "WEIGHT_LOSS"},
+    'medical_conditions': {
+        "restrictions": ["low glycemic index", "lactose-free dairy"],
+        "warnings": ["monitor blood sugar after meals"],
+    },
+    'habits': {"preferences": ["high-fibre", "home-style food"], "avoid": ["refined sugar", "fried snacks"]},
+    'activity_level': {"activity_level": "LIGHT", "protein_multiplier": 1.0},
+    'routine_time': {"meal_schedule": {"breakfast": "07:30 AM", "lunch": "01:00 PM", "snack_1": "04:30 PM", "dinner": "08:00 PM"}},
+    'nutrient_need': {
+        "target_calories": 1800, "macros_target": {"protein": "90g", "carbs": "200g", "fat": "60g"},
+        "micros_needed": ["calcium", "iron", "vitamin D", "fiber"],
+    },
+    'meal_filter': {"allowed_meals": ["moong dal chilla", "vegetable upma", "lentil soup", "quinoa salad with chickpeas",
+                                      "rajma with brown rice", "vegetable khichdi", "sprouts salad", "fruit bowl"]},
+    'personalized_meals': {"meals": {
+        "breakfast": {"time": "07:30 AM", "items": ["2 moong dal chilla", "1 cup green tea"], "calories": 380},
+        "lunch": {"time": "01:00 PM", "items": ["1 cup rajma", "1 cup brown rice", "1 bowl salad"], "calories": 560},
+        "snack_1": {"time": "04:30 PM", "items": ["1 cup sprouts salad", "1 apple"], "calories": 220},
+        "dinner": {"time": "08:00 PM", "items": ["1 bowl vegetable khichdi", "1 cup lentil soup"], "calories": 520},
+    }},
+    'calorie_macro_ai': {
+        "total_calories": 1680, "actual_macros": {"protein": "82g", "carbs": "215g", "fat": "52g"},
+        "recommendation": "Within 7% of the target; add a portion of curd or tofu for protein.",
+    },
+    'supplement_advisor': {"supplements": ["vitamin D3", "vitamin B12"], "notes": "Recheck levels in three months."},
+    'hydration_tips': {"water_intake": "2.5 liters/day",
+                       "tips": ["Carry a water bottle", "Walk 10 minutes after dinner", "Keep a regular sleep schedule"]},
+    'motivation': {"opening": "Every balanced meal is a step forward.", "closing": "Consistency beats perfection."},
+}
+
+REPORT = """# Personalized Diet Plan
+
+## Patient Profile
+| Field | Value |
+|---|---|
+| Goal | Weight loss |
+| Diet | Vegetarian |
+| Target calories | 1800 kcal/day |
+
+## Daily Meal Plan
+| Meal | Time | Items | Calories |
+|---|---|---|---|
+| Breakfast | 07:30 AM | 2 moong dal chilla, green tea | 380 |
+| Lunch | 01:00 PM | rajma, brown rice, salad | 560 |
+| Snack | 04:30 PM | sprouts salad, apple | 220 |
+| Dinner | 08:00 PM | vegetable khichdi, lentil soup | 520 |
+
+## Supplements
+- Vitamin D3
+- Vitamin B12
+
+## Hydration and Lifestyle
+- Drink 2.5 liters of water a day
+- Walk 10 minutes after dinner
+
+Every balanced meal is a step forward.
+"""
+
+# First key of the requested JSON shape -> node
+_FIRST_KEYS = {next(iter(reply)): node for node, reply in REPLIES.items()}
+_RESPOND = re.compile(r'Respond in JSON: \{"(\w+)":(\{?)')
+_SCHEMA_TITLES = {model.__name__: node for node, model in NODE_SCHEMAS.items()}
+
+
+class ServiceUnavailable(Exception):
+    """
+    Stands in for the provider's 503 error; retryable by class name.
+    """
+
+
+def identify(prompt: str) -> str:
+    """
+    Returns the node a prompt was built by, "profile_analysis" for the fused prompt and
+    "pdf_generator" for anything that asks for no JSON (the report prompt).
+    """
+    if prompt.startswith('Your previous reply could not be used'):
+        for title in re.findall(r'"title":"(\w+)"', prompt):
+            if title in _SCHEMA_TITLES:
+                return _SCHEMA_TITLES[title]
+    match = _RESPOND.search(prompt)
+    if match is None:
+        return 'pdf_generator'
+    if match.group(2) and match.group(1) in FUSED_SECTIONS:
+        return 'profile_analysis'
+    return _FIRST_KEYS.get(match.group(1), 'pdf_generator')
+
+
+def reply_for(node: str, prompt: str) -> str:
+    if node == 'pdf_generator':
+        return REPORT
+    if node == 'profile_analysis':
+        reply = {name: REPLIES[name] for name in FUSED_SECTIONS if f'"{name}":{{' in prompt}
+    else:
+        reply = REPLIES[node]
+    return "```json\n" + json.dumps(reply) + "\n```"
+
+
+class FakeChatModel:
+    """
+    Chat model stand-in with invoke/ainvoke, batch/abatch and stream/astream.
+
+    Args:
+        median_ms (float): Median time to first token.
+        sigma (float): Log-normal spread of the time to first token (0 for a fixed latency).
+        tokens_per_s (float): Generation speed; longer replies take longer.
+        slow_rate (float): Share of requests that stall for slow_ms.
+        slow_ms (float): Latency of a stalled request.
+        error_rate (float): Share of requests that fail with a retryable 503.
+        invalid_rate (float): Share of JSON replies that come back truncated (exercises the repair call).
+        seed (int): Seed of every latency and failure draw.
+    """
+
+    model = 'fake-llm'
+    temperature = 0.0
+
+    def __init__(self, median_ms: float = 400, sigma: float = 0.35, tokens_per_s: float = 250,
+                 slow_rate: float = 0.0, slow_ms: float = 5000, error_rate: float = 0.0,
+                 invalid_rate: float = 0.0, seed: int = 7):
+        self.median_s = median_ms / 1000.0
+        self.sigma = sigma
+        self.tokens_per_s = tokens_per_s
+        self.slow_rate = slow_rate
+        self.slow_s = slow_ms / 1000.0
+        self.error_rate = error_rate
+        self.invalid_rate = invalid_rate
+        self.seed = seed
+        self._seen = defaultdict(int)
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+
+    def _plan(self, prompt) -> tuple:
+        """
+        Returns (reply text, seconds to wait, error to raise or None) for one request.
+        """
+        prompt = prompt if isinstance(prompt, str) else str(prompt)
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        node = identify(prompt)
+        with self._lock:
+            self._seen[digest] += 1
+            self.requests[node] += 1
+            draw = random.Random(f"{self.seed}:{digest}:{self._seen[digest]}")
+
+        reply = reply_for(node, prompt)
+        if node != 'pdf_generator' and draw.random() < self.invalid_rate:
+            reply = reply[:len(reply) // 2]
+        first_token = self.median_s * math.exp(self.sigma * draw.gauss(0.0, 1.0))
+        if draw.random() < self.slow_rate:
+            first_token = self.slow_s
+        seconds = first_token + estimate_tokens(reply) / self.tokens_per_s
+        error = ServiceUnavailable("503 model overloaded") if draw.random() < self.error_rate else None
+        return reply, seconds, error
+
+    def invoke(self, prompt, *args, **kwargs):
+        reply, seconds, error = self._plan(prompt)
+        time.sleep(seconds)
+        if error is not None:
+            raise error
+        return types.SimpleNamespace(content=reply)
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        reply, seconds, error = self._plan(prompt)
+        await asyncio.sleep(seconds)
+        if error is not None:
+            raise error
+        return types.SimpleNamespace(content=reply)
+
+    def batch(self, prompts, *args, return_exceptions: bool = False, **kwargs):
+        # one request for the whole batch: the slowest member decides the latency
+        planned = [self._plan(prompt) for prompt in prompts]
+        time.sleep(max((seconds for _, seconds, _ in planned), default=0.0))
+        return [self._result(reply, error, return_exceptions) for reply, _, error in planned]
+
+    async def abatch(self, prompts, *args, return_exceptions: bool = False, **kwargs):
+        planned = [self._plan(prompt) for prompt in prompts]
+        await asyncio.sleep(max((seconds for _, seconds, _ in planned), default=0.0))
+        return [self._result(reply, error, return_exceptions) for reply, _, error in planned]
+
+    @staticmethod
+    def _result(reply, error, return_exceptions):
+        if error is None:
+            return types.SimpleNamespace(content=reply)
+        if return_exceptions:
+            return error
+        raise error
+
+    def _chunks(self, reply: str, seconds: float, size: int = 16):
+        count = max(1, math.ceil(len(reply) / size))
+        return [(reply[i * size:(i + 1) * size], seconds / count) for i in range(count)]
+
+    def stream(self, prompt, *args, **kwargs):
+        reply, seconds, error = self._plan(prompt)
+        if error is not None:
+            time.sleep(seconds)
+            raise error
+        for chunk, delay in self._chunks(reply, seconds):
+            time.sleep(delay)
+            yield types.SimpleNamespace(content=chunk)
+
+    async def astream(self, prompt, *args, **kwargs):
+        reply, seconds, error = self._plan(prompt)
+        if error is not None:
+            await asyncio.sleep(seconds)
+            raise error
+        for chunk, delay in self._chunks(reply, seconds):
+            await asyncio.sleep(delay)
+            yield types.SimpleNamespace(content=chunk)
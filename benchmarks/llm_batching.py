@@ -0,0 +1,86 @@
+"""
+Compares direct LLM calls with the cross-session micro-batcher using an offline fake model.
+
+The fake model charges a fixed per-request overhead (connection, queueing) plus a small cost per
+prompt, and serves a limited number of requests at once, like a quota-bound endpoint.
+
+Run from the repository root:
+    python benchmarks/llm_batching.py --callers 200 --window-ms 20
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batcher import MicroBatcher
+
+
+class FakeChatModel:
+    """
+    Answers every prompt with a fixed reply after a simulated delay.
+    """
+
+    def __init__(self, request_ms: float, per_prompt_ms: float, max_concurrent: int):
+        self.request_s = request_ms / 1000.0
+        self.per_prompt_s = per_prompt_ms / 1000.0
+        self.slots = threading.Semaphore(max_concurrent)
+        self.requests = 0
+
+    def _serve(self, count: int) -> None:
+        with self.slots:
+            self.requests += 1
+            time.sleep(self.request_s + self.per_prompt_s * count)
+
+    def invoke(self, prompt):
+        self._serve(1)
+        return types.SimpleNamespace(content='{"ok": true}')
+
+    def batch(self, prompts, return_exceptions=False):
+        self._serve(len(prompts))
+        return [types.SimpleNamespace(content='{"ok": true}') for _ in prompts]
+
+
+def run_callers(callers: int, call) -> float:
+    """
+    Starts one thread per caller, each sending one prompt, and returns the wall time in seconds.
+    """
+    threads = [threading.Thread(target=call, args=(f"prompt {i}",)) for i in range(callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--callers", type=int, default=200, help="Concurrent prompts")
+    parser.add_argument("--window-ms", type=float, default=20, help="Batch collection window")
+    parser.add_argument("--max-batch", type=int, default=32, help="Prompts per batch")
+    parser.add_argument("--request-ms", type=float, default=300, help="Fake per-request overhead")
+    parser.add_argument("--per-prompt-ms", type=float, default=10, help="Fake cost per prompt")
+    parser.add_argument("--max-concurrent", type=int, default=8, help="Requests the fake endpoint serves at once")
+    args = parser.parse_args()
+
+    direct_model = FakeChatModel(args.request_ms, args.per_prompt_ms, args.max_concurrent)
+    direct = run_callers(args.callers, direct_model.invoke)
+
+    batched_model = FakeChatModel(args.request_ms, args.per_prompt_ms, args.max_concurrent)
+    batcher = MicroBatcher(batched_model, window_ms=args.window_ms, max_batch=args.max_batch,
+                           max_inflight_batches=args.max_concurrent)
+    batched = run_callers(args.callers, batcher.invoke)
+    batcher.shutdown()
+
+    print(f"{'direct':<10} {direct:7.2f} s  {args.callers / direct:8.1f} prompts/s  {direct_model.requests:5d} requests")
+    print(f"{'batched':<10} {batched:7.2f} s  {args.callers / batched:8.1f} prompts/s  {batched_model.requests:5d} requests")
+    print(f"mean batch size {batcher.stats()['mean_batch_size']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Runs the whole workflow offline at several concurrency levels and records the results as JSON.
+
+Every plan goes through get_workflow() end to end with the deterministic FakeChatModel from
+fake_llm.py in place of Gemini, so the numbers reflect the engine (graph scheduling, parsing,
+retries, rate limiting, report templates, PDF rendering) plus a realistic but repeatable LLM
+latency. For each level it reports plan latency p50/p95/p99, plans per second, peak RSS and a
+per-node breakdown (wall time, LLM time and calls, parse/report/render phases) taken from the
+instrumentation layer. Each level runs in a fresh process, so peak RSS and warm-up are per level.
+
+Save a run, then compare a later commit against it:
+    python benchmarks/pipeline.py --output before.json
+    python benchmarks/pipeline.py --output after.json --compare before.json
+
+Run from the repository root:
+    python benchmarks/pipeline.py --concurrency 1 10 100 --median-ms 400
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import resource
+except ImportError:         # Windows
+    resource = None
+
+# Nodes computed locally by default; --all-llm asks the model for them as well.
+LOCAL_NODES = ('goal_class', 'routine_time', 'nutrient_need', 'meal_filter', 'calorie_macro_ai', 'pdf_generator')
+# Relative change in these that counts as a regression in --compare; the bool says whether higher is better.
+COMPARED = (('p50_s', False), ('p95_s', False), ('p99_s', False), ('plans_per_s', True), ('peak_rss_mb', False))
+# Node slowdowns smaller than this are not reported by --compare.
+NODE_NOISE_S = 0.001
+
+
+def profile(i: int) -> dict:
+    """
+    Returns the input state of plan i; plans differ a little so their prompts are not identical.
+    """
+    return {
+        'name': f'Patient {i}', 'age': 25 + i % 40, 'gender': ('FEMALE', 'MALE')[i % 2],
+        'height_m': 1.55 + (i % 30) / 100, 'weight_kg': 55 + i % 50, 'primary_goal': ('LOSE_WEIGHT', 'GAIN_WEIGHT', 'MAINTAIN_WEIGHT')[i % 3],
+        'diet_type': ('VEGETARIAN', 'NON_VEGETARIAN', 'VEGAN')[i % 3], 'allergies': [('peanuts', 'lactose', 'gluten')[i % 3]],
+        'medical_conditions': [('type 2 diabetes', 'hypertension', 'none')[i % 3]],
+        'activity_level_description': 'Desk job, walks 30 minutes most evenings and does yoga twice a week',
+        'wake_time': '06:30 AM', 'sleep_time': '10:30 PM', 'meal_frequency': 3 + i % 3,
+        'supper_snacks': ['fruit'], 'breakfast': ['poha', 'tea'], 'lunch': ['dal', 'rice'], 'dinner': ['roti', 'sabzi'],
+        'likes': ['lentils', 'mango'], 'dislikes': ['okra'], 'water_intake': 2.5,
+    }
+
+
+def percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def node_breakdown(nodes: dict) -> dict:
+    """
+    Reduces the instrumentation snapshot to per-execution averages for each node.
+    """
+    breakdown = {}
+    for node, entry in sorted(nodes.items()):
+        runs = entry['runs'] or 1
+        breakdown[node] = {
+            'runs': entry['runs'],
+            'wall_mean_s': entry['wall_seconds'] / runs,
+            'wall_p50_s': entry.get('wall', {}).get('p50'),
+            'wall_p95_s': entry.get('wall', {}).get('p95'),
+            'llm_calls': entry['llm_calls'] / runs,
+            'llm_s': entry['llm_seconds'] / runs,
+            'phases_s': {phase: seconds / runs for phase, seconds in entry['phase_seconds'].items()},
+            'errors': entry['errors'],
+        }
+    return breakdown
+
+
+def run_level(concurrency: int, plans: int, options: dict) -> dict:
+    """
+    Runs one concurrency level (in a child process) and returns its results.
+    """
+    # checkpoints of benchmark plans go to a scratch directory, dropped with the process
+    checkpoint_dir = tempfile.mkdtemp(prefix='bench-checkpoints-')
+    os.environ['DIET_CHECKPOINT_DIR'] = checkpoint_dir
+    from checkpoints import checkpoint_config
+    from fake_llm import FakeChatModel
+    from graph import get_workflow
+    from instrumentation import get_node_metrics
+    from pdf_render import get_render_pool
+    from resilience import get_call_metrics
+
+    llm = FakeChatModel(**options['llm'])
+    configurable = {'llm': llm, 'cache': False, 'llm_overrides': options['llm_overrides'], 'batching': options['batching']}
+    graph = get_workflow(async_mode=options['mode'] == 'async', fused=options['fused'], checkpoint=options['checkpoint'])
+
+    def config(i):
+        return checkpoint_config({'configurable': dict(configurable, thread_id=f'bench-{i}')})
+
+    async def run_async(indices):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                result = await graph.ainvoke(profile(i), config=config(i))
+                return time.perf_counter() - start, bool(result.get('diet_plan_pdf'))
+
+        return await asyncio.gather(*(one(i) for i in indices), return_exceptions=True)
+
+    def run_sync(indices):
+        def one(i):
+            start = time.perf_counter()
+            result = graph.invoke(profile(i), config=config(i))
+            return time.perf_counter() - start, bool(result.get('diet_plan_pdf'))
+
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            futures = [pool.submit(one, i) for i in indices]
+            return [future.exception() or future.result() for future in futures]
+
+    def run(indices):
+        return asyncio.run(run_async(indices)) if options['mode'] == 'async' else run_sync(indices)
+
+    # warm-up: imports, template compilation, render pool start-up
+    run(range(-min(concurrency, 4), 0))
+    get_node_metrics().reset()
+    get_call_metrics().reset()
+    llm.requests.clear()
+
+    start = time.perf_counter()
+    outcomes = run(range(plans))
+    wall = time.perf_counter() - start
+
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    latencies = sorted(outcome[0] for outcome in outcomes if isinstance(outcome, tuple) and outcome[1])
+    failed = len(outcomes) - len(latencies)
+    return {
+        'concurrency': concurrency,
+        'plans': plans,
+        'failed': failed,
+        'wall_s': wall,
+        'plans_per_s': len(latencies) / wall if wall else 0.0,
+        'p50_s': percentile(latencies, 0.50) if latencies else None,
+        'p95_s': percentile(latencies, 0.95) if latencies else None,
+        'p99_s': percentile(latencies, 0.99) if latencies else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'llm_requests': dict(llm.requests),
+        'pdf_backend': get_render_pool().backend.name,
+        'nodes': node_breakdown(get_node_metrics().snapshot()['nodes']),
+        'attempts': get_call_metrics().snapshot(),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list:
+    """
+    Prints each level's headline numbers next to the baseline's.
+
+    Returns:
+        list: "level metric" entries that got worse by more than tolerance.
+    """
+    regressions = []
+    print(f"\ncompared with {baseline['meta'].get('commit') or 'baseline'} (tolerance {tolerance:.0%})")
+    print(f"{'level':>6} {'metric':<12} {'baseline':>10} {'current':>10} {'change':>8}")
+    for level, result in current['levels'].items():
+        before = baseline['levels'].get(level)
+        if before is None:
+            continue
+        for metric, higher_is_better in COMPARED:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = '  REGRESSION' if worse > tolerance else ''
+            if flag:
+                regressions.append(f"{level} {metric}")
+            print(f"{level:>6} {metric:<12} {old:10.3f} {new:10.3f} {change:+8.1%}{flag}")
+        for node, entry in result['nodes'].items():
+            old = before['nodes'].get(node, {}).get('wall_mean_s')
+            if old and entry['wall_mean_s'] - old > NODE_NOISE_S and (entry['wall_mean_s'] - old) / old > tolerance:
+                print(f"{level:>6} {node:<20} mean wall {old * 1000:.1f} -> {entry['wall_mean_s'] * 1000:.1f} ms")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[1, 10, 100], help="Concurrent plans per level")
+    parser.add_argument("--plans", type=int, default=None, help="Plans per level (default: max(20, 2 x concurrency))")
+    parser.add_argument("--mode", choices=('async', 'sync'), default='async', help="Graph variant: ainvoke on one loop, or invoke on threads")
+    parser.add_argument("--fused", action="store_true", help="Use the fused profile_analysis node")
+    parser.add_argument("--all-llm", action="store_true", help="Ask the LLM for the nodes that are local by default")
+    parser.add_argument("--batching", action="store_true", help="Send calls through the micro-batcher")
+    parser.add_argument("--checkpoint", action="store_true", help="Compile the workflow with the SQLite checkpointer")
+    parser.add_argument("--median-ms", type=float, default=400, help="Median time to first token")
+    parser.add_argument("--sigma", type=float, default=0.35, help="Log-normal spread of the latency")
+    parser.add_argument("--tokens-per-s", type=float, default=250, help="Generation speed of the fake model")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of stalled requests")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of retryable 503 errors")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="Share of malformed JSON replies")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default="pipeline_results.json", help="Where to write the results")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative change reported as a regression")
+    args = parser.parse_args()
+
+    options = {
+        'mode': args.mode, 'fused': args.fused, 'batching': args.batching, 'checkpoint': args.checkpoint,
+        'llm_overrides': list(LOCAL_NODES) if args.all_llm else [],
+        'llm': {'median_ms': args.median_ms, 'sigma': args.sigma, 'tokens_per_s': args.tokens_per_s,
+                'slow_rate': args.slow_rate, 'error_rate': args.error_rate, 'invalid_rate': args.invalid_rate, 'seed': args.seed},
+    }
+    results = {
+        'meta': {'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+                 'cpus': os.cpu_count(), 'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'options': options},
+        'levels': {},
+    }
+
+    print(f"{'level':>6} {'plans':>6} {'failed':>6} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'plans/s':>8} {'peak MB':>8}")
+    context = multiprocessing.get_context('spawn')
+    for concurrency in args.concurrency:
+        plans = args.plans or max(20, 2 * concurrency)
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+            result = pool.submit(run_level, concurrency, plans, options).result()
+        results['levels'][str(concurrency)] = result
+        print(f"{concurrency:6d} {plans:6d} {result['failed']:6d} {result['p50_s'] or 0:7.2f} {result['p95_s'] or 0:7.2f} "
+              f"{result['p99_s'] or 0:7.2f} {result['plans_per_s']:8.2f} {result['peak_rss_mb'] or 0:8.1f}")
+
+    last = results['levels'][str(args.concurrency[-1])]
+    print(f"\nper node at concurrency {args.concurrency[-1]} (mean per execution)")
+    print(f"{'node':<20} {'wall ms':>8} {'p95 ms':>8} {'llm ms':>8} {'calls':>6}  phases")
+    for node, entry in last['nodes'].items():
+        phases = ', '.join(f"{phase} {seconds * 1000:.1f} ms" for phase, seconds in entry['phases_s'].items())
+        print(f"{node:<20} {entry['wall_mean_s'] * 1000:8.1f} {(entry['wall_p95_s'] or 0) * 1000:8.1f} "
+              f"{entry['llm_s'] * 1000:8.1f} {entry['llm_calls']:6.2f}  {phases}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        if regressions:
+            print(f"regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
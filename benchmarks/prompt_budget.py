@@ -0,0 +1,115 @@
+"""
+Checks the size of every node's prompt for a fixed profile against a recorded budget.
+
+Exits with status 1 when any prompt is larger than its entry in prompt_budget.json, so a
+change that makes prompts grow fails the check. After an intended change, record the new
+sizes with --update.
+
+Run from the repository root:
+    python benchmarks/prompt_budget.py            # compare with the budget
+    python benchmarks/prompt_budget.py --update   # record the current sizes
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import methods
+from prompts import estimate_tokens
+
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompt_budget.json')
+
+# A complete state as it looks when pdf_generator runs, so every prompt can be built from it.
+PROFILE = {
+    'name': 'Asha Rao', 'age': 34, 'gender': 'FEMALE', 'height_m': 1.62, 'weight_kg': 71, 'bmi': 27.1,
+    'primary_goal': 'LOSE_WEIGHT', 'diet_type': 'VEGETARIAN', 'allergies': ['peanuts', 'lactose'],
+    'medical_conditions': ['type 2 diabetes', 'hypothyroidism'],
+    'activity_level_description': 'Desk job, walks 30 minutes most evenings and does yoga twice a week',
+    'wake_time': '06:30 AM', 'sleep_time': '10:30 PM', 'meal_frequency': 4,
+    'supper_snacks': ['fruit', 'roasted chana'], 'breakfast': ['poha', 'tea'], 'lunch': ['dal', 'rice', 'sabzi'],
+    'dinner': ['roti', 'paneer curry'], 'likes': ['paneer', 'lentils', 'mango'], 'dislikes': ['bitter gourd', 'okra'],
+    'water_intake': '2.5 liters/day',
+    'goal_class': 'WEIGHT_LOSS', 'activity_level': 'LIGHT', 'protein_multiplier': 1.0,
+    'restrictions': ['no peanuts', 'lactose-free dairy', 'low glycemic index'],
+    'warnings': ['monitor blood sugar after meals', 'take thyroid medication 30-60 minutes before breakfast'],
+    'preferences': ['high-fibre', 'home-style Indian food'], 'avoid': ['refined sugar', 'fried snacks', 'white bread'],
+    'meal_schedule': {'breakfast': '07:15 AM', 'lunch': '12:45 PM', 'snack_1': '04:30 PM', 'dinner': '08:00 PM'},
+    'target_calories': 1550, 'macros_target': {'protein': 71, 'carbs': 190, 'fat': 48},
+    'micros_needed': ['fiber', 'calcium', 'vitamin D', 'iron', 'vitamin B12', 'iodine', 'selenium'],
+    'allowed_meals': ['moong dal chilla', 'besan chilla', 'vegetable upma', 'oats porridge with seeds', 'lentil soup',
+                      'quinoa salad with chickpeas', 'tofu stir fry with brown rice', 'rajma with brown rice',
+                      'palak tofu with roti', 'vegetable khichdi', 'roasted chickpeas', 'sprouts salad', 'fruit bowl'],
+    'meals': {
+        'breakfast': {'time': '07:15 AM', 'items': ['2 moong dal chilla', '1 cup mint chutney', '1 cup green tea'], 'calories': 380},
+        'lunch': {'time': '12:45 PM', 'items': ['1 cup rajma', '1 cup brown rice', '1 bowl cucumber salad'], 'calories': 520},
+        'snack_1': {'time': '04:30 PM', 'items': ['1 cup sprouts salad', '1 apple'], 'calories': 210},
+        'dinner': {'time': '08:00 PM', 'items': ['2 roti', '1 cup palak tofu', '1 cup vegetable soup'], 'calories': 440},
+    },
+    'total_calories': 1550, 'actual_macros': {'protein': 68, 'carbs': 201, 'fat': 45},
+    'recommendation': 'Calories within 1% of the target. Protein slightly low; add a serving of curd or tofu.',
+    'supplements': ['vitamin D3', 'vitamin B12', 'omega-3 (algal oil)'],
+    'notes': 'Check vitamin D and B12 levels in three months.',
+    'tips': ['Carry a water bottle to work', 'Walk 10 minutes after dinner', 'Keep a regular sleep schedule'],
+    'motivation': {'opening': 'Small steps every day.', 'closing': 'You have got this.'},
+}
+
+PROMPTS = {
+    'goal_class': methods._goal_class_prompt,
+    'medical_conditions': methods._medical_conditions_prompt,
+    'habits': methods._habits_prompt,
+    'activity_level': methods._activity_level_prompt,
+    'routine_time': methods._routine_time_prompt,
+    'nutrient_need': methods._nutrient_need_prompt,
+    'meal_filter': methods._meal_filter_prompt,
+    'personalized_meals': methods._personalized_meals_prompt,
+    'calorie_macro_ai': methods._calorie_macro_ai_prompt,
+    'supplement_advisor': methods._supplement_advisor_prompt,
+    'hydration_tips': methods._hydration_tips_prompt,
+    'motivation': methods._motivation_prompt,
+    'pdf_generator': methods._pdf_generator_prompt,
+    methods.FUSED_NODE: lambda state: methods._profile_analysis_prompt(state, list(methods.FUSED_SECTIONS)),
+}
+
+
+def measure() -> dict:
+    """
+    Returns {node: estimated prompt tokens} for the fixed profile.
+    """
+    return {node: estimate_tokens(build(PROFILE)) for node, build in PROMPTS.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="Record the current sizes as the budget")
+    parser.add_argument("--budget", default=BUDGET_PATH, help="Budget file")
+    args = parser.parse_args()
+
+    sizes = measure()
+    if args.update:
+        with open(args.budget, 'w', encoding='utf-8') as f:
+            json.dump(sizes, f, indent=2)
+            f.write('\n')
+        print(f"recorded {sum(sizes.values())} prompt tokens over {len(sizes)} prompts in {args.budget}")
+        return
+
+    with open(args.budget, encoding='utf-8') as f:
+        budget = json.load(f)
+    over = []
+    print(f"{'node':<20} {'tokens':>7} {'budget':>7}")
+    for node, tokens in sizes.items():
+        limit = budget.get(node)
+        flag = '' if limit is not None and tokens <= limit else '  OVER'
+        if flag:
+            over.append(node)
+        print(f"{node:<20} {tokens:7d} {limit if limit is not None else '-':>7}{flag}")
+    print(f"{'total':<20} {sum(sizes.values()):7d} {sum(budget.values()):7d}")
+    if over:
+        print(f"prompt budget exceeded for: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
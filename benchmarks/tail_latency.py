@@ -0,0 +1,113 @@
+"""
+Measures LLM call tail latency with and without retries and hedging, using an offline fake model.
+
+The fake model answers most requests quickly, but a fraction of them are slow (a stalled
+connection or a queued request) and a fraction fail with a retryable server error, which is
+what makes p99 so much worse than p50 against a hosted endpoint.
+
+Run from the repository root:
+    python benchmarks/tail_latency.py --calls 400 --slow-rate 0.03 --error-rate 0.03
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resilience import acall_with_policy, get_call_metrics
+
+
+class ServiceUnavailable(Exception):
+    """
+    Stands in for the provider's 503 error; retryable by class name.
+    """
+
+
+class FlakyChatModel:
+    """
+    Answers after a random delay: usually fast_ms, sometimes slow_ms, sometimes a 503.
+    """
+
+    def __init__(self, fast_ms: float, slow_ms: float, slow_rate: float, error_rate: float, seed: int):
+        self.fast_s = fast_ms / 1000.0
+        self.slow_s = slow_ms / 1000.0
+        self.slow_rate = slow_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+
+    async def ainvoke(self, prompt):
+        self.requests += 1
+        roll = self.random.random()
+        delay = self.slow_s if roll < self.slow_rate else self.fast_s * self.random.uniform(0.7, 1.3)
+        await asyncio.sleep(delay)
+        if self.random.random() < self.error_rate:
+            raise ServiceUnavailable("503 model overloaded")
+        return types.SimpleNamespace(content='{"ok": true}')
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(calls: int, concurrency: int, model: FlakyChatModel, resilience) -> tuple:
+    """
+    Sends the calls through acall_with_policy() and returns (latencies, failures).
+    """
+    config = {'configurable': {'resilience': resilience}}
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one(i):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await acall_with_policy('bench', lambda: model.ainvoke(f"prompt {i}"), config)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return latencies, failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=400, help="Calls per scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="Calls in flight at once")
+    parser.add_argument("--fast-ms", type=float, default=40, help="Typical latency")
+    parser.add_argument("--slow-ms", type=float, default=1500, help="Latency of a stalled request")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="Fraction of stalled requests")
+    parser.add_argument("--error-rate", type=float, default=0.03, help="Fraction of 503 errors")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    scenarios = [
+        ('single', False),
+        ('retry', {'timeout': 5.0, 'backoff': 0.05}),
+        ('retry+hedge', {'timeout': 5.0, 'backoff': 0.05, 'hedge': True}),
+    ]
+    print(f"{'scenario':<12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'failed':>7} {'requests':>9} {'hedges':>7}")
+    for name, resilience in scenarios:
+        get_call_metrics().reset()
+        model = FlakyChatModel(args.fast_ms, args.slow_ms, args.slow_rate, args.error_rate, args.seed)
+        if resilience and resilience.get('hedge'):
+            # hedging waits for the node's p95, so it needs a latency history first
+            asyncio.run(run(100, args.concurrency, model, resilience))
+            model.requests = 0
+        before = get_call_metrics().snapshot().get('bench', {}).get('hedges', 0)
+        latencies, failures = asyncio.run(run(args.calls, args.concurrency, model, resilience))
+        hedges = get_call_metrics().snapshot().get('bench', {}).get('hedges', 0) - before
+        print(f"{name:<12} {percentile(latencies, 0.50) * 1000:8.0f} {percentile(latencies, 0.95) * 1000:8.0f} "
+              f"{percentile(latencies, 0.99) * 1000:8.0f} {failures:7d} {model.requests:9d} {hedges:7d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Measures the per-request cost of building the workflow versus reusing the compiled registry entry.
+
+Run from the repository root:
+    python benchmarks/workflow_compile.py --requests 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import Get_workflow, clear_workflows, get_workflow, warm_up
+
+
+def time_calls(fn, requests: int) -> list[float]:
+    """
+    Calls fn the given number of times and returns the wall time of each call in milliseconds.
+    """
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summary(label: str, timings: list[float]) -> str:
+    ordered = sorted(timings)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    return f"{label:<22} mean={statistics.mean(ordered):8.3f} ms  p50={statistics.median(ordered):8.3f} ms  p95={p95:8.3f} ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100, help="Number of simulated requests")
+    args = parser.parse_args()
+
+    rebuild = time_calls(Get_workflow, args.requests)
+
+    clear_workflows()
+    start = time.perf_counter()
+    warm_up()
+    warm_up_ms = (time.perf_counter() - start) * 1000
+    cached = time_calls(get_workflow, args.requests)
+
+    print(summary("rebuild per request", rebuild))
+    print(summary("registry lookup", cached))
+    print(f"{'one-time warm-up':<22} {warm_up_ms:8.3f} ms")
+    print(f"{'saved per request':<22} {statistics.mean(rebuild) - statistics.mean(cached):8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_DIR = os.environ.get(
+    'DIET_CHECKPOINT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'checkpoints'),
+)
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+PRUNE_INTERVAL_SECONDS = 3600
+# bytes values from this size on (the PDF) are stored as blobs, not inside checkpoints
+BLOB_MIN_BYTES = 1024
+BLOB_REF = '__blob_sha256__'
+# configurable keys LangGraph would otherwise copy into every checkpoint's metadata
+SECRET_KEYS = ('api_key',)
+
+
+class BlobSerializer(JsonPlusSerializer):
+    """
+    Checkpoint serializer that keeps large bytes values out of the database.
+
+    Each one is written once to a content-addressed file, and the checkpoint holds a reference,
+    so snapshots stay a few kilobytes even after the PDF has been rendered.
+    """
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _put_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            # refresh the age, so prune() never drops a blob a live checkpoint still uses
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp, 'wb') as f:
+                f.write(data)
+            os.replace(temp, path)
+        return digest
+
+    def _get_blob(self, digest: str) -> bytes:
+        with open(self._path(digest), 'rb') as f:
+            return f.read()
+
+    def delete_blob(self, digest: str) -> None:
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+    def references(self, data: tuple) -> set:
+        """
+        Returns the digests of the blobs a serialized value refers to, without reading them.
+        """
+        found = set()
+
+        def walk(value):
+            if isinstance(value, dict):
+                if len(value) == 1 and BLOB_REF in value:
+                    found.add(value[BLOB_REF])
+                else:
+                    for item in value.values():
+                        walk(item)
+            elif isinstance(value, (list, tuple)):
+                for item in value:
+                    walk(item)
+
+        walk(super().loads_typed(data))
+        return found
+
+    def _externalize(self, value):
+        if isinstance(value, bytes) and len(value) >= BLOB_MIN_BYTES:
+            return {BLOB_REF: self._put_blob(value)}
+        if isinstance(value, dict):
+            return {key: self._externalize(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._externalize(item) for item in value)
+        return value
+
+    def _internalize(self, value):
+        if isinstance(value, dict):
+            if len(value) == 1 and BLOB_REF in value:
+                return self._get_blob(value[BLOB_REF])
+            return {key: self._internalize(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._internalize(item) for item in value)
+        return value
+
+    def dumps_typed(self, obj) -> tuple:
+        return super().dumps_typed(self._externalize(obj))
+
+    def loads_typed(self, data: tuple):
+        return self._internalize(super().loads_typed(data))
+
+
+class PlanCheckpointer(SqliteSaver):
+    """
+    SQLite checkpointer shared by every workflow variant in the process, keyed by run id (thread_id).
+
+    SqliteSaver is sync only; the async graph's calls run on a worker thread, which the saver's
+    own lock makes safe. Secrets such as the API key are left out of the stored metadata.
+    Deleting a run also deletes the blobs no other run refers to, and runs older than
+    DEFAULT_TTL_SECONDS are pruned in the background at most every PRUNE_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CHECKPOINT_DIR):
+        os.makedirs(directory, exist_ok=True)
+        # several processes (batch_cli workers) may share the file; wait for each other's writes
+        conn = sqlite3.connect(os.path.join(directory, 'checkpoints.sqlite3'), check_same_thread=False, timeout=30)
+        super().__init__(conn, serde=BlobSerializer(os.path.join(directory, 'blobs')))
+        self.directory = directory
+        # held while writing or deleting rows, so a blob is never deleted between another
+        # run serializing a reference to it and inserting that row
+        self._blob_lock = threading.RLock()
+        self._next_prune = 0.0
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        self._maybe_prune()
+        configurable = {key: value for key, value in config['configurable'].items() if key not in SECRET_KEYS}
+        with self._blob_lock:
+            return super().put(dict(config, configurable=configurable), checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=''):
+        with self._blob_lock:
+            super().put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id) -> None:
+        """
+        Deletes a run's checkpoints and writes, and the blobs only they referred to.
+        """
+        with self._blob_lock:
+            with self.cursor(transaction=False) as cur:
+                rows = cur.execute(
+                    'SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? '
+                    'UNION ALL SELECT type, value FROM writes WHERE thread_id = ?',
+                    (str(thread_id), str(thread_id)),
+                ).fetchall()
+            digests = set()
+            for row in rows:
+                if row[1] and BLOB_REF.encode('utf-8') in row[1]:
+                    digests |= self.serde.references(row)
+            super().delete_thread(thread_id)
+            for digest in digests:
+                if not self._referenced(digest):
+                    self.serde.delete_blob(digest)
+
+    def _referenced(self, digest: str) -> bool:
+        needle = digest.encode('utf-8')
+        with self.cursor(transaction=False) as cur:
+            return cur.execute(
+                'SELECT 1 FROM checkpoints WHERE instr(checkpoint, ?) > 0 '
+                'UNION ALL SELECT 1 FROM writes WHERE instr(value, ?) > 0 LIMIT 1',
+                (needle, needle),
+            ).fetchone() is not None
+
+    def _maybe_prune(self) -> None:
+        now = time.monotonic()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + PRUNE_INTERVAL_SECONDS
+        threading.Thread(target=self._prune_quietly, name='checkpoint-prune', daemon=True).start()
+
+    def _prune_quietly(self) -> None:
+        try:
+            self.prune()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("could not prune old checkpoints: %s", e)
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        tuples = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in tuples:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=''):
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def prune(self, max_age: float = DEFAULT_TTL_SECONDS) -> int:
+        """
+        Deletes runs whose last checkpoint is older than max_age, and blobs no newer than that.
+
+        Args:
+            max_age (float): Age in seconds after which a run can no longer be resumed.
+
+        Returns:
+            int: The number of runs deleted.
+        """
+        cutoff = time.time() - max_age
+        with self.cursor(transaction=False) as cur:
+            threads = [row[0] for row in cur.execute('SELECT DISTINCT thread_id FROM checkpoints')]
+        stale = []
+        for thread_id in threads:
+            latest = self.get_tuple({'configurable': {'thread_id': thread_id}})
+            if latest is None or datetime.fromisoformat(latest.checkpoint['ts']).timestamp() < cutoff:
+                stale.append(thread_id)
+        for thread_id in stale:
+            self.delete_thread(thread_id)
+
+        for root, _, files in os.walk(self.serde.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+        logger.info("pruned %d checkpointed runs older than %.0fs", len(stale), max_age)
+        return len(stale)
+
+
+_CHECKPOINTER = None
+_CHECKPOINTER_LOCK = threading.Lock()
+
+
+def get_checkpointer() -> PlanCheckpointer:
+    """
+    Returns the process-wide checkpointer.
+    """
+    global _CHECKPOINTER
+    if _CHECKPOINTER is None:
+        with _CHECKPOINTER_LOCK:
+            if _CHECKPOINTER is None:
+                _CHECKPOINTER = PlanCheckpointer()
+    return _CHECKPOINTER
+
+
+def checkpoint_config(config: dict) -> dict:
+    """
+    Returns a copy of a run config with a configurable "thread_id", the id its checkpoints (and
+    trace) are kept under; a new one when the config has none. LangChain's own top-level "run_id"
+    (a UUID) is left alone.
+
+    Args:
+        config (dict): The run config.
+
+    Returns:
+        dict: The config with configurable["thread_id"] set.
+    """
+    config = dict(config or {})
+    configurable = dict(config.get('configurable') or {})
+    configurable['thread_id'] = str(configurable.get('thread_id') or uuid.uuid4().hex)
+    config['configurable'] = configurable
+    return config
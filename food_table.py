@@ -0,0 +1,272 @@
+import csv
+import difflib
+import functools
+import os
+import re
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+
+FOOD_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'food_composition.csv')
+
+# Column order of FoodTable.per_100g.
+NUTRIENTS = ('kcal', 'protein', 'carbs', 'fat')
+
+# Household measures converted to grams; counted units ("2 slices", "1 piece") use the food's serving size.
+UNIT_GRAMS = {
+    'g': 1.0, 'gm': 1.0, 'gms': 1.0, 'gram': 1.0, 'grams': 1.0, 'kg': 1000.0,
+    'ml': 1.0, 'l': 1000.0, 'oz': 28.35,
+    'cup': 200.0, 'cups': 200.0, 'glass': 250.0, 'glasses': 250.0, 'bowl': 250.0, 'bowls': 250.0,
+    'tbsp': 15.0, 'tablespoon': 15.0, 'tablespoons': 15.0, 'tsp': 5.0, 'teaspoon': 5.0, 'teaspoons': 5.0,
+    'scoop': 30.0, 'scoops': 30.0, 'handful': 28.0,
+}
+COUNT_WORDS = {'a': 1.0, 'an': 1.0, 'one': 1.0, 'two': 2.0, 'three': 3.0, 'four': 4.0, 'half': 0.5}
+FRACTIONS = {'½': '1/2', '¼': '1/4', '¾': '3/4', '⅓': '1/3', '⅔': '2/3'}
+
+# Composite items ("toast with butter", "rice and lentils") are resolved component by component.
+_COMPONENT_SPLIT = re.compile(r'\s*(?:,|&|\+|\bwith\b|\band\b)\s*')
+_WEIGHT = re.compile(r'(\d+(?:\.\d+)?)\s*(kg|gms|gm|grams|gram|g|ml|l|oz)\b')
+_LEADING_AMOUNT = re.compile(
+    r'^\s*(\d+(?:\.\d+)?(?:\s*/\s*\d+)?|' + '|'.join(COUNT_WORDS) + r')\b\s*'
+    r'(' + '|'.join(sorted(UNIT_GRAMS, key=len, reverse=True)) + r')?\b\s*(?:of\s+)?'
+)
+
+
+class FoodTable(NamedTuple):
+    names: list
+    aliases: dict
+    per_100g: np.ndarray
+    serving_g: np.ndarray
+
+
+_TABLE = None
+_TABLE_LOCK = threading.Lock()
+
+
+def _normalize(name: str) -> str:
+    name = re.sub(r'\([^)]*\)', ' ', name.lower())
+    return re.sub(r'[^a-z]+', ' ', name).strip()
+
+
+def load_table(path: str = FOOD_TABLE_PATH) -> FoodTable:
+    """
+    Loads the bundled food-composition table into NumPy arrays, once per process.
+
+    Returns:
+        FoodTable: Food names, an alias -> row index map, per-100 g nutrients (kcal, protein, carbs, fat)
+        and the typical serving size of every row.
+    """
+    global _TABLE
+    if _TABLE is not None:
+        return _TABLE
+
+    with _TABLE_LOCK:
+        if _TABLE is None:
+            names, aliases, values, servings = [], {}, [], []
+            with open(path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    index = len(names)
+                    names.append(row['name'])
+                    for alias in [row['name']] + row['aliases'].split('|'):
+                        if alias.strip():
+                            aliases.setdefault(_normalize(alias), index)
+                    values.append([float(row[n]) for n in NUTRIENTS])
+                    servings.append(float(row['serving_g']))
+            _TABLE = FoodTable(names, aliases, np.array(values), np.array(servings))
+    return _TABLE
+
+
+@functools.lru_cache(maxsize=4096)
+def resolve_food(name: str) -> int:
+    """
+    Finds the table row for a free-text food name.
+
+    Tries an exact alias match, then the longest run of words that is a known alias (so
+    "grilled chicken breast with lemon" finds "grilled chicken breast"), then a close spelling match.
+
+    Args:
+        name (str): The food name without quantity, e.g. "boiled eggs".
+
+    Returns:
+        int: The row index, or -1 when nothing matches.
+    """
+    table = load_table()
+    name = _normalize(name)
+    if not name:
+        return -1
+    if name in table.aliases:
+        return table.aliases[name]
+
+    words = name.split()
+    for size in range(len(words), 0, -1):
+        for start in range(len(words) - size + 1):
+            phrase = ' '.join(words[start:start + size])
+            for candidate in (phrase, phrase.rstrip('s')):
+                if candidate in table.aliases:
+                    return table.aliases[candidate]
+
+    close = difflib.get_close_matches(name, table.aliases.keys(), n=1, cutoff=0.8)
+    return table.aliases[close[0]] if close else -1
+
+
+def parse_item(item: str) -> tuple:
+    """
+    Splits a meal item such as "2 boiled eggs", "1 cup brown rice" or "Grilled chicken (150g)" into
+    a food name and an amount.
+
+    Returns:
+        tuple: (name, grams, servings). grams is None when the amount is a count of servings.
+    """
+    text = str(item).lower()
+    for symbol, fraction in FRACTIONS.items():
+        text = text.replace(symbol, fraction)
+
+    weight = _WEIGHT.search(text)
+    if weight:
+        grams = float(weight.group(1)) * UNIT_GRAMS[weight.group(2)]
+        text = text[:weight.start()] + text[weight.end():]
+        return text, grams, None
+
+    amount = _LEADING_AMOUNT.match(text)
+    if not amount or not amount.group(0).strip():
+        return text, None, 1.0
+
+    quantity = amount.group(1)
+    if quantity in COUNT_WORDS:
+        count = COUNT_WORDS[quantity]
+    elif '/' in quantity:
+        numerator, denominator = quantity.split('/')
+        count = float(numerator) / float(denominator)
+    else:
+        count = float(quantity)
+
+    name = text[amount.end():]
+    unit = amount.group(2)
+    if unit:
+        return name, count * UNIT_GRAMS[unit], None
+    return name, None, count
+
+
+def _meal_items(meals) -> list:
+    """
+    Flattens the meals dict returned by personalized_meals into (meal name, items, stated calories).
+    """
+    flat = []
+    for meal, details in (meals or {}).items():
+        if isinstance(details, dict):
+            items, calories = details.get('items') or [], details.get('calories')
+        elif isinstance(details, list):
+            items, calories = [], 0
+            for entry in details:
+                if isinstance(entry, dict):
+                    items += entry.get('items') or [entry.get('name', '')]
+                    calories += entry.get('calories') or 0
+                else:
+                    items.append(entry)
+        else:
+            items, calories = [details], None
+        if isinstance(items, str):
+            items = [items]
+        flat.append((meal, [str(i) for i in items], calories))
+    return flat
+
+
+def meal_totals(meals: dict) -> dict:
+    """
+    Adds up calories and macros for a meal plan from the food-composition table.
+
+    Every item is resolved once, then all items are summed in one vectorized pass. Items that
+    cannot be resolved are reported; for their meal the calories the plan stated are kept when
+    they exceed what the resolved items account for.
+
+    Args:
+        meals (dict): Meal name -> {"time", "items", "calories"} as produced by personalized_meals.
+
+    Returns:
+        dict: {"total_calories": int, "actual_macros": {"protein", "carbs", "fat"} in grams,
+        "per_meal": {meal: {"calories": int, ...}}, "unresolved": [item, ...]}
+    """
+    table = load_table()
+    flat = _meal_items(meals)
+
+    rows, grams, owners, unresolved = [], [], [], []
+    for position, (meal, items, _) in enumerate(flat):
+        for item in items:
+            name, weight, servings = parse_item(item)
+            components = [part for part in _COMPONENT_SPLIT.split(name) if part.strip()] or [name]
+            matched = [resolve_food(part) for part in components]
+            if all(row < 0 for row in matched):
+                unresolved.append(item)
+                continue
+            # the stated amount belongs to the main (first) component; the rest count as one serving
+            for i, row in enumerate(matched):
+                if row < 0:
+                    continue
+                if i == 0 and weight is not None:
+                    grams.append(weight)
+                else:
+                    grams.append((servings if i == 0 else 1.0) * table.serving_g[row])
+                rows.append(row)
+                owners.append(position)
+
+    per_meal = np.zeros((len(flat), len(NUTRIENTS)))
+    if rows:
+        amounts = table.per_100g[np.array(rows)] * (np.array(grams) / 100.0)[:, None]
+        np.add.at(per_meal, np.array(owners), amounts)
+
+    # unresolved items keep whatever energy the plan stated for their meal beyond the resolved part
+    unresolved_set = set(unresolved)
+    for position, (_, items, stated) in enumerate(flat):
+        if stated and any(item in unresolved_set for item in items):
+            per_meal[position, 0] = max(per_meal[position, 0], float(stated))
+
+    totals = per_meal.sum(axis=0)
+    return {
+        'total_calories': int(round(totals[0])),
+        'actual_macros': {nutrient: int(round(totals[i])) for i, nutrient in enumerate(NUTRIENTS) if i},
+        'per_meal': {
+            meal: {nutrient if i else 'calories': int(round(per_meal[position, i])) for i, nutrient in enumerate(NUTRIENTS)}
+            for position, (meal, _, _) in enumerate(flat)
+        },
+        'unresolved': unresolved,
+    }
+
+
+def compare_with_targets(totals: dict, target_calories, macros_target: dict, tolerance: float = 0.10) -> str:
+    """
+    Writes a short recommendation comparing a plan's totals with its targets.
+
+    Args:
+        totals (dict): Output of meal_totals().
+        target_calories (int): The daily calorie target.
+        macros_target (dict): Target grams for protein, carbs and fat.
+        tolerance (float): Relative deviation accepted without comment.
+
+    Returns:
+        str: The recommendation.
+    """
+    notes = []
+    checks = [('calories', totals['total_calories'], target_calories, 'kcal')]
+    checks += [(macro, totals['actual_macros'].get(macro, 0), (macros_target or {}).get(macro), 'g')
+               for macro in ('protein', 'carbs', 'fat')]
+
+    for label, actual, target, unit in checks:
+        try:
+            target = float(target)
+        except (TypeError, ValueError):
+            continue
+        if target <= 0:
+            continue
+        deviation = (actual - target) / target
+        if abs(deviation) > tolerance:
+            direction = 'above' if deviation > 0 else 'below'
+            action = 'reduce' if deviation > 0 else 'increase'
+            notes.append(f"{label.capitalize()}: {actual} {unit}, {abs(deviation):.0%} {direction} the target of {target:.0f} {unit}; {action} portions accordingly.")
+
+    if not notes:
+        notes.append(f"The meal plan is within {tolerance:.0%} of the calorie and macronutrient targets.")
+    if totals['unresolved']:
+        notes.append(f"Nutrient values could not be verified for: {', '.join(totals['unresolved'])}.")
+    return ' '.join(notes)
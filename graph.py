@@ -1,68 +1,193 @@
-from langgraph.graph import StateGraph, START, END
-from methods import *
-
-
-
-def Get_workflow():
-    """
-    This function returns the workflow of the graph.
-    """
-
-    graph= StateGraph(Dietplan_State, start=START, end=END)
-    
-    # adding the nodes
-    graph.add_node('goal_class', goal_class)
-    graph.add_node('medical_conditions', medical_conditions)
-    graph.add_node('habits', habits)
-    graph.add_node('activity_level', activity_level)
-    graph.add_node('routine_time', routine_time)
-    graph.add_node('nutrient_need', nutrient_need)
-    graph.add_node('meal_filter', meal_filter)
-    graph.add_node('personalized_meals', personalized_meals)
-    graph.add_node('calorie_macro_ai', calorie_macro_ai)
-    graph.add_node('supplement_advisor', supplement_advisor)
-    graph.add_node('hydration_tips', hydration_tips)
-    graph.add_node('pdf_generator', pdf_generator)
-    
-    
-    # add the edges
-    graph.add_edge(START, 'goal_class')
-    graph.add_edge(START, 'medical_conditions')
-    graph.add_edge(START, 'habits')
-    graph.add_edge(START, 'activity_level')
-    graph.add_edge(START, 'routine_time')
-    
-    # Parallel preprocessors → Nutrient Need and Meal Filter
-    graph.add_edge('goal_class', 'nutrient_need')
-    graph.add_edge('medical_conditions', 'meal_filter')
-    graph.add_edge('habits', 'meal_filter')
-    graph.add_edge('activity_level', 'nutrient_need')
-    graph.add_edge('routine_time', 'meal_filter')
-    
-    # Nutrient Need → Personalized Meals
-    graph.add_edge('nutrient_need', 'personalized_meals')
-    
-    # Meal Filter → Personalized Meals
-    graph.add_edge('meal_filter', 'personalized_meals')
-    
-    # Personalized Meals → Calorie & Macro AI
-    graph.add_edge('personalized_meals', 'calorie_macro_ai')
-    
-    # Calorie & Macro AI → Supplement Advisor
-    graph.add_edge('calorie_macro_ai', 'supplement_advisor')
-    
-    # Supplement Advisor → Hydration & Tips
-    graph.add_edge('supplement_advisor', 'hydration_tips')
-    
-    # Hydration & Tips → PDF Generator
-    graph.add_edge('hydration_tips', 'pdf_generator')
-    
-    # PDF Generator → Final Output
-    graph.add_edge('pdf_generator', END)
-
-        
-
-    return graph.compile()
-
-
-
+import logging
+import threading
+
+from langgraph.graph import StateGraph, START, END
+from methods import *
+from checkpoints import get_checkpointer
+from instrumentation import instrument_node
+
+
+logger = logging.getLogger(__name__)
+
+
+
+def infer_dependencies(node_io: dict) -> dict:
+    """
+    Derives the minimal set of upstream nodes for every node from the state keys it reads and writes.
+
+    Args:
+        node_io (dict): Node name -> {"reads": (...), "writes": (...)}.
+
+    Returns:
+        dict: Node name -> set of node names that must finish before it runs. Keys that no node
+        writes are user inputs and add no dependency.
+    """
+    writers = {}
+    for name, io in node_io.items():
+        for key in io['writes']:
+            if key in writers:
+                raise ValueError(f"State key '{key}' is written by both '{writers[key]}' and '{name}'.")
+            writers[key] = name
+
+    direct = {
+        name: {writers[key] for key in io['reads'] if key in writers and writers[key] != name}
+        for name, io in node_io.items()
+    }
+
+    # ancestors in topological order; a cycle means two nodes wait on each other forever
+    ancestors = {}
+    visiting = set()
+
+    def collect(name):
+        if name in ancestors:
+            return ancestors[name]
+        if name in visiting:
+            raise ValueError(f"Node '{name}' depends on its own output.")
+        visiting.add(name)
+        found = set()
+        for dep in direct[name]:
+            found |= {dep} | collect(dep)
+        visiting.discard(name)
+        ancestors[name] = found
+        return found
+
+    for name in direct:
+        collect(name)
+
+    # transitive reduction: drop an edge when another dependency already implies it
+    return {
+        name: {dep for dep in deps if not any(dep in ancestors[other] for other in deps if other != dep)}
+        for name, deps in direct.items()
+    }
+
+
+def critical_path(dependencies: dict, node_io: dict) -> list:
+    """
+    Finds the chain of nodes with the most LLM round-trips, which bounds the latency of a plan.
+
+    Args:
+        dependencies (dict): Output of infer_dependencies().
+        node_io (dict): Node name -> {"llm": bool, ...}.
+
+    Returns:
+        list: Node names along the critical path, from START to END.
+    """
+    best = {}
+
+    def longest(name):
+        if name not in best:
+            cost, path = 0, []
+            for dep in sorted(dependencies[name]):
+                dep_cost, dep_path = longest(dep)
+                if dep_cost > cost or not path:
+                    cost, path = dep_cost, dep_path
+            best[name] = (cost + int(node_io[name]['llm']), path + [name])
+        return best[name]
+
+    return max((longest(name) for name in dependencies), key=lambda item: item[0])[1]
+
+
+
+def Get_workflow(async_mode: bool = False, fused: bool = False, checkpoint: bool = False):
+    """
+    This function returns the workflow of the graph.
+
+    Args:
+        async_mode (bool): Use the async node variants, so the graph runs on an event loop via ainvoke/astream.
+        fused (bool): Replace goal_class, medical_conditions, habits, activity_level and routine_time
+            with the single profile_analysis node, which asks for all of them in one LLM call.
+        checkpoint (bool): Checkpoint every step in the process-wide SQLite checkpointer (see
+            checkpoints.py), so a failed run can be resumed. Runs then need a configurable
+            "thread_id"; the runner sets one with checkpoints.checkpoint_config().
+
+    Every node is wrapped by instrumentation.instrument_node(), which records its wall time, LLM
+    calls, tokens, cache hits and errors.
+    """
+
+    graph= StateGraph(Dietplan_State, start=START, end=END)
+
+    nodes, node_io = NODES, NODE_IO
+    if fused:
+        nodes = {FUSED_NODE: (profile_analysis, aprofile_analysis)}
+        nodes.update((name, pair) for name, pair in NODES.items() if name not in FUSED_SECTIONS)
+        node_io = {name: NODE_IO.get(name, FUSED_NODE_IO) for name in nodes}
+    
+    # adding the nodes
+    for name, (node, anode) in nodes.items():
+        graph.add_node(name, instrument_node(name, anode if async_mode else node))
+    
+    
+    # add the edges, derived from what each node reads and writes
+    dependencies = infer_dependencies(node_io)
+    dependents = {name for deps in dependencies.values() for name in deps}
+    for name, deps in dependencies.items():
+        if not deps:
+            graph.add_edge(START, name)
+        elif len(deps) == 1:
+            graph.add_edge(next(iter(deps)), name)
+        else:
+            # a list of sources waits for all of them before the node runs
+            graph.add_edge(sorted(deps), name)
+        if name not in dependents:
+            graph.add_edge(name, END)
+
+    path = critical_path(dependencies, node_io)
+    logger.info("critical path (%d LLM calls): %s", sum(node_io[n]['llm'] for n in path), ' → '.join(path))
+
+    return graph.compile(checkpointer=get_checkpointer() if checkpoint else None)
+
+
+
+# Compiled workflows are immutable and hold no per-run state, so one instance
+# per variant can serve every session in the process concurrently.
+_WORKFLOWS = {}
+_WORKFLOWS_LOCK = threading.Lock()
+
+
+def _workflow_key(options: dict) -> tuple:
+    """
+    Builds a hashable registry key from the keyword options of Get_workflow().
+    """
+    return tuple(sorted(options.items()))
+
+
+def get_workflow(**options):
+    """
+    Returns the compiled workflow for the given variant, building it only once per process.
+
+    Args:
+        **options: Keyword arguments forwarded to Get_workflow() on the first call.
+
+    Returns:
+        CompiledStateGraph: The shared compiled workflow.
+    """
+    key = _workflow_key(options)
+    workflow = _WORKFLOWS.get(key)
+    if workflow is not None:
+        return workflow
+
+    with _WORKFLOWS_LOCK:
+        workflow = _WORKFLOWS.get(key)
+        if workflow is None:
+            workflow = Get_workflow(**options)
+            _WORKFLOWS[key] = workflow
+    return workflow
+
+
+def warm_up(*variants: dict) -> None:
+    """
+    Compiles the given workflow variants ahead of the first request.
+
+    Args:
+        *variants (dict): Option sets to compile. The default variant is used when none are given.
+    """
+    for options in variants or ({},):
+        get_workflow(**options)
+
+
+def clear_workflows() -> None:
+    """
+    Drops every compiled workflow from the registry (e.g. after reloading node code).
+    """
+    with _WORKFLOWS_LOCK:
+        _WORKFLOWS.clear()
@@ -0,0 +1,618 @@
+import contextvars
+import cProfile
+import functools
+import inspect
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the node and plan wall-time histograms in the Prometheus output.
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DURATION_WINDOW = 500           # recent samples kept per node for the JSON percentiles
+TRACE_DIR = os.environ.get('DIET_TRACE_DIR')
+
+
+def _percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+class NodeSpan:
+    """
+    What one node execution spent: wall time, LLM time and calls, named phases (parse, report,
+    render), prompt/completion tokens, response-cache hits and misses, and handled errors.
+
+    Calls and phases are also kept as timed events for the run's trace file.
+    """
+
+    def __init__(self, node: str, plan=None):
+        self.node = node
+        self.plan = plan
+        self.started = time.perf_counter()
+        self.wall_seconds = 0.0
+        self.llm_seconds = 0.0
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.phases = defaultdict(float)
+        self.errors = defaultdict(int)
+        self.failed = False
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add_phase(self, phase: str, started: float, seconds: float) -> None:
+        with self._lock:
+            self.phases[phase] += seconds
+            self.events.append(('phase', phase, started, seconds))
+
+    def add_llm_call(self, node: str, prompt_tokens: int, completion_tokens: int, seconds: float) -> None:
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_seconds += seconds
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.events.append(('llm', node or self.node, time.perf_counter() - seconds, seconds))
+
+    def add_cache_lookup(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def add_error(self, kind: str) -> None:
+        with self._lock:
+            self.errors[kind] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                'wall_seconds': self.wall_seconds,
+                'llm_seconds': self.llm_seconds,
+                'llm_calls': self.llm_calls,
+                'phase_seconds': dict(self.phases),
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'errors': dict(self.errors),
+                'failed': self.failed,
+            }
+
+
+class PlanTrace:
+    """
+    Collects the spans of one workflow run and writes them as a trace file.
+
+    The file is JSON in the Chrome trace-event format, so it opens in chrome://tracing or
+    Perfetto as one lane per node with its LLM calls and phases nested inside; the per-node
+    summaries and plan totals are stored alongside.
+    """
+
+    def __init__(self, run_id: str = None):
+        self.run_id = run_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.wall_seconds = 0.0
+        self.failed = False
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span: NodeSpan) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> dict:
+        """
+        Returns {"run_id", "wall_seconds", "failed", "nodes": {node: span summary}, "totals": {...}}.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        nodes = {span.node: span.summary() for span in spans}
+        totals = defaultdict(int)
+        for summary in nodes.values():
+            for key in ('llm_seconds', 'llm_calls', 'prompt_tokens', 'completion_tokens', 'cache_hits', 'cache_misses'):
+                totals[key] += summary[key]
+            totals['errors'] += sum(summary['errors'].values())
+        return {'run_id': self.run_id, 'wall_seconds': self.wall_seconds, 'failed': self.failed, 'nodes': nodes, 'totals': dict(totals)}
+
+    def trace_events(self) -> list:
+        with self._lock:
+            spans = list(self.spans)
+        lanes, events = {}, []
+        for span in sorted(spans, key=lambda s: s.started):
+            lane = lanes.setdefault(span.node, len(lanes) + 1)
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': lane, 'args': {'name': span.node}})
+            events.append({
+                'name': span.node, 'cat': 'node', 'ph': 'X', 'pid': 1, 'tid': lane,
+                'ts': (span.started - self.started) * 1e6, 'dur': span.wall_seconds * 1e6, 'args': span.summary(),
+            })
+            with span._lock:
+                nested = list(span.events)
+            for category, name, started, seconds in nested:
+                events.append({
+                    'name': name, 'cat': category, 'ph': 'X', 'pid': 1, 'tid': lane,
+                    'ts': (started - self.started) * 1e6, 'dur': seconds * 1e6,
+                })
+        return events
+
+    def write(self, directory: str) -> str:
+        """
+        Writes <directory>/<run_id>.trace.json and returns its path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.run_id}.trace.json")
+        document = self.summary()
+        document['started_at'] = self.started_at
+        document['traceEvents'] = self.trace_events()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(document, f, default=str)
+        return path
+
+
+class NodeMetrics:
+    """
+    Process-wide aggregates of every node execution and plan, for the JSON and Prometheus snapshots.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes = defaultdict(lambda: {
+            'runs': 0, 'failures': 0, 'wall_seconds': 0.0, 'llm_seconds': 0.0, 'llm_calls': 0,
+            'prompt_tokens': 0, 'completion_tokens': 0, 'cache_hits': 0, 'cache_misses': 0,
+            'phase_seconds': defaultdict(float), 'errors': defaultdict(int),
+            'buckets': [0] * len(DURATION_BUCKETS),
+        })
+        self._durations = defaultdict(lambda: deque(maxlen=DURATION_WINDOW))
+        self._plans = {'runs': 0, 'failures': 0, 'wall_seconds': 0.0, 'buckets': [0] * len(DURATION_BUCKETS)}
+
+    @staticmethod
+    def _bucket(buckets: list, seconds: float) -> None:
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+
+    def record_span(self, span: NodeSpan) -> None:
+        summary = span.summary()
+        with self._lock:
+            entry = self._nodes[span.node]
+            entry['runs'] += 1
+            entry['failures'] += int(summary['failed'])
+            for key in ('wall_seconds', 'llm_seconds', 'llm_calls', 'prompt_tokens', 'completion_tokens', 'cache_hits', 'cache_misses'):
+                entry[key] += summary[key]
+            for phase, seconds in summary['phase_seconds'].items():
+                entry['phase_seconds'][phase] += seconds
+            for kind, count in summary['errors'].items():
+                entry['errors'][kind] += count
+            self._bucket(entry['buckets'], summary['wall_seconds'])
+            self._durations[span.node].append(summary['wall_seconds'])
+
+    def record_plan(self, plan: PlanTrace) -> None:
+        with self._lock:
+            self._plans['runs'] += 1
+            self._plans['failures'] += int(plan.failed)
+            self._plans['wall_seconds'] += plan.wall_seconds
+            self._bucket(self._plans['buckets'], plan.wall_seconds)
+
+    def snapshot(self) -> dict:
+        """
+        Returns {"nodes": {node: totals plus wall-time mean/p50/p95/max}, "plans": {...}}.
+        """
+        with self._lock:
+            nodes = {}
+            for node, entry in self._nodes.items():
+                nodes[node] = {key: value for key, value in entry.items() if key != 'buckets'}
+                nodes[node]['phase_seconds'] = dict(entry['phase_seconds'])
+                nodes[node]['errors'] = dict(entry['errors'])
+                ordered = sorted(self._durations[node])
+                if ordered:
+                    nodes[node]['wall'] = {
+                        'mean': sum(ordered) / len(ordered), 'p50': _percentile(ordered, 0.50),
+                        'p95': _percentile(ordered, 0.95), 'max': ordered[-1],
+                    }
+            plans = {key: value for key, value in self._plans.items() if key != 'buckets'}
+        return {'nodes': nodes, 'plans': plans}
+
+    def prometheus(self) -> str:
+        """
+        Renders the aggregates in the Prometheus text exposition format.
+        """
+        with self._lock:
+            nodes = {node: dict(entry, buckets=list(entry['buckets']), phase_seconds=dict(entry['phase_seconds']), errors=dict(entry['errors']))
+                     for node, entry in self._nodes.items()}
+            plans = dict(self._plans, buckets=list(self._plans['buckets']))
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+        def histogram(name, help_text, series):
+            samples = []
+            for labels, entry in series:
+                for bound, count in zip(DURATION_BUCKETS, entry['buckets']):
+                    samples.append(({**labels, 'le': bound}, count))
+                samples.append(({**labels, 'le': '+Inf'}, entry['runs']))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, value in samples:
+                lines.append(f"{name}_bucket{_labels(labels)} {value}")
+            for labels, entry in series:
+                lines.append(f"{name}_sum{_labels(labels)} {entry['wall_seconds']}")
+                lines.append(f"{name}_count{_labels(labels)} {entry['runs']}")
+
+        ordered = sorted(nodes.items())
+        histogram('diet_node_duration_seconds', 'Wall time of node executions.',
+                  [({'node': node}, entry) for node, entry in ordered])
+        metric('diet_node_failures_total', 'counter', 'Node executions that raised.',
+               [({'node': node}, entry['failures']) for node, entry in ordered])
+        metric('diet_node_llm_seconds_total', 'counter', 'Time spent waiting for LLM replies.',
+               [({'node': node}, entry['llm_seconds']) for node, entry in ordered])
+        metric('diet_node_llm_calls_total', 'counter', 'LLM calls made.',
+               [({'node': node}, entry['llm_calls']) for node, entry in ordered])
+        metric('diet_node_phase_seconds_total', 'counter', 'Time spent in parsing, report and render phases.',
+               [({'node': node, 'phase': phase}, seconds) for node, entry in ordered for phase, seconds in sorted(entry['phase_seconds'].items())])
+        metric('diet_node_tokens_total', 'counter', 'Estimated prompt and completion tokens.',
+               [({'node': node, 'kind': kind}, entry[f'{kind}_tokens']) for node, entry in ordered for kind in ('prompt', 'completion')])
+        metric('diet_node_cache_lookups_total', 'counter', 'Response-cache lookups by result.',
+               [({'node': node, 'result': result}, entry[f'cache_{result}']) for node, entry in ordered for result in ('hits', 'misses')])
+        metric('diet_node_errors_total', 'counter', 'Errors handled inside nodes, by kind.',
+               [({'node': node, 'kind': kind}, count) for node, entry in ordered for kind, count in sorted(entry['errors'].items())])
+        histogram('diet_plan_duration_seconds', 'Wall time of whole workflow runs.', [({}, plans)])
+        metric('diet_plan_failures_total', 'counter', 'Workflow runs that raised.', [({}, plans['failures'])])
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        with self._lock:
+            self._nodes.clear()
+            self._durations.clear()
+            self._plans.update(runs=0, failures=0, wall_seconds=0.0, buckets=[0] * len(DURATION_BUCKETS))
+
+
+_METRICS = NodeMetrics()
+_SPAN = contextvars.ContextVar('node_span', default=None)
+_PLAN = contextvars.ContextVar('plan_trace', default=None)
+
+
+def get_node_metrics() -> NodeMetrics:
+    return _METRICS
+
+
+def current_span() -> NodeSpan:
+    """
+    Returns the span of the node running in this context, or None outside a node.
+    """
+    return _SPAN.get()
+
+
+# ---- recording hooks (no-ops outside an instrumented node) --------------
+
+
+def record_llm_call(node: str, prompt_tokens: int, completion_tokens: int, seconds: float) -> None:
+    span = _SPAN.get()
+    if span is not None:
+        span.add_llm_call(node, prompt_tokens, completion_tokens, seconds)
+
+
+def record_cache_lookup(hit: bool) -> None:
+    span = _SPAN.get()
+    if span is not None:
+        span.add_cache_lookup(hit)
+
+
+def record_error(kind: str) -> None:
+    """
+    Counts an error a node recovered from, e.g. "invalid_reply" or "fallback".
+    """
+    span = _SPAN.get()
+    if span is not None:
+        span.add_error(kind)
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Adds the time spent in the block to the current node's named phase (e.g. "parse", "render").
+    """
+    span = _SPAN.get()
+    if span is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        span.add_phase(name, started, time.perf_counter() - started)
+
+
+# ---- node wrapper and plan context --------------------------------------
+
+
+def _open_span(name: str):
+    span = NodeSpan(name, _PLAN.get())
+    logger.debug("%s started", name)
+    return span, _SPAN.set(span)
+
+
+def _close_span(span: NodeSpan, token, error: BaseException = None) -> None:
+    _SPAN.reset(token)
+    span.wall_seconds = time.perf_counter() - span.started
+    if error is not None:
+        span.failed = True
+        logger.error("%s failed after %.2fs: %s", span.node, span.wall_seconds, error)
+    else:
+        logger.info("%s finished in %.2fs (%d LLM calls, %.2fs LLM)", span.node, span.wall_seconds, span.llm_calls, span.llm_seconds)
+    _METRICS.record_span(span)
+    if span.plan is not None:
+        span.plan.add_span(span)
+
+
+def instrument_node(name: str, node):
+    """
+    Wraps a graph node (sync or async) so each execution is measured as a NodeSpan.
+
+    The wrapper keeps the node's signature, so LangGraph still passes the run config to it.
+
+    Args:
+        name (str): The node name used in metrics and traces.
+        node (callable): The node function.
+
+    Returns:
+        callable: The instrumented node.
+    """
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def async_wrapper(*args, **kwargs):
+            span, token = _open_span(name)
+            try:
+                result = await node(*args, **kwargs)
+            except BaseException as e:
+                _close_span(span, token, e)
+                raise
+            _close_span(span, token)
+            return result
+        return async_wrapper
+
+    @functools.wraps(node)
+    def wrapper(*args, **kwargs):
+        span, token = _open_span(name)
+        try:
+            result = node(*args, **kwargs)
+        except BaseException as e:
+            _close_span(span, token, e)
+            raise
+        _close_span(span, token)
+        return result
+    return wrapper
+
+
+def trace_dir(config: dict = None) -> str:
+    """
+    Returns where a run's trace file goes: configurable["trace_dir"], else DIET_TRACE_DIR, else None (no file).
+    """
+    return (config or {}).get('configurable', {}).get('trace_dir', TRACE_DIR)
+
+
+@contextmanager
+def plan_trace(run_id: str = None, directory: str = None):
+    """
+    Groups the node spans of one workflow run, records the plan's wall time and, when a
+    directory is given, writes the run's trace file on exit.
+
+    Like plan_ledger() in prompts.py, the trace travels in a context variable, so nodes run
+    from the block's threads and tasks are included.
+
+    Args:
+        run_id (str): Names the trace file; a random id by default.
+        directory (str): Directory for <run_id>.trace.json, or None for no file.
+
+    Yields:
+        PlanTrace: The run's trace.
+    """
+    plan = PlanTrace(run_id)
+    token = _PLAN.set(plan)
+    try:
+        yield plan
+    except BaseException:
+        plan.failed = True
+        raise
+    finally:
+        _PLAN.reset(token)
+        plan.wall_seconds = time.perf_counter() - plan.started
+        _METRICS.record_plan(plan)
+        if directory:
+            try:
+                path = plan.write(directory)
+                logger.info("plan %s trace written to %s", plan.run_id, path)
+            except OSError as e:
+                logger.warning("could not write the trace of plan %s: %s", plan.run_id, e)
+
+
+# ---- snapshots -----------------------------------------------------------
+
+
+def metrics_snapshot() -> dict:
+    """
+    Returns everything measured so far as one JSON-serialisable dict: node and plan aggregates,
+    per-node LLM attempt counters (resilience.py), rate-limiter queue stats, token totals
+    (prompts.py) and profiler sections.
+    """
+    # imported here: those modules record into this one, so they cannot be imported at the top
+    from prompts import get_token_ledger
+    from rate_limiter import get_rate_limiter
+    from resilience import get_call_metrics
+
+    snapshot = _METRICS.snapshot()
+    snapshot['llm_calls'] = get_call_metrics().snapshot()
+    limiter = get_rate_limiter()
+    snapshot['rate_limiter'] = limiter.stats() if limiter is not None else None
+    snapshot['tokens'] = get_token_ledger().snapshot()
+    snapshot['profiles'] = profiled_sections()
+    return snapshot
+
+
+def prometheus_text() -> str:
+    """
+    Returns the node and plan metrics in the Prometheus text exposition format.
+    """
+    return _METRICS.prometheus()
+
+
+# ---- optional profiling of the non-LLM work ------------------------------
+
+
+PROFILERS = ('cprofile', 'pyinstrument')
+_PROFILER = os.environ.get('DIET_PROFILE') or None
+_PROFILES = {}
+_PROFILES_LOCK = threading.Lock()
+_ACTIVE = threading.local()
+
+
+def configure_profiling(profiler: str = None) -> None:
+    """
+    Turns profiling of the profiled() sections on or off.
+
+    Args:
+        profiler (str): "cprofile", "pyinstrument" (needs the optional pyinstrument package) or
+            None to switch it off. Defaults to the DIET_PROFILE environment variable.
+    """
+    global _PROFILER
+    if profiler is not None and profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler '{profiler}', expected one of {', '.join(PROFILERS)}")
+    _PROFILER = profiler
+
+
+def _pyinstrument_profiler():
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        logger.warning("pyinstrument is not installed, profiling with cProfile instead")
+        configure_profiling('cprofile')
+        return None
+    return Profiler(async_mode='disabled')
+
+
+@contextmanager
+def profiled(section: str):
+    """
+    Profiles the block when profiling is on and merges the result into the section's totals.
+
+    Meant for CPU-bound, synchronous work such as markdown conversion, template rendering and
+    PDF rendering. A block entered while this thread is already profiling runs unprofiled, since
+    a thread can only have one active profiler.
+    """
+    if _PROFILER is None or getattr(_ACTIVE, 'on', False):
+        yield
+        return
+
+    profiler = _pyinstrument_profiler() if _PROFILER == 'pyinstrument' else None
+    if profiler is None:
+        profiler = cProfile.Profile()
+        start, stop = profiler.enable, profiler.disable
+    else:
+        start, stop = profiler.start, profiler.stop
+
+    _ACTIVE.on = True
+    start()
+    try:
+        yield
+    finally:
+        stop()
+        _ACTIVE.on = False
+        _merge_profile(section, profiler)
+
+
+def _merge_profile(section: str, profiler) -> None:
+    with _PROFILES_LOCK:
+        entry = _PROFILES.get(section)
+        if isinstance(profiler, cProfile.Profile):
+            if entry is None or not isinstance(entry, pstats.Stats):
+                _PROFILES[section] = pstats.Stats(profiler)
+            else:
+                entry.add(profiler)
+        else:
+            session = profiler.last_session
+            if entry is None or isinstance(entry, pstats.Stats):
+                _PROFILES[section] = session
+            else:
+                _PROFILES[section] = type(session).combine(entry, session)
+
+
+def profiled_sections() -> dict:
+    """
+    Returns {section: seconds profiled so far}.
+    """
+    with _PROFILES_LOCK:
+        return {
+            section: entry.total_tt if isinstance(entry, pstats.Stats) else entry.duration
+            for section, entry in _PROFILES.items()
+        }
+
+
+def profile_report(section: str, limit: int = 25) -> str:
+    """
+    Returns the profile of a section as text: the top functions by cumulative time for cProfile,
+    the call tree for pyinstrument.
+    """
+    with _PROFILES_LOCK:
+        entry = _PROFILES.get(section)
+        if entry is None:
+            return f"No profile recorded for '{section}'"
+        if isinstance(entry, pstats.Stats):
+            out = io.StringIO()
+            entry.stream = out
+            entry.sort_stats('cumulative').print_stats(limit)
+            return out.getvalue()
+    from pyinstrument.renderers import ConsoleRenderer
+    return ConsoleRenderer().render(entry)
+
+
+def dump_profiles(directory: str) -> list:
+    """
+    Writes every cProfile section to <directory>/<section>.prof (for snakeviz etc.) and every
+    pyinstrument section to <directory>/<section>.txt.
+
+    Returns:
+        list: The written paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for section in list(_PROFILES):
+        safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in section)
+        with _PROFILES_LOCK:
+            entry = _PROFILES[section]
+        if isinstance(entry, pstats.Stats):
+            path = os.path.join(directory, f"{safe}.prof")
+            with _PROFILES_LOCK:
+                entry.dump_stats(path)
+        else:
+            path = os.path.join(directory, f"{safe}.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profile_report(section))
+        paths.append(path)
+    return paths
+
+
+def reset_profiles() -> None:
+    with _PROFILES_LOCK:
+        _PROFILES.clear()
@@ -0,0 +1,322 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import record_cache_lookup
+
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    'DIET_LLM_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'llm_responses.sqlite3'),
+)
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MEMORY_ENTRIES = 2048
+DEFAULT_DISK_BYTES = 64 * 1024 * 1024
+
+
+def canonical_prompt(prompt: str) -> str:
+    """
+    Collapses indentation and runs of whitespace so prompts that differ only in layout share a cache entry.
+    """
+    return re.sub(r'\s+', ' ', prompt).strip()
+
+
+def model_identity(llm) -> str:
+    """
+    Describes the model behind a chat client for use in cache keys (name plus sampling temperature).
+    """
+    name = getattr(llm, 'model', None) or getattr(llm, 'model_name', None) or type(llm).__name__
+    return f"{name}@{getattr(llm, 'temperature', None)}"
+
+
+def cache_key(llm, prompt: str) -> str:
+    payload = json.dumps([model_identity(llm), canonical_prompt(prompt)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM responses: an in-memory LRU in front of an SQLite store.
+
+    Entries expire after ttl seconds. The memory tier holds at most max_memory_entries; the disk
+    tier drops the least recently used rows once it exceeds max_disk_bytes. Concurrent callers
+    asking for the same key while it is being computed wait for that one call (single-flight)
+    instead of sending duplicate requests. Hits and misses are also counted for the calling
+    node (see instrumentation.py).
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: float = DEFAULT_TTL_SECONDS,
+                 max_memory_entries: int = DEFAULT_MEMORY_ENTRIES, max_disk_bytes: int = DEFAULT_DISK_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._disk_bytes = 0
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0, 'stores': 0, 'evictions': 0, 'expired': 0, 'rejected': 0}
+
+    # ---- storage tiers -------------------------------------------------
+
+    def _connect(self):
+        if self._db is None and self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, '
+                'size INTEGER NOT NULL, accessed REAL NOT NULL)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            db.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+            self._disk_bytes = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            self._db = db
+        return self._db
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _remember(self, key: str, value: str, expires: float) -> None:
+        with self._lock:
+            self._memory[key] = (expires, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """
+        Returns the cached response for key, or None when it is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] >= now:
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return entry[1]
+                del self._memory[key]
+                self._counters['expired'] += 1
+
+        with self._db_lock:
+            db = self._connect()
+            row = db.execute('SELECT value, expires FROM responses WHERE key = ?', (key,)).fetchone() if db else None
+            if row is not None and row[1] < now:
+                db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._disk_bytes -= len(row[0].encode('utf-8'))
+                row = None
+                self._count('expired')
+            elif row is not None:
+                db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+
+        if row is None:
+            return None
+        self._count('disk_hits')
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Stores a response in both tiers and evicts least recently used disk rows past the size limit.
+        """
+        now = time.time()
+        expires = now + self.ttl
+        size = len(value.encode('utf-8'))
+        self._remember(key, value, expires)
+        self._count('stores')
+
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return
+            previous = db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', (key, value, expires, size, now))
+            self._disk_bytes += size - (previous[0] if previous else 0)
+
+            while self._disk_bytes > self.max_disk_bytes:
+                oldest = db.execute('SELECT key, size FROM responses ORDER BY accessed LIMIT 64').fetchall()
+                if not oldest:
+                    break
+                for old_key, old_size in oldest:
+                    if self._disk_bytes <= self.max_disk_bytes:
+                        break
+                    db.execute('DELETE FROM responses WHERE key = ?', (old_key,))
+                    self._disk_bytes -= old_size
+                    self._count('evictions')
+
+    def delete(self, key: str) -> None:
+        """
+        Drops a response from both tiers.
+        """
+        with self._lock:
+            self._memory.pop(key, None)
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return
+            row = db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._disk_bytes -= row[0]
+
+    def _usable(self, key: str, value: str, validate) -> bool:
+        """
+        Checks a response with validate(), which raises ValueError for one the caller cannot use.
+        A rejected response is dropped, so the next lookup asks the model again instead of replaying it.
+        """
+        if validate is None:
+            return True
+        try:
+            validate(value)
+        except ValueError:
+            self.delete(key)
+            self._count('rejected')
+            return False
+        return True
+
+    # ---- single-flight lookups -----------------------------------------
+
+    def _claim(self, key: str):
+        """
+        Returns (future, is_leader). The leader computes the value; everyone else waits on its future.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._counters['coalesced'] += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self._inflight[key] = future
+            return future, True
+
+    def _settle(self, key: str, future, value=None, error: BaseException = None) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+    def get_or_call(self, key: str, compute, validate=None) -> str:
+        """
+        Returns the cached response for key, calling compute() once on a miss.
+
+        Args:
+            key (str): The cache key, see cache_key().
+            compute (callable): Produces the response text.
+            validate (callable): Raises ValueError for a response the caller cannot use. Such a
+                response is returned but not stored, and a stored one is dropped and recomputed.
+
+        Returns:
+            str: The response text.
+        """
+        value = self.get(key)
+        if value is not None and self._usable(key, value, validate):
+            record_cache_lookup(True)
+            return value
+
+        future, leader = self._claim(key)
+        record_cache_lookup(not leader)
+        if not leader:
+            return future.result()
+
+        self._count('misses')
+        try:
+            value = compute()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        if value and self._usable(key, value, validate):
+            self.set(key, value)
+        self._settle(key, future, value)
+        return value
+
+    async def aget_or_call(self, key: str, compute, validate=None) -> str:
+        """
+        Async variant of get_or_call(); compute is an async callable.
+        """
+        value = self.get(key)
+        if value is not None and self._usable(key, value, validate):
+            record_cache_lookup(True)
+            return value
+
+        future, leader = self._claim(key)
+        record_cache_lookup(not leader)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        self._count('misses')
+        try:
+            value = await compute()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        if value and self._usable(key, value, validate):
+            self.set(key, value)
+        self._settle(key, future, value)
+        return value
+
+    # ---- housekeeping --------------------------------------------------
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss counters plus the current size of each tier.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+        stats['disk_bytes'] = self._disk_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_rate'] = (lookups - stats['misses']) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        with self._db_lock:
+            db = self._connect()
+            if db is not None:
+                db.execute('DELETE FROM responses')
+            self._disk_bytes = 0
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """
+    Returns the process-wide response cache.
+    """
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = ResponseCache()
+    return _CACHE
+
+
+def response_cache(config: dict = None):
+    """
+    Returns the cache a run should use: the shared one, a ResponseCache passed as
+    configurable["cache"], or None when the run sets configurable["cache"] to False.
+    """
+    setting = (config or {}).get('configurable', {}).get('cache', True)
+    if setting is False or setting is None:
+        return None
+    if isinstance(setting, ResponseCache):
+        return setting
+    return get_cache()
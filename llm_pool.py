@@ -0,0 +1,90 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+DEFAULT_PROVIDER = "google_genai"
+MAX_CLIENTS = 64
+
+
+# (provider, model, key fingerprint) -> chat model. Each client keeps its own
+# HTTP transport alive, so reusing it reuses the underlying connections.
+_CLIENTS = OrderedDict()
+_CLIENTS_LOCK = threading.Lock()
+
+
+def _fingerprint(api_key: str) -> str:
+    """
+    Returns a short, non-reversible identifier for an API key so raw keys are never used as pool keys.
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def get_llm(api_key: str = None, model: str = DEFAULT_MODEL, provider: str = DEFAULT_PROVIDER):
+    """
+    Returns the pooled chat model for the given credential and model, creating it on first use.
+
+    Args:
+        api_key (str): The tenant's Google API key. Falls back to the GOOGLE_API_KEY environment variable.
+        model (str): The model name passed to init_chat_model.
+        provider (str): The model provider passed to init_chat_model.
+
+    Returns:
+        BaseChatModel: A chat model bound to the given credential.
+    """
+    api_key = api_key or os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("No Google API key configured for this run.")
+
+    key = (provider, model, _fingerprint(api_key))
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is not None:
+            _CLIENTS.move_to_end(key)
+            return client
+
+    # Imported lazily so tools that never call the LLM do not pay for the provider SDK.
+    from langchain.chat_models import init_chat_model
+
+    client = init_chat_model(model, model_provider=provider, google_api_key=api_key)
+
+    with _CLIENTS_LOCK:
+        # Another thread may have created the same client meanwhile; keep the first one.
+        client = _CLIENTS.setdefault(key, client)
+        _CLIENTS.move_to_end(key)
+        while len(_CLIENTS) > MAX_CLIENTS:
+            _CLIENTS.popitem(last=False)
+    return client
+
+
+def resolve_llm(config: dict = None):
+    """
+    Picks the chat model for a run from its LangGraph config.
+
+    The "configurable" section may carry a ready model instance under "llm" (used by tests and
+    benchmarks), or an "api_key" and optional "model"/"provider" that are looked up in the pool.
+
+    Args:
+        config (dict): The run config passed to the node.
+
+    Returns:
+        BaseChatModel: The chat model to call.
+    """
+    configurable = (config or {}).get("configurable", {})
+    if configurable.get("llm") is not None:
+        return configurable["llm"]
+    return get_llm(
+        api_key=configurable.get("api_key"),
+        model=configurable.get("model", DEFAULT_MODEL),
+        provider=configurable.get("provider", DEFAULT_PROVIDER),
+    )
+
+
+def clear_pool() -> None:
+    """
+    Drops every pooled client.
+    """
+    with _CLIENTS_LOCK:
+        _CLIENTS.clear()
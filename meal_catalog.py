@@ -0,0 +1,324 @@
+import csv
+import functools
+import logging
+import os
+import re
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+from nutrition import normalize_diet_type
+
+
+logger = logging.getLogger(__name__)
+
+MEAL_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'meal_catalog.csv')
+MAX_ALLOWED_MEALS = 40
+
+# Allergen and diet-type bits
+DAIRY = 1 << 0
+EGG = 1 << 1
+GLUTEN = 1 << 2
+TREE_NUTS = 1 << 3
+PEANUTS = 1 << 4
+SOY = 1 << 5
+FISH = 1 << 6
+SHELLFISH = 1 << 7
+SESAME = 1 << 8
+MEAT = 1 << 9
+RED_MEAT = 1 << 10
+HONEY = 1 << 11
+# Nutrition tag bits, set from the catalog's "tags" column
+HIGH_SUGAR = 1 << 16
+HIGH_SODIUM = 1 << 17
+FRIED = 1 << 18
+HIGH_FAT = 1 << 19
+REFINED_CARBS = 1 << 20
+HIGH_PROTEIN = 1 << 21
+HIGH_FIBER = 1 << 22
+LOW_CARB = 1 << 23
+
+TAGS = {
+    'high_sugar': HIGH_SUGAR, 'high_sodium': HIGH_SODIUM, 'fried': FRIED, 'high_fat': HIGH_FAT,
+    'refined_carbs': REFINED_CARBS, 'red_meat': RED_MEAT, 'high_protein': HIGH_PROTEIN,
+    'high_fiber': HIGH_FIBER, 'low_carb': LOW_CARB,
+}
+
+DIET_EXCLUSIONS = {
+    'NON_VEGETARIAN': 0,
+    'VEGETARIAN': MEAT | RED_MEAT | FISH | SHELLFISH,
+    'VEGAN': MEAT | RED_MEAT | FISH | SHELLFISH | DAIRY | EGG | HONEY,
+}
+
+# Catalog ingredients that carry allergen or diet bits; every other ingredient carries none.
+INGREDIENT_FLAGS = {
+    'butter': DAIRY, 'cheese': DAIRY, 'cottage cheese': DAIRY, 'cream': DAIRY, 'feta': DAIRY,
+    'ghee': DAIRY, 'greek yogurt': DAIRY, 'milk': DAIRY, 'milk powder': DAIRY, 'paneer': DAIRY,
+    'parmesan': DAIRY, 'whey protein': DAIRY, 'yogurt': DAIRY, 'chocolate': DAIRY,
+    'egg': EGG, 'mayonnaise': EGG,
+    'bread croutons': GLUTEN, 'oats': GLUTEN, 'pasta': GLUTEN, 'semolina': GLUTEN, 'wheat flour': GLUTEN,
+    'white bread': GLUTEN, 'whole wheat bread': GLUTEN, 'whole wheat flour': GLUTEN,
+    'whole wheat pasta': GLUTEN, 'whole wheat tortilla': GLUTEN,
+    'granola': GLUTEN | TREE_NUTS | HONEY,
+    'almond milk': TREE_NUTS, 'almonds': TREE_NUTS, 'cashews': TREE_NUTS, 'walnuts': TREE_NUTS,
+    'coconut milk': TREE_NUTS,
+    'peanut butter': PEANUTS, 'peanuts': PEANUTS,
+    'soy milk': SOY, 'soy sauce': SOY | GLUTEN, 'tofu': SOY, 'tempeh': SOY, 'edamame': SOY,
+    'anchovy': FISH, 'salmon': FISH, 'tuna': FISH, 'white fish': FISH,
+    'shrimp': SHELLFISH,
+    'sesame oil': SESAME, 'tahini': SESAME, 'hummus': SESAME,
+    'chicken': MEAT, 'chicken breast': MEAT, 'turkey': MEAT,
+    'beef': MEAT | RED_MEAT, 'beef mince': MEAT | RED_MEAT, 'mutton': MEAT | RED_MEAT,
+    'honey': HONEY,
+}
+
+# Words in allergies, restrictions, avoid and dislikes that name an allergen group.
+# Longer terms are matched first and consumed, so "peanut" does not also match "nut".
+ALLERGEN_TERMS = {
+    'lactose': DAIRY, 'dairy': DAIRY, 'milk': DAIRY, 'casein': DAIRY, 'whey': DAIRY, 'cheese': DAIRY,
+    'egg': EGG,
+    'gluten': GLUTEN, 'wheat': GLUTEN, 'celiac': GLUTEN, 'coeliac': GLUTEN,
+    'tree nut': TREE_NUTS, 'almond': TREE_NUTS, 'cashew': TREE_NUTS, 'walnut': TREE_NUTS,
+    'peanut': PEANUTS, 'nut': TREE_NUTS | PEANUTS,
+    'soy': SOY,
+    'seafood': FISH | SHELLFISH, 'shellfish': SHELLFISH, 'shrimp': SHELLFISH, 'prawn': SHELLFISH,
+    'crustacean': SHELLFISH, 'fish': FISH,
+    'sesame': SESAME,
+    'red meat': RED_MEAT, 'meat': MEAT,
+}
+
+# Words in restrictions and avoid that rule out a nutrition tag.
+RESTRICTION_TERMS = {
+    'sugar': HIGH_SUGAR, 'sweet': HIGH_SUGAR, 'dessert': HIGH_SUGAR, 'diabet': HIGH_SUGAR | REFINED_CARBS,
+    'glycemic': REFINED_CARBS, 'refined': REFINED_CARBS,
+    'sodium': HIGH_SODIUM, 'salt': HIGH_SODIUM, 'hypertension': HIGH_SODIUM,
+    'fried': FRIED, 'greasy': FRIED | HIGH_FAT,
+    'saturated fat': HIGH_FAT, 'low fat': HIGH_FAT, 'low-fat': HIGH_FAT, 'cholesterol': HIGH_FAT | FRIED,
+    'full fat': HIGH_FAT, 'full-fat': HIGH_FAT, 'fatty': HIGH_FAT,
+    'red meat': RED_MEAT,
+}
+
+# Restrictions only exclude an allergen group when phrased as an exclusion ("dairy-free", "no nuts");
+# "low-fat dairy" must not remove dairy.
+_EXCLUSION_CUES = re.compile(r'free|\bno\b|avoid|allerg|intoleran|exclude|without')
+# Words that do not narrow an avoided food group: "all dairy products" still means dairy.
+_FILLER_WORDS = frozenset(('a', 'all', 'and', 'any', 'food', 'foods', 'item', 'items', 'of', 'or', 'product', 'products', 'the'))
+
+PREFERENCE_TERMS = {'protein': HIGH_PROTEIN, 'fiber': HIGH_FIBER, 'fibre': HIGH_FIBER, 'low carb': LOW_CARB, 'low-carb': LOW_CARB, 'keto': LOW_CARB}
+
+
+class MealCatalog(NamedTuple):
+    names: list
+    ingredients: list
+    flags: np.ndarray
+    ingredient_index: dict
+
+
+_CATALOG = None
+_CATALOG_LOCK = threading.Lock()
+
+
+def load_catalog(path: str = MEAL_CATALOG_PATH) -> MealCatalog:
+    """
+    Loads the meal catalog and builds its per-meal bitmasks and ingredient -> meals inverted index, once per process.
+
+    Returns:
+        MealCatalog: Meal names, ingredient lists, a uint32 flag mask per meal and the inverted index.
+    """
+    global _CATALOG
+    if _CATALOG is not None:
+        return _CATALOG
+
+    with _CATALOG_LOCK:
+        if _CATALOG is None:
+            names, ingredients, flags, index = [], [], [], {}
+            with open(path, newline='', encoding='utf-8') as f:
+                for position, row in enumerate(csv.DictReader(f)):
+                    items = tuple(i.strip() for i in row['ingredients'].split('|') if i.strip())
+                    mask = 0
+                    for item in items:
+                        mask |= INGREDIENT_FLAGS.get(item, 0)
+                        index.setdefault(item, []).append(position)
+                    for tag in row['tags'].split('|'):
+                        mask |= TAGS.get(tag.strip(), 0)
+                    names.append(row['name'])
+                    ingredients.append(items)
+                    flags.append(mask)
+            _CATALOG = MealCatalog(
+                names, ingredients, np.array(flags, dtype=np.uint32),
+                {item: np.array(meals, dtype=np.intp) for item, meals in index.items()},
+            )
+    return _CATALOG
+
+
+def _phrases(values) -> list:
+    if not values or values == 'No':
+        return []
+    if isinstance(values, str):
+        values = [values]
+    return [re.sub(r'\s+', ' ', str(v).lower()).strip() for v in values if str(v).strip()]
+
+
+_TERM_TABLES = {
+    'allergen': ALLERGEN_TERMS,
+    'restriction': RESTRICTION_TERMS,
+    'preference': PREFERENCE_TERMS,
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def text_flags(phrase: str, kind: str) -> int:
+    """
+    Returns the bits a free-text phrase names, matching longer terms first.
+
+    Args:
+        phrase (str): Lower-cased phrase, e.g. "dairy-free".
+        kind (str): "allergen", "restriction" or "preference".
+    """
+    terms = _TERM_TABLES[kind]
+    mask = 0
+    for term in sorted(terms, key=len, reverse=True):
+        if term in phrase:
+            mask |= terms[term]
+            phrase = phrase.replace(term, ' ')
+    return mask
+
+
+@functools.lru_cache(maxsize=4096)
+def _qualifiers(phrase: str) -> tuple:
+    """
+    Returns the words of a phrase that are neither allergen or restriction terms, exclusion cues
+    nor filler, e.g. "processed meats" -> ("processed",), "no dairy" -> ().
+    """
+    for term in sorted({**ALLERGEN_TERMS, **RESTRICTION_TERMS}, key=len, reverse=True):
+        phrase = re.sub(re.escape(term) + r'\w*', ' ', phrase)
+    return tuple(
+        word for word in re.findall(r'[a-z]+', phrase)
+        if len(word) > 1 and word not in _FILLER_WORDS and not _EXCLUSION_CUES.search(word)
+    )
+
+
+def _words_in(part: str, whole: str) -> bool:
+    return re.search(r'\b' + re.escape(part) + r's?\b', whole) is not None
+
+
+@functools.lru_cache(maxsize=4096)
+def matching_ingredients(phrase: str) -> tuple:
+    """
+    Lists the catalog ingredients a phrase refers to, e.g. "spinach" -> ("spinach",), "chicken" -> ("chicken", "chicken breast").
+    """
+    index = load_catalog().ingredient_index
+    phrase = phrase.rstrip('s') if phrase not in index else phrase
+    return tuple(item for item in index if _words_in(phrase, item) or _words_in(item, phrase))
+
+
+@functools.lru_cache(maxsize=4096)
+def _named_ingredients(phrase: str) -> tuple:
+    """
+    Lists the catalog ingredients a whole avoided phrase names, e.g. "chicken" -> ("chicken",
+    "chicken breast"); unlike matching_ingredients(), "peanut butter" does not also match "butter".
+    """
+    index = load_catalog().ingredient_index
+    phrase = ' '.join(word for word in phrase.split() if not _EXCLUSION_CUES.search(word))
+    phrase = phrase.rstrip('s') if phrase not in index else phrase
+    return tuple(item for item in index if phrase and _words_in(phrase, item))
+
+
+def _avoided_meals(catalog: MealCatalog, phrase: str) -> np.ndarray:
+    """
+    Marks the meals an avoided or disliked phrase rules out.
+
+    Every part the phrase names must hold, so qualifiers narrow the match: "full-fat dairy" is
+    dairy that is also high-fat, "fried chicken" fried meals with chicken. A food group with an
+    unknown qualifier ("processed meats") is not excluded as a whole; like any phrase it still
+    rules out the ingredients and meal names it matches.
+
+    Args:
+        catalog (MealCatalog): The loaded catalog.
+        phrase (str): Lower-cased phrase from avoid or dislikes.
+
+    Returns:
+        np.ndarray: One bool per meal, True where the meal is ruled out.
+    """
+    group = text_flags(phrase, 'allergen')
+    tags = text_flags(phrase, 'restriction')
+    qualifiers = _qualifiers(phrase)
+    parts = [(catalog.flags & np.uint32(bits)) != 0 for bits in (group, tags) if bits]
+    if parts and qualifiers:
+        named = {item for word in qualifiers for item in _named_ingredients(word)}
+        if named:
+            parts.append(_meals_with(catalog, named))
+        elif not tags:
+            parts = []
+
+    avoided = np.logical_and.reduce(parts) if parts else np.zeros(len(catalog.names), dtype=bool)
+    avoided |= _meals_with(catalog, _named_ingredients(phrase))
+    avoided |= np.array([_words_in(phrase, name.lower()) for name in catalog.names], dtype=bool)
+    return avoided
+
+
+def _meals_with(catalog: MealCatalog, items) -> np.ndarray:
+    meals = np.zeros(len(catalog.names), dtype=bool)
+    for item in items:
+        meals[catalog.ingredient_index[item]] = True
+    return meals
+
+
+def filter_meals(diet_type=None, allergies=(), restrictions=(), avoid=(), dislikes=(), likes=(), preferences=(), limit: int = MAX_ALLOWED_MEALS) -> list:
+    """
+    Selects the catalog meals compatible with a patient's diet type, allergies and restrictions.
+
+    Exclusions are a bitwise test of each meal's flag mask against the forbidden bits, plus the
+    inverted index for allergens. Avoided and disliked phrases are matched against groups, tags,
+    ingredients and meal names together (see _avoided_meals()), so a qualifier narrows them.
+    Remaining meals are ranked by how many liked ingredients and preferred tags they contain.
+
+    Args:
+        diet_type (str): VEGETARIAN, NON_VEGETARIAN or VEGAN (any case).
+        allergies (list[str]): Declared allergies; a meal containing one is never returned.
+        restrictions (list[str]): Medical restrictions, e.g. "low-sugar", "dairy-free".
+        avoid (list[str]): Foods or food groups to avoid.
+        dislikes (list[str]): Disliked foods.
+        likes (list[str]): Liked foods, used for ranking.
+        preferences (list[str]): Dietary preferences such as "high-protein", used for ranking.
+        limit (int): Maximum number of meals returned.
+
+    Returns:
+        list[str]: Allowed meal names, best match first.
+    """
+    catalog = load_catalog()
+    forbidden = DIET_EXCLUSIONS.get(normalize_diet_type(diet_type), 0)
+    excluded_ingredients = set()
+
+    for phrase in _phrases(allergies):
+        bits = text_flags(phrase, 'allergen')
+        items = matching_ingredients(phrase)
+        if not bits and not items:
+            logger.warning("Allergy '%s' does not match any catalog ingredient", phrase)
+        forbidden |= bits
+        excluded_ingredients.update(items)
+
+    for phrase in _phrases(restrictions):
+        forbidden |= text_flags(phrase, 'restriction')
+        if _EXCLUSION_CUES.search(phrase):
+            forbidden |= text_flags(phrase, 'allergen')
+
+    allowed = (catalog.flags & np.uint32(forbidden)) == 0
+    for item in excluded_ingredients:
+        allowed[catalog.ingredient_index[item]] = False
+    for phrase in _phrases(avoid) + _phrases(dislikes):
+        allowed &= ~_avoided_meals(catalog, phrase)
+
+    score = np.zeros(len(catalog.names))
+    for phrase in _phrases(likes):
+        for item in matching_ingredients(phrase):
+            score[catalog.ingredient_index[item]] += 1
+    for phrase in _phrases(preferences):
+        bits = text_flags(phrase, 'preference')
+        if bits:
+            score += (catalog.flags & np.uint32(bits)) != 0
+
+    candidates = np.flatnonzero(allowed)
+    ranked = candidates[np.argsort(-score[candidates], kind='stable')]
+    return [catalog.names[i] for i in ranked[:limit]]
@@ -1,846 +1,1381 @@
-from typing import Literal, Union
-
-from typing_extensions import TypedDict 
-
-import os
-from langchain.chat_models import init_chat_model
-
-from pydantic import Field
-import json
-import re
-from markdown2 import markdown
-from jinja2 import Template
-import pdfkit
-import io
-
-
-
-os.environ["GOOGLE_API_KEY"] = "API_KEY"
-llm = init_chat_model("gemini-2.5-flash", model_provider="google_genai")
-
-
-
-class Dietplan_State(TypedDict):
-    
-    #user input fields
-    name: str= Field( default="Patient", description="Name of the patient", examples=["John Doe", "Jane Smith"])
-    age: int = Field(default=30, description="Age of the patient", examples=[25, 40],gt=0, lt=90)
-    gender: Literal['MALE', 'FEMALE','BISEXUAL','OTHER'] = Field(default='MALE', description='gender of the patient', examples=['MALE', 'FEMALE','BISEXUAL','OTHER'])
-    height_m: float = Field(default=1.70, description="Height of the patient in meters", examples=[1.60, 1.80], gt=0.6, lt=2.00)
-    weight_kg: int = Field(default=70, description="Weight of the patient in kg", examples=[50, 100], gt=30, lt=200)
-    bmi: float = Field(default=None, description="Body Mass Index of the patient", examples=[22.5, 27.0], gt=10.0, lt=50.0)
-    primary_goal: str = Field(default='LOSE_WEIGHT', description="Goal of the patient", examples=['LOSE_WEIGHT', 'GAIN_WEIGHT', 'MAINTAIN_WEIGHT'])
-    diet_type: Literal['VEGETARIAN', 'NON_VEGETARIAN', 'VEGAN'] = Field(default='NON_VEGETARIAN', description="Type of diet", examples=['VEGETARIAN', 'NON_VEGETARIAN', 'VEGAN'])
-    allergies: list[str] = Field(default_factory=list, description="List of allergies", examples=["nuts","gluten", "dairy"])
-    medical_conditions: list[str] = Field(default_factory=list, description="List of medical conditions", examples=[["diabetes"], ["hypertension", "high cholesterol"]])
-    activity_level_description : str = Field(default='MODERATE', description="Activity level of the patient")
-    wake_time: str = Field(default="7:00 AM", description="Wake time of the patient", examples=["6:00 AM", "8:00 AM"])
-    sleep_time: str = Field(default="11:00 PM", description="Sleep time of the patient", examples=["10:00 PM", "12:00 AM"])
-    meal_frequency: int = Field(default=3, description="Number of meals per day", examples=[2, 5], gt=1, lt=10)
-    supper_snacks: Union[Literal['No'],list[str]] = Field(default=None, description="Whether the patient has supper or snacks", examples=['No', ['fruits', 'nuts']])
-    breakfast: Union[Literal['No'],list[str]] = Field(default=None, description="Whether the patient has breakfast", examples=['No', ['eggs', 'toast']])
-    lunch: Union[Literal['No'],list[str]] = Field(default=None, description="Whether the patient has lunch", examples=['No', ['rice', 'chicken']])
-    dinner: Union[Literal['No'],list[str]] = Field(default=None, description="Whether the patient has dinner", examples=['No', ['pasta', 'salad']])
-    likes: list[str] = Field(default_factory=list, description="List of liked foods", examples=[["chicken", "fish"], ["fruits", "vegetables"]])
-    dislikes: list[str] = Field(default_factory=list, description="List of disliked foods", examples=[["spinach"], ["broccoli", "cauliflower"]])
-    water_intake: float = Field(default=4, description="Daily water intake in number of glasses", examples=[1, 3], gt=0, lt=6)
-    
-    #output fields
-    goal_class: Literal['WEIGHT_LOSS', 'WEIGHT_GAIN', 'MAINTENANCE','CLINICAL_DIET','CHILD_DIET'] = Field(default=None, description="Classified goal of the patient", examples=['WEIGHT_LOSS', 'WEIGHT_GAIN', 'MAINTENANCE', 'CLINICAL_DIET', 'CHILD_DIET'])
-    target_calories: int = Field(default=2000, description="Target calories for the patient", examples=[1500, 2500], gt=1000, lt=5000)
-    restrictions: list[str] = Field(default_factory=list, description="List of dietary restrictions", examples=["gluten-free","low-carb", "low-sugar"])
-    warnings: list[str] = Field(default_factory=list, description="List of warnings", examples=["high cholesterol","diabetes management", "low iron levels"])  
-    preferences: list[str] = Field(default_factory=list, description="List of dietary preferences", examples=["low-fat","high-protein", "low-carb"])
-    avoid: list[str] = Field(default_factory=list, description="List of foods to avoid", examples=["sugar","processed foods", "high sodium foods"])  
-    activity_level: Literal['SEDENTARY', 'LIGHT', 'MODERATE', 'ACTIVE', 'VERY_ACTIVE'] = Field(default=None, description="Classified activity level of the patient", examples=['SEDENTARY', 'LIGHT', 'MODERATE', 'ACTIVE', 'VERY_ACTIVE'])
-    protein_multiplier: float = Field(default=1.0, description="Protein multiplier based on activity level", examples=[0.8, 1.2, 1.5])
-    meal_schedule: dict[str, str] = Field(default_factory=dict, description="Meal schedule for the patient", examples=[{"breakfast": ["eggs", "toast"], "lunch": ["rice", "chicken"], "dinner": ["pasta", "salad"]}])
-    macros_target: dict[str, str] = Field(default_factory=dict, description="Macronutrient targets for the patient", examples=[{"protein": 150.0, "carbs": 200.0, "fats": 70.0}])
-    micros_needed: list[str] = Field(default_factory=list, description="List of micronutrients needed", examples=["vitamin D","calcium", "iron"])
-    allowed_meals: list[str] = Field(default_factory=list, description="List of allowed meals", examples=["grilled chicken salad","vegetable stir-fry", "quinoa bowl"])
-    diet_plan_pdf: bytes = Field(default=None,description="The generated proposal PDF in bytes format.")
-    
-    
-    meals: dict[str, dict[str, Union[str, list[str], int]]] = Field(
-        default_factory=dict,
-        description="Meal plan for the patient with time, items, and calories",
-        examples=[
-            {
-                "breakfast": {"time": "8:00 AM", "items": ["eggs", "toast"], "calories": 300},
-                "lunch": {"time": "12:00 PM", "items": ["rice", "chicken"], "calories": 500},
-                "dinner": {"time": "7:00 PM", "items": ["pasta", "salad"], "calories": 400},
-                "snacks": {"items": ["fruits", "nuts"], "calories": 200}
-            }
-        ]
-    )
-    
-    total_calories: int = Field(default=2000, description="Total daily calories for the patient",examples=[1500, 2500],gt=1000,lt=5000)
-    actual_macros: dict[str, str] = Field(default_factory=dict, description="Actual macronutrient intake for the patient", examples=[{"protein": "150g", "carbs": "200g", "fat": "70g"}])
-    recommendation: str = Field(default="", description="Dietary recommendation for the patient", examples=["Increase protein intake","Reduce sugar consumption","Include more vegetables in meals"])
-    supplements: list[str] = Field(default_factory=list, description="List of recommended supplements", examples=["vitamin D","omega-3 fatty acids", "multivitamins"])
-    notes: str = Field(default="", description="Additional notes for the patient", examples=["Monitor blood sugar levels","Follow up in 2 weeks","Consider a nutritionist consultation"])
-    water_intake: str
-    tips : list[str]
-
-
-
-def calculate_bmi(weight_kg, height_m) -> float:
-    """
-    Calculates the Body Mass Index (BMI).
-
-    Args:
-        weight_kg (float): The individual's weight in kilograms.
-        height_m (float): The individual's height in meters.
-
-    Returns:
-        float: The calculated BMI value.
-    """
-    if height_m <= 0:
-        raise ValueError("Height cannot be zero or negative.")
-    bmi = weight_kg / (height_m ** 2)
-    return bmi
-
-
-def get_response(Prompt: str) -> str:
-    """
-    Gets a response from the language model based on the provided prompt.
-    
-    Args:
-        Prompt (str): The input prompt for the language model.
-        
-    Returns:
-        str: The response content from the language model.
-    """
-    response = llm.invoke(Prompt)
-    return response.content
-    
-
-
-def get_JSON(response: str) -> dict:
-    """
-    Parses a JSON string into a Python dictionary.
-    
-    Args:
-        response (str): The JSON string to parse.
-        
-    Returns:
-        dict: The parsed JSON data.
-    """
-    try:
-        match = re.search(r'\{[\s\S]*\}', response)
-        if match:
-            response_json = match.group(0)
-            response_json = json.loads(response_json)
-            return response_json
-    except Exception as e:
-        print(f"Error parsing JSON: {e}")
-        return {}
-
-
-
-
-
-def goal_class(state: Dietplan_State) -> Dietplan_State:
-    """
-    Classifies the user's fitness/diet goal (e.g., weight loss, muscle gain).
-    """
-    print('goal class')
-    
-    bmi=calculate_bmi(state['weight_kg'], state['height_m'])
-    
-    
-    prompt = f"""Given the following patient data, classify the primary health goal as one of the following: 
-             - weight_loss
-             - muscle_gain
-             - maintenance
-             - child_diet
-             - clinical_diet
-             
-             Also estimate a daily target calorie intake.
-             
-             Patient Info:
-             Age: {state['age']}
-             Gender: {state['gender']}
-             Height: {bmi}
-             Stated Goal(by user): {state["primary_goal"]}
-             
-             Respond in json format: {{"goal_class": "...", "target_calories": ...}}
-             """
-    try:
-        response = get_response(prompt)
-        response_json = get_JSON(response)
-        
-        state['goal_class'] = response_json.get('goal_class', 'MAINTENANCE')  # Default to MAINTENANCE if not provided
-        state['target_calories'] = response_json.get('target_calories', 2000)  # Default to 2000 if not provided
-        return {'goal_class': state['goal_class'], 'target_calories': state['target_calories'], 'bmi': bmi}
-    except Exception as e:
-        print(f"Error in goal_class: {e}")
-    
-    
-
-def medical_conditions(state: Dietplan_State) -> Dietplan_State:
-    """
-    Filters meals or suggestions based on medical conditions.
-    """
-    print('medical condition')
-        
-    
-    prompt = f"""Analyze the following medical conditions and allergies. Provide a list of dietary restrictions and medical cautions that must be considered while creating a meal plan.
-
-             Medical Conditions: {state['medical_conditions']}
-             Allergies: {state["allergies"]}
-             Respond in JSON: {{ "restrictions": [...], "warnings": [...] }}
-             """
-
-    try:
-        response = get_response(prompt)
-        response_json = get_JSON(response)
-        
-        state['restrictions'] = response_json.get('restrictions', None)  # Default to MAINTENANCE if not provided
-        state['warnings'] = response_json.get('warnings', None)  # Default to 2000 if not provided
-        return {'restrictions': state['restrictions'], 'warnings': state['warnings']}
-    except Exception as e:
-        print(f"Error in medical conditions: {e}")
-        
-        
-        
-
-def habits(state: Dietplan_State) -> Dietplan_State:
-    """
-    Analyzes user habits like meal preferences, allergies, etc.
-    """
-    
-    print('habbits')
-        
-    prompt = f"""Given the patient’s eating habits and preferences, generate a list of food preferences, cultural restrictions, and foods to avoid to achieve his goal.
-              
-              Patient Goal: {state['primary_goal']}
-              Diet Type: {state['diet_type']}
-              Likes: {state['likes']}
-              Dislikes: {state['dislikes']}
-              Snacks at supper: {state['supper_snacks']}
-              Breakfast: {state['breakfast']}
-              Lunch: {state['lunch']}
-              Dinner: {state['dinner']}
-                
-              
-              Respond in JSON: {{ "preferences": [...], "avoid": [...] }}
-              """
-
-
-    try:
-        response = get_response(prompt)
-        response_json = get_JSON(response)
-        
-        state['preferences'] = response_json.get('preferences', None)  # Default to MAINTENANCE if not provided
-        state['avoid'] = response_json.get('avoid', None)  # Default to 2000 if not provided
-        return {'preferences': state['preferences'], 'avoid': state['avoid']}
-    except Exception as e:
-        print(f"Error in habits: {e}")
-        
-        
-        
-        
-        
-        
-
-def activity_level(state: Dietplan_State) -> Dietplan_State:
-    """
-    Adjusts nutrition based on the patient's activity level.
-    """
-    
-    print('activity level')
-        
-    prompt = f"""Classify the patient’s physical activity level as one of:
-             - sedentary
-             - moderate
-             - light
-             - active
-             - very_active
-             
-             Also suggest a protein intake multiplier (between 1.0–2.0) based on activity.
-             
-             Activity Description: {state['activity_level_description']}
-             
-             Respond in JSON: {{ "activity_level": "...", "protein_multiplier": ... }}
-             """
-
-
-
-    try:
-        response = get_response(prompt)
-        response_json = get_JSON(response)
-        
-        state['activity_level'] = response_json.get('activity_level', None)  # Default to MAINTENANCE if not provided
-        state['protein_multiplier'] = response_json.get('protein_multiplier', None)  # Default to 2000 if not provided
-        return {'activity_level': state['activity_level'], 'protein_multiplier': state['protein_multiplier']}
-    except Exception as e:
-        print(f"Error in habits: {e}")
-        
-        
-        
-        
-        
-
-def routine_time(state: Dietplan_State) -> Dietplan_State:
-    """
-    Uses wake/sleep time and meal frequency to estimate meal timings.
-    """
-    
-    print('routine time')
-        
-    prompt = f"""Based on the patient's wake and sleep times and number of meals per day, create an ideal daily meal schedule with meal names and suggested times.
-
-             Wake Time: {state['wake_time']}
-             Sleep Time: {state['sleep_time']}
-             Meal Frequency: {state['meal_frequency']}
-             
-             Respond in JSON: 
-             {{ 
-               "meal_schedule": {{ 
-                 "breakfast": "...", 
-                 "lunch": "...", 
-                 "dinner": "...", 
-                 "snack_1": "...", 
-                 ...
-               }}
-             }}
-             """
-
-
-
-
-    try:
-        response = get_response(prompt)
-        response_json = get_JSON(response)
-        
-        state['meal_schedule'] = response_json.get('meal_schedule', None)  
-        return {'meal_schedule': state['meal_schedule']}
-    except Exception as e:
-        print(f"Error in habits: {e}")
-        
-        
-        
-        
-        
-        
-
-def nutrient_need(state: Dietplan_State) -> Dietplan_State:
-    """
-    Calculates the patient's required calories and macronutrient distribution.
-    """
-    
-    print('nutrient need')
-        
-    prompt = f"""Estimate daily macro- and micronutrient needs for the patient based on their profile.
-
-             Age: {state['age']}
-             Gender: {state['gender']}
-             BMI: {state['bmi']} 
-             Goal Class: {state['goal_class']}
-             Activity Level: {state['activity_level']}
-             
-             Respond in JSON:
-             {{ 
-               "macros_target": {{ "protein": "...g", "carbs": "...g", "fat": "...g" }},
-               "micros_needed": ["calcium", "iron", "vitamin D", "fiber", ...]
-             }}
-             """
-
-
-    try:
-        response = get_response(prompt)
-        response_json = get_JSON(response)
-        
-        state['macros_target'] = response_json.get('macros_target', None) 
-        state['micros_needed'] = response_json.get('micros_needed', None)  
-        return {'macros_target': state['macros_target'], 'micros_needed': state['micros_needed']}
-    except Exception as e:
-        print(f"Error in habits: {e}")
-        
-        
-        
-        
-        
-        
-        
-
-def meal_filter(state: Dietplan_State) -> Dietplan_State:
-    """
-    Filters meals based on dislikes, allergies, preferences (veg/non-veg).
-    """
-    
-    print('meal filter')
-        
-    prompt = f"""Filter the allowed meals based on the patient’s dislikes, allergies, preferences and medical restrictions.
-
-             Preferences: {state['preferences']}
-             Restrictions: {state['restrictions']}
-             Avoid: {state['avoid']}
-             Likes: {state['likes']}
-             Dislikes: {state['dislikes']}
-             
-                          
-             Respond in JSON: {{ "allowed_meals": [ "grilled chicken", "lentils", ... ] }}
-             """
-
-
-
-    try:
-        response = get_response(prompt)
-        response_json = get_JSON(response)
-        
-        state['allowed_meals'] = response_json.get('allowed_meals', None)
-        return {'allowed_meals': state['allowed_meals']}
-    except Exception as e:
-        print(f"Error in habits: {e}")
-        
-        
-        
-        
-        
-        
-        
-
-def personalized_meals(state: Dietplan_State) -> Dietplan_State:
-    """
-    Selects personalized meal suggestions for breakfast, lunch, dinner, and snacks.
-    """
-    
-    print('personalize meal')
-        
-    prompt = f"""Create a full-day meal plan using the allowed meals, nutrient needs, and meal timing schedule.
-
-             Goal: {state['goal_class']}
-             Target Calories: {state['target_calories']}
-             Meal Schedule: {state['meal_schedule']}
-             Allowed Meals: {state['allowed_meals']}
-             Macros Target: {state['macros_target']}
-             Micros Needed: {state['micros_needed']}
-                
-             
-             Respond in JSON:
-             {{
-               "meals": {{
-                 "breakfast": {{
-                   "time": "...",
-                   "items": [...],
-                   "calories": ...
-                 }},
-                 "lunch": {{...}},
-                 "dinner": {{...}},
-                 "snacks": [...]
-               }}
-             }}
-             """
-
-    try:
-        response = get_response(prompt)
-        response_json = get_JSON(response)
-        
-        
-        state['meals'] = response_json.get('meals', None)
-        return {'meals': state['meals']}
-    except Exception as e:
-        print(f"Error in habits: {e}")
-        
-        
-        
-        
-        
-        
-        
-
-def calorie_macro_ai(state: Dietplan_State) -> Dietplan_State:
-    """
-    Finalizes calorie and macronutrient mapping to selected meals.
-    """
-    
-    print('macro calori')
-        
-    prompt = f"""Calculate the total calorie count and macro breakdown for the provided meals. Compare it with the target and return recommendations.
-
-             Target Calories: {state['target_calories']}
-             Macros Target: {state['macros_target']}
-             Micros Needed: {state['micros_needed']}
-             Meal Schedule: {state['meal_schedule']}
-             Meal Plan: {state['meals']}
-             
-             
-             Respond in JSON:
-             {{
-               "total_calories": ...,
-               "actual_macros": {{ "protein": "...g", "carbs": "...g", "fat": "...g" }},
-               "recommendation": "..."
-             }}
-             """
-
-
-    try:
-        response = get_response(prompt)
-        response_json = get_JSON(response)
-        
-        
-        state['total_calories'] = response_json.get('total_calories', None)
-        state['actual_macros'] = response_json.get('actual_macros', None)
-        state['recommendation'] = response_json.get('recommendation', None)
-        return {'total_calories': state['total_calories'],'actual_macros': state['actual_macros'],'recommendation': state['recommendation']}
-    except Exception as e:
-        print(f"Error in habits: {e}")
-        
-        
-        
-        
-        
-        
-
-def supplement_advisor(state: Dietplan_State) -> Dietplan_State:
-    """
-    Suggests supplements based on deficiencies, goal, and medical conditions.
-    """
-    
-    print("supplement")
-        
-    prompt = f"""Based on the meal plan and patient profile, recommend any nutritional supplements that may help achieve the goal.
-
-             Medical Conditions: {state['medical_conditions']}
-             Diet Type: {state['diet_type']}
-             Allergies: {state['allergies']}
-             Macros Target: {state['macros_target']}
-             Micronutrient Needs: {state['micros_needed']}
-             Goal Class: {state['goal_class']}
-             Meal Plan: {state['meals']}
-             
-             Respond in JSON:
-             {{ "supplements": [...], "notes": "..." }}
-             """
-
-
-
-    try:
-        response = get_response(prompt)
-        response_json = get_JSON(response)
-        
-        
-        state['supplements'] = response_json.get('supplements', None)
-        state['notes'] = response_json.get('notes', None)
-        return {'supplements': state['supplements'],'notes': state['notes']}
-    except Exception as e:
-        print(f"Error in habits: {e}")
-        
-        
-        
-        
-        
-        
-
-def hydration_tips(state: Dietplan_State) -> Dietplan_State:
-    """
-    Provides daily water intake tips based on activity and weather (optional live info).
-    """
-    
-    print('hydration')
-        
-    prompt = f"""Suggest personalized hydration advice and 2-3 lifestyle tips for wellness.
-
-             BMI: {state['bmi']}
-             Climate: 'monson'
-             Activity Level: {state['activity_level']}
-             
-             Respond in JSON:
-             {{ 
-               "water_intake": "... liters/day", 
-               "tips": ["...", "...", "..."] 
-             }}
-             """
-
-
-
-
-    try:
-        response = get_response(prompt)
-        response_json = get_JSON(response)
-        
-        
-        state['water_intake'] = response_json.get('water_intake', None)
-        state['tips'] = response_json.get('tips', None)
-        return {'water_intake': state['water_intake'],'tips': state['tips']}
-    except Exception as e:
-        print(f"Error in habits: {e}")
-        
-        
-        
-        
-        
-
-def pdf_generator(state: Dietplan_State) -> Dietplan_State:
-    """
-    Compiles the full diet plan into a downloadable or shareable PDF.
-    """
-    
-    print('pdf')
-    
-    prompt=f"""
-             You are a professional assistant creating a comprehensive, friendly, and beautifully formatted **diet plan report** for a patient. The output will be used in a **PDF**, so make it visually structured, rich in details, and warm in tone.
-             
-             Use:
-             - 📌 Headings and subheadings  
-             - ✅ Bullet points  
-             - 🧠 Quotes and health facts  
-             - 🍱 Tables for meal plans  
-             - ✨ Emojis for better visual appeal  
-             - 📣 Motivational messages  
-             - 📋 Final health notes  
-             
-             Use the following data to construct the report:
-             
-             ---
-             
-             👤 **Patient Profile:**
-             - Name: {state['name']}
-             - Age: {state['age']}
-             - Gender: {state['gender']}
-             - BLI : {state['bmi']}
-             - Activity Level: {state['activity_level']}
-             - Diet Type: {state['diet_type']}
-             - Health Goal: {state['goal_class']}
-             
-             🩺 **Medical:**
-             - Conditions: {state['medical_conditions']}
-             - Allergies: {state['allergies']}
-             - Restrictions: {state['restrictions']}
-             
-             🍽️ **Preferences:**
-             - Likes: {state['likes']}
-             - Dislikes: {state['dislikes']}
-             - Meal Frequency: {state['meal_frequency']}
-             
-             ⏰ **Meal Timing (Routine):**  
-             {state['meal_schedule']}
-             
-             🔥 **Nutritional Targets:**
-             - Calories: {state['target_calories']} kcal/day
-             - Macronutrients:
-               - Protein: {state['macros_target']['protein']}
-               - Carbohydrates: {state['macros_target']['carbs']}
-               - Fats: {state['macros_target']['fat']}
-             - Micronutrients Focus: {state['micros_needed']}
-             
-             🥗 **Detailed Daily Meal Plan:**  
-             {state['meals']}  # Contains breakfast, lunch, dinner, snacks, time, items, calories
-             
-             💊 **Supplement Suggestions:**
-             - {state['supplements']}
-             - Notes: {state['notes']}
-             
-             💧 **Water Intake Recommendation:** {state['water_intake']}  
-             🧘‍♀️ **Lifestyle & Wellness Tips:** {state['tips']}
-             
-             ---
-             
-             ### 📘 **Structure of the Report:**
-             
-             1. ✨ Title Page with Quote  
-             2. 📋 Patient Summary  
-             3. 🚦 Medical Warnings  
-             4. 🔬 Nutrition Targets  
-             5. 🍱 Full Meal Plan (Table Format)  
-             6. 💊 Supplements & Guidance  
-             7. 💡 Water + Lifestyle Advice  
-             8. 💬 Final Motivational Quote  
-             
-             ---
-             
-             Use markdown-style formatting like:
-             
-             ### 🍱 Meal Plan Table
-             
-             | Meal      | Time     | Items                            | Calories |
-             |-----------|----------|----------------------------------|----------|
-             | Breakfast | 08:00 AM | Boiled eggs, Brown toast, Tea    | 350 kcal |
-             
-             and motivational messages like:
-             
-             > 🧠 *“Let food be thy medicine and medicine be thy food.”* — Hippocrates
-             
-             Now generate the full report using the given data. Use UTF-8 Encoding instead of emogis as i will paste to pdf. Use bullet points.
-             """
-             
-    response=get_response(prompt)
-    
-    print('get response')
-    
-    html_body = markdown(response,extras=["tables", "fenced-code-blocks"])
-    
-    print('get html body')
-    
-    html_template = Template("""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <style>
-        body {
-            font-family: 'Segoe UI Emoji', 'Apple Color Emoji', 'Noto Color Emoji', 'Arial Unicode MS', 'Arial', sans-serif;
-            font-size: 12pt;
-            line-height: 1.6;
-            color: #2C3E50;
-            background-color: #FFFFFF;
-            margin: 40px;
-        }
-
-
-        h1 {
-            color: #1A5276;
-            background-color: #D6EAF8;
-            padding: 16px;
-            border-left: 10px solid #2980B9;
-            font-size: 24pt;
-            margin-bottom: 30px;
-        }
-
-        h2 {
-            color: #2471A3;
-            border-bottom: 2px solid #D4E6F1;
-            padding-bottom: 6px;
-            margin-top: 30px;
-            font-size: 18pt;
-        }
-
-        h3 {
-            color: #2980B9;
-            font-size: 14pt;
-            margin-top: 25px;
-            margin-bottom: 10px;
-        }
-
-        ul, ol {
-            margin-left: 25px;
-        }
-
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            margin-top: 20px;
-            font-size: 11pt;
-        }
-
-        table, th, td {
-            border: 1px solid #BDC3C7;
-            padding: 10px;
-        }
-
-        th {
-            background-color: #3498DB;
-            color: white;
-        }
-
-        tr:nth-child(even) {
-            background-color: #F2F3F4;
-        }
-
-        tr:hover {
-            background-color: #EBF5FB;
-        }
-
-        .section-box {
-            border: 2px solid #AED6F1;
-            background-color: #F4F6F7;
-            padding: 20px;
-            margin-top: 30px;
-            border-radius: 10px;
-        }
-
-        .quote {
-            font-style: italic;
-            color: #34495E;
-            padding: 12px;
-            margin-top: 20px;
-            border-left: 5px solid #2980B9;
-            background-color: #FBFCFC;
-        }
-
-        .note {
-            font-size: 11pt;
-            padding: 10px;
-            margin-top: 20px;
-            background-color: #FCF3CF;
-            border-left: 5px solid #F1C40F;
-            color: #7D6608;
-        }
-
-        .page-break {
-            page-break-after: always;
-        }
-
-        .center {
-            text-align: center;
-        }
-    </style>
-</head>
-<body>
-    {{ body }}
-</body>
-</html>
-""")
-
-    
-    
-    
-    final_html = html_template.render(body=html_body)
-    final_html.encode('utf-8')
-    
-    print('set final html')
-    
-    # Save path to wkhtmltopdf
-    try:
-        path_to_wkhtmltopdf = r"C:\Users\hassan\Desktop\Dietetian Agent\wkhtmltopdf\bin\wkhtmltopdf.exe"
-        if not path_to_wkhtmltopdf:
-            print("nammually assign path")
-            path_to_wkhtmltopdf = r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"
-        config = pdfkit.configuration(wkhtmltopdf=path_to_wkhtmltopdf)
-    except Exception as e:
-        print("Error setting wkhtmltopdf path:", e)
-
-    pdf_bytes=pdfkit.from_string(final_html, False, configuration=config)
-    pdf_buffer = io.BytesIO(pdf_bytes)
-    state["diet_plan_pdf"] = pdf_buffer.getvalue()
-    
-    print('set state')
-    
-
-    
-    
-
-
-    print(f"✅ Proposal saved to: output_pdf")
-    return state
-
-
-         
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+from typing import Annotated, Literal, Union
+
+from typing_extensions import TypedDict 
+
+from langchain_core.messages import AIMessage
+from langchain_core.messages.ai import add_usage
+from langchain_core.runnables import RunnableConfig
+
+from pydantic import Field
+import json
+import asyncio
+import operator
+import functools
+import logging
+
+from llm_pool import resolve_llm
+from llm_cache import cache_key, response_cache
+from batcher import batch_timeout, batcher_for
+from resilience import acall_with_policy, call_with_policy
+from rate_limiter import alimited_call, limited_call
+from prompts import ametered_call, build_prompt, meal_calories, meal_items, metered_call, response_text
+from scheduler import build_meal_schedule
+from food_table import compare_with_targets, meal_totals
+from meal_catalog import filter_meals
+from pdf_render import Rendered, get_render_pool
+from schemas import EMPTY_OUTPUTS, describe_error, disable_structured_output, empty_output, extract_json, parse_output, rejects_structured_output, repair_prompt, structured_model, validate_output
+from report import build_report, default_motivation, render_page
+from instrumentation import phase, record_cache_lookup, record_error
+from nutrition import PROTEIN_MULTIPLIERS, classify_goal, compute_targets, micronutrient_focus, normalize_activity, normalize_goal_class, parse_grams
+
+
+logger = logging.getLogger(__name__)
+
+
+class Dietplan_State(TypedDict):
+    
+    #user input fields
+    name: str= Field( default="Patient", description="Name of the patient", examples=["John Doe", "Jane Smith"])
+    age: int = Field(default=30, description="Age of the patient", examples=[25, 40],gt=0, lt=90)
+    gender: Literal['MALE', 'FEMALE','BISEXUAL','OTHER'] = Field(default='MALE', description='gender of the patient', examples=['MALE', 'FEMALE','BISEXUAL','OTHER'])
+    height_m: float = Field(default=1.70, description="Height of the patient in meters", examples=[1.60, 1.80], gt=0.6, lt=2.00)
+    weight_kg: int = Field(default=70, description="Weight of the patient in kg", examples=[50, 100], gt=30, lt=200)
+    bmi: float = Field(default=None, description="Body Mass Index of the patient", examples=[22.5, 27.0], gt=10.0, lt=50.0)
+    primary_goal: str = Field(default='LOSE_WEIGHT', description="Goal of the patient", examples=['LOSE_WEIGHT', 'GAIN_WEIGHT', 'MAINTAIN_WEIGHT'])
+    diet_type: Literal['VEGETARIAN', 'NON_VEGETARIAN', 'VEGAN'] = Field(default='NON_VEGETARIAN', description="Type of diet", examples=['VEGETARIAN', 'NON_VEGETARIAN', 'VEGAN'])
+    allergies: list[str] = Field(default_factory=list, description="List of allergies", examples=["nuts","gluten", "dairy"])
+    medical_conditions: list[str] = Field(default_factory=list, description="List of medical conditions", examples=[["diabetes"], ["hypertension", "high cholesterol"]])
+    activity_level_description : str = Field(default='MODERATE', description="Activity level of the patient")
+    wake_time: str = Field(default="7:00 AM", description="Wake time of the patient", examples=["6:00 AM", "8:00 AM"])
+    sleep_time: str = Field(default="11:00 PM", description="Sleep time of the patient", examples=["10:00 PM", "12:00 AM"])
+    meal_frequency: int = Field(default=3, description="Number of meals per day", examples=[2, 5], gt=1, lt=10)
+    supper_snacks: Union[Literal['No'],list[str]] = Field(default=None, description="Whether the patient has supper or snacks", examples=['No', ['fruits', 'nuts']])
+    breakfast: Union[Literal['No'],list[str]] = Field(default=None, description="Whether the patient has breakfast", examples=['No', ['eggs', 'toast']])
+    lunch: Union[Literal['No'],list[str]] = Field(default=None, description="Whether the patient has lunch", examples=['No', ['rice', 'chicken']])
+    dinner: Union[Literal['No'],list[str]] = Field(default=None, description="Whether the patient has dinner", examples=['No', ['pasta', 'salad']])
+    likes: list[str] = Field(default_factory=list, description="List of liked foods", examples=[["chicken", "fish"], ["fruits", "vegetables"]])
+    dislikes: list[str] = Field(default_factory=list, description="List of disliked foods", examples=[["spinach"], ["broccoli", "cauliflower"]])
+    water_intake: float = Field(default=4, description="Daily water intake in number of glasses", examples=[1, 3], gt=0, lt=6)
+    
+    #output fields
+    goal_class: Literal['WEIGHT_LOSS', 'WEIGHT_GAIN', 'MAINTENANCE','CLINICAL_DIET','CHILD_DIET'] = Field(default=None, description="Classified goal of the patient", examples=['WEIGHT_LOSS', 'WEIGHT_GAIN', 'MAINTENANCE', 'CLINICAL_DIET', 'CHILD_DIET'])
+    target_calories: int = Field(default=2000, description="Target calories for the patient", examples=[1500, 2500], gt=1000, lt=5000)
+    restrictions: list[str] = Field(default_factory=list, description="List of dietary restrictions", examples=["gluten-free","low-carb", "low-sugar"])
+    warnings: list[str] = Field(default_factory=list, description="List of warnings", examples=["high cholesterol","diabetes management", "low iron levels"])  
+    preferences: list[str] = Field(default_factory=list, description="List of dietary preferences", examples=["low-fat","high-protein", "low-carb"])
+    avoid: list[str] = Field(default_factory=list, description="List of foods to avoid", examples=["sugar","processed foods", "high sodium foods"])  
+    activity_level: Literal['SEDENTARY', 'LIGHT', 'MODERATE', 'ACTIVE', 'VERY_ACTIVE'] = Field(default=None, description="Classified activity level of the patient", examples=['SEDENTARY', 'LIGHT', 'MODERATE', 'ACTIVE', 'VERY_ACTIVE'])
+    protein_multiplier: float = Field(default=1.0, description="Protein multiplier based on activity level", examples=[0.8, 1.2, 1.5])
+    meal_schedule: dict[str, str] = Field(default_factory=dict, description="Meal schedule for the patient", examples=[{"breakfast": ["eggs", "toast"], "lunch": ["rice", "chicken"], "dinner": ["pasta", "salad"]}])
+    macros_target: dict[str, str] = Field(default_factory=dict, description="Macronutrient targets for the patient", examples=[{"protein": 150.0, "carbs": 200.0, "fats": 70.0}])
+    micros_needed: list[str] = Field(default_factory=list, description="List of micronutrients needed", examples=["vitamin D","calcium", "iron"])
+    allowed_meals: list[str] = Field(default_factory=list, description="List of allowed meals", examples=["grilled chicken salad","vegetable stir-fry", "quinoa bowl"])
+    diet_plan_pdf: bytes = Field(default=None,description="The generated proposal PDF in bytes format.")
+    pdf_backend: str = Field(default=None, description="The PDF backend that rendered diet_plan_pdf", examples=["weasyprint", "wkhtmltopdf", "text"])
+    pdf_fallback: str = Field(default=None, description="Why the configured PDF backend was not used, when it failed and the plain-text fallback rendered the PDF")
+    # written by any node that falls back (so it is not in NODE_IO); the reducer lets parallel nodes both set it
+    degraded: Annotated[bool, operator.or_] = Field(default=False, description="True when a node's LLM call failed and its output came from a local fallback or schemas.EMPTY_OUTPUTS")
+    
+    
+    meals: dict[str, dict[str, Union[str, list[str], int]]] = Field(
+        default_factory=dict,
+        description="Meal plan for the patient with time, items, and calories",
+        examples=[
+            {
+                "breakfast": {"time": "8:00 AM", "items": ["eggs", "toast"], "calories": 300},
+                "lunch": {"time": "12:00 PM", "items": ["rice", "chicken"], "calories": 500},
+                "dinner": {"time": "7:00 PM", "items": ["pasta", "salad"], "calories": 400},
+                "snacks": {"items": ["fruits", "nuts"], "calories": 200}
+            }
+        ]
+    )
+    
+    total_calories: int = Field(default=2000, description="Total daily calories for the patient",examples=[1500, 2500],gt=1000,lt=5000)
+    actual_macros: dict[str, str] = Field(default_factory=dict, description="Actual macronutrient intake for the patient", examples=[{"protein": "150g", "carbs": "200g", "fat": "70g"}])
+    recommendation: str = Field(default="", description="Dietary recommendation for the patient", examples=["Increase protein intake","Reduce sugar consumption","Include more vegetables in meals"])
+    supplements: list[str] = Field(default_factory=list, description="List of recommended supplements", examples=["vitamin D","omega-3 fatty acids", "multivitamins"])
+    notes: str = Field(default="", description="Additional notes for the patient", examples=["Monitor blood sugar levels","Follow up in 2 weeks","Consider a nutritionist consultation"])
+    water_intake: str
+    tips : list[str]
+    motivation: dict[str, str] = Field(default_factory=dict, description="Opening and closing motivational lines for the report", examples=[{"opening": "...", "closing": "..."}])
+
+
+
+def calculate_bmi(weight_kg, height_m) -> float:
+    """
+    Calculates the Body Mass Index (BMI).
+
+    Args:
+        weight_kg (float): The individual's weight in kilograms.
+        height_m (float): The individual's height in meters.
+
+    Returns:
+        float: The calculated BMI value.
+    """
+    if height_m <= 0:
+        raise ValueError("Height cannot be zero or negative.")
+    bmi = weight_kg / (height_m ** 2)
+    return bmi
+
+
+def use_llm(config: RunnableConfig, node: str) -> bool:
+    """
+    Tells whether a node that is computed locally by default should ask the LLM instead.
+
+    Nodes opt in through the run config, e.g. {"configurable": {"llm_overrides": ["goal_class"]}}.
+    """
+    return node in (config or {}).get('configurable', {}).get('llm_overrides', ())
+
+
+def get_response(Prompt: str, config: RunnableConfig = None, node: str = None, validate=None) -> str:
+    """
+    Gets a response from the language model based on the provided prompt.
+    
+    Args:
+        Prompt (str): The input prompt for the language model.
+        config (RunnableConfig): The run config; selects the pooled client for the run's credential.
+            Repeated prompts are answered from the response cache unless it sets "cache" to False;
+            with "batching" set, the call is sent together with other sessions' prompts (see batcher.py).
+            Its "resilience" settings control timeouts, retries and hedging (see resilience.py).
+            Calls wait for the shared rate limiter when one is configured (see rate_limiter.py).
+            Input and output tokens of every model call are counted per node, as reported in the
+            reply's usage_metadata or else estimated (see prompts.py).
+        node (str): The calling node, for per-node deadlines and attempt metrics.
+        validate (callable): Raises ValueError for a reply the caller cannot use; such replies are not cached.
+        
+    Returns:
+        str: The response content from the language model.
+    """
+    llm = resolve_llm(config)
+    batcher = batcher_for(llm, config)
+
+    def attempt():
+        if batcher is not None:
+            return batcher.invoke(Prompt, timeout=batch_timeout(config))
+        return llm.invoke(Prompt)
+
+    def call():
+        # every attempt, retry and hedge waits for the limiter and is charged and metered for its own reply
+        return response_text(call_with_policy(node, lambda: limited_call(node, Prompt, lambda: metered_call(node, Prompt, attempt)), config))
+
+    cache = response_cache(config)
+    if cache is None:
+        return call()
+    return cache.get_or_call(cache_key(llm, Prompt), call, validate)
+
+
+async def aget_response(Prompt: str, config: RunnableConfig = None, node: str = None, validate=None) -> str:
+    """
+    Async variant of get_response(); awaits the model's ainvoke so the event loop stays free.
+    
+    Args:
+        Prompt (str): The input prompt for the language model.
+        config (RunnableConfig): The run config; selects the pooled client for the run's credential.
+        node (str): The calling node, for per-node deadlines and attempt metrics.
+        validate (callable): Raises ValueError for a reply the caller cannot use; such replies are not cached.
+        
+    Returns:
+        str: The response content from the language model.
+    """
+    llm = resolve_llm(config)
+    batcher = batcher_for(llm, config)
+
+    async def attempt():
+        if batcher is not None:
+            return await batcher.ainvoke(Prompt, timeout=batch_timeout(config))
+        return await llm.ainvoke(Prompt)
+
+    async def call():
+        return response_text(await acall_with_policy(node, lambda: alimited_call(node, Prompt, lambda: ametered_call(node, Prompt, attempt)), config))
+
+    cache = response_cache(config)
+    if cache is None:
+        return await call()
+    return await cache.aget_or_call(cache_key(llm, Prompt), call, validate)
+    
+
+
+def report_callback(config: RunnableConfig):
+    """
+    Returns the run's on_report_chunk callback, which receives the PDF report text as it streams in.
+    """
+    return (config or {}).get('configurable', {}).get('on_report_chunk')
+
+
+def _chunk_usage(usage: dict, chunk) -> dict:
+    # streamed chunks report their share of the call's usage; like AIMessageChunk addition, sum them
+    chunk_usage = getattr(chunk, 'usage_metadata', None)
+    return add_usage(usage, chunk_usage) if chunk_usage else usage
+
+
+def stream_response(Prompt: str, config: RunnableConfig, on_chunk, node: str = None) -> str:
+    """
+    Gets a response through llm.stream, passing each piece of text to on_chunk as it arrives.
+
+    A cached response is passed on as a single chunk. Streamed calls bypass the batcher.
+
+    Args:
+        Prompt (str): The input prompt for the language model.
+        config (RunnableConfig): The run config.
+        on_chunk (callable): Called with every new piece of text.
+        node (str): The calling node, for the rate limiter's priority class.
+
+    Returns:
+        str: The complete response content.
+    """
+    llm = resolve_llm(config)
+    cache = response_cache(config)
+    key = cache_key(llm, Prompt)
+    cached = cache.get(key) if cache is not None else None
+    if cache is not None:
+        record_cache_lookup(cached is not None)
+    if cached is not None:
+        on_chunk(cached)
+        return cached
+
+    def call():
+        parts, usage = [], None
+        for chunk in llm.stream(Prompt):
+            usage = _chunk_usage(usage, chunk)
+            if isinstance(chunk.content, str) and chunk.content:
+                parts.append(chunk.content)
+                on_chunk(chunk.content)
+        return AIMessage(content=''.join(parts), usage_metadata=usage)
+
+    response = response_text(limited_call(node, Prompt, lambda: metered_call(node, Prompt, call)))
+    if cache is not None and response:
+        cache.set(key, response)
+    return response
+
+
+async def astream_response(Prompt: str, config: RunnableConfig, on_chunk, node: str = None) -> str:
+    """
+    Async variant of stream_response(), consuming llm.astream.
+    """
+    llm = resolve_llm(config)
+    cache = response_cache(config)
+    key = cache_key(llm, Prompt)
+    cached = cache.get(key) if cache is not None else None
+    if cache is not None:
+        record_cache_lookup(cached is not None)
+    if cached is not None:
+        on_chunk(cached)
+        return cached
+
+    async def call():
+        parts, usage = [], None
+        async for chunk in llm.astream(Prompt):
+            usage = _chunk_usage(usage, chunk)
+            if isinstance(chunk.content, str) and chunk.content:
+                parts.append(chunk.content)
+                on_chunk(chunk.content)
+        return AIMessage(content=''.join(parts), usage_metadata=usage)
+
+    response = response_text(await alimited_call(node, Prompt, lambda: ametered_call(node, Prompt, call)))
+    if cache is not None and response:
+        cache.set(key, response)
+    return response
+
+
+def get_JSON(response: str) -> dict:
+    """
+    Parses a JSON string into a Python dictionary.
+    
+    Args:
+        response (str): The JSON string to parse.
+        
+    Returns:
+        dict: The parsed JSON data, or an empty dict when the response contains no JSON object.
+    """
+    try:
+        return extract_json(response)
+    except ValueError as e:
+        logger.warning("Error parsing JSON: %s", e)
+        return {}
+
+
+def _structured_enabled(config: RunnableConfig) -> bool:
+    # batched runs keep the plain-text path so their prompts can still share llm.batch() calls
+    configurable = (config or {}).get('configurable', {})
+    return configurable.get('structured_output', True) and not configurable.get('batching')
+
+
+def _structured_reply(result: dict) -> AIMessage:
+    """
+    Turns a structured-output result ({"raw", "parsed", "parsing_error"}) into a message holding
+    the reply as JSON text, with the raw reply's usage_metadata for token accounting.
+    """
+    if result.get('parsing_error') is not None:
+        raise result['parsing_error']
+    if result.get('parsed') is None:
+        raise ValueError("the model returned no structured output")
+    return AIMessage(content=result['parsed'].model_dump_json(), usage_metadata=getattr(result.get('raw'), 'usage_metadata', None))
+
+
+def get_structured_response(name: str, Prompt: str, config: RunnableConfig = None) -> dict:
+    """
+    Asks the model for a node's reply in its provider-native structured-output mode.
+
+    Args:
+        name (str): The node name; selects the schema in schemas.NODE_SCHEMAS.
+        Prompt (str): The input prompt for the language model.
+        config (RunnableConfig): The run config.
+
+    Returns:
+        dict: The validated reply, or None when the model has no native structured output.
+    """
+    llm = resolve_llm(config)
+    runnable = structured_model(llm, name)
+    if runnable is None:
+        return None
+
+    def attempt():
+        return _structured_reply(runnable.invoke(Prompt))
+
+    def call():
+        # every attempt, retry and hedge waits for the limiter and is charged and metered for its own reply
+        return response_text(call_with_policy(name, lambda: limited_call(name, Prompt, lambda: metered_call(name, Prompt, attempt)), config))
+
+    cache = response_cache(config)
+    if cache is None:
+        return json.loads(call())
+    return json.loads(cache.get_or_call(cache_key(llm, f"[{name}]\n{Prompt}"), call))
+
+
+async def aget_structured_response(name: str, Prompt: str, config: RunnableConfig = None) -> dict:
+    """
+    Async variant of get_structured_response().
+    """
+    llm = resolve_llm(config)
+    runnable = structured_model(llm, name)
+    if runnable is None:
+        return None
+
+    async def attempt():
+        return _structured_reply(await runnable.ainvoke(Prompt))
+
+    async def call():
+        return response_text(await acall_with_policy(name, lambda: alimited_call(name, Prompt, lambda: ametered_call(name, Prompt, attempt)), config))
+
+    cache = response_cache(config)
+    if cache is None:
+        return json.loads(await call())
+    return json.loads(await cache.aget_or_call(cache_key(llm, f"[{name}]\n{Prompt}"), call))
+
+
+def get_node_json(name: str, Prompt: str, config: RunnableConfig = None) -> dict:
+    """
+    Gets a node's reply as a dict that satisfies its schema (see schemas.py).
+
+    Models with a native structured-output mode are asked through it, unless the run sets
+    "structured_output" to False or uses batching. If the provider rejects the schema, the mode
+    is turned off for that model and node (transient errors are raised instead). Otherwise the
+    JSON is extracted from the text reply; if that fails validation the model gets exactly one
+    repair prompt quoting its reply and the errors.
+
+    Args:
+        name (str): The node name.
+        Prompt (str): The input prompt for the language model.
+        config (RunnableConfig): The run config.
+
+    Returns:
+        dict: The validated reply.
+
+    Raises:
+        ValueError: If the reply is still unusable after the repair call.
+    """
+    if _structured_enabled(config):
+        try:
+            response_json = get_structured_response(name, Prompt, config)
+            if response_json is not None:
+                return response_json
+        except Exception as e:
+            # transient failures go to the node's fallback; only a rejected schema turns the mode off
+            if not rejects_structured_output(e):
+                raise
+            logger.warning("%s: structured output rejected (%s), using the text reply", name, e)
+            record_error('structured_output')
+            disable_structured_output(resolve_llm(config), name)
+
+    # an unusable reply is not cached, so later runs ask the model again instead of replaying it
+    validate = functools.partial(parse_output, name)
+    response = get_response(Prompt, config, name, validate)
+    try:
+        with phase('parse'):
+            return parse_output(name, response)
+    except ValueError as e:
+        error = e
+    logger.warning("%s: invalid reply (%s), asking for a corrected one", name, describe_error(error))
+    record_error('invalid_reply')
+    response = get_response(repair_prompt(name, response, error), config, name, validate)
+    with phase('parse'):
+        return parse_output(name, response)
+
+
+async def aget_node_json(name: str, Prompt: str, config: RunnableConfig = None) -> dict:
+    """
+    Async variant of get_node_json().
+    """
+    if _structured_enabled(config):
+        try:
+            response_json = await aget_structured_response(name, Prompt, config)
+            if response_json is not None:
+                return response_json
+        except Exception as e:
+            # transient failures go to the node's fallback; only a rejected schema turns the mode off
+            if not rejects_structured_output(e):
+                raise
+            logger.warning("%s: structured output rejected (%s), using the text reply", name, e)
+            record_error('structured_output')
+            disable_structured_output(resolve_llm(config), name)
+
+    validate = functools.partial(parse_output, name)
+    response = await aget_response(Prompt, config, name, validate)
+    try:
+        with phase('parse'):
+            return parse_output(name, response)
+    except ValueError as e:
+        error = e
+    logger.warning("%s: invalid reply (%s), asking for a corrected one", name, describe_error(error))
+    record_error('invalid_reply')
+    response = await aget_response(repair_prompt(name, response, error), config, name, validate)
+    with phase('parse'):
+        return parse_output(name, response)
+
+
+
+
+
+def _run_llm_node(name: str, state: Dietplan_State, config: RunnableConfig, build_prompt, parse_result, fallback=None) -> dict:
+    """
+    Runs one LLM-backed node: builds the prompt, calls the model and maps the JSON reply onto state keys.
+
+    Args:
+        name (str): The node name, used in log messages.
+        state (Dietplan_State): The current graph state.
+        config (RunnableConfig): The run config.
+        build_prompt (callable): Returns the prompt for the given state.
+        parse_result (callable): Maps (state, response_json) to the node's state update.
+        fallback (callable): Optional local computation used when the LLM call fails.
+
+    Returns:
+        dict: The state update. Without a fallback, a failed node writes the empty values from
+        schemas.EMPTY_OUTPUTS so the rest of the plan can still be built.
+    """
+    try:
+        response_json = get_node_json(name, build_prompt(state), config)
+        return parse_result(state, response_json)
+    except Exception as e:
+        logger.error("Error in %s: %s", name, e)
+        return _node_fallback(name, state, fallback)
+
+
+async def _arun_llm_node(name: str, state: Dietplan_State, config: RunnableConfig, build_prompt, parse_result, fallback=None) -> dict:
+    """
+    Async variant of _run_llm_node().
+    """
+    try:
+        response_json = await aget_node_json(name, build_prompt(state), config)
+        return parse_result(state, response_json)
+    except Exception as e:
+        logger.error("Error in %s: %s", name, e)
+        return _node_fallback(name, state, fallback)
+
+
+def _node_fallback(name: str, state: Dietplan_State, fallback=None) -> dict:
+    record_error('fallback')
+    if fallback is not None:
+        update = fallback(state)
+    elif name in EMPTY_OUTPUTS:
+        update = empty_output(name)
+    else:
+        update = None
+    # marks the plan, so it is not cached and replayed to the next identical profile
+    return {**(update or {}), 'degraded': True}
+
+
+
+
+
+def _goal_class_prompt(state: Dietplan_State) -> str:
+    bmi=calculate_bmi(state['weight_kg'], state['height_m'])
+
+    return build_prompt(
+        "Given the following patient data, classify the primary health goal as one of: weight_loss, muscle_gain, maintenance, child_diet, clinical_diet.",
+        {'Age': state['age'], 'Gender': state['gender'], 'BMI': f"{bmi:.1f}", 'Stated Goal(by user)': state['primary_goal']},
+        '{"goal_class":"..."}',
+    )
+
+
+def _goal_class_local(state: Dietplan_State) -> dict:
+    return {
+        'goal_class': classify_goal(state['primary_goal'], state['age']),
+        'bmi': round(calculate_bmi(state['weight_kg'], state['height_m']), 1),
+    }
+
+
+def _goal_class_result(state: Dietplan_State, response_json: dict) -> dict:
+    update = _goal_class_local(state)
+    if response_json.get('goal_class'):
+        update['goal_class'] = normalize_goal_class(response_json['goal_class'])
+    return update
+
+
+def goal_class(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Classifies the user's fitness/diet goal (e.g., weight loss, muscle gain).
+
+    The class follows from the stated goal and age, so it is computed locally; the LLM is only
+    asked when "goal_class" is listed in the run's llm_overrides.
+    """
+    if use_llm(config, 'goal_class'):
+        return _run_llm_node('goal_class', state, config, _goal_class_prompt, _goal_class_result, _goal_class_local)
+    return _goal_class_local(state)
+
+
+async def agoal_class(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of goal_class().
+    """
+    if use_llm(config, 'goal_class'):
+        return await _arun_llm_node('goal_class', state, config, _goal_class_prompt, _goal_class_result, _goal_class_local)
+    return _goal_class_local(state)
+
+
+
+def _medical_conditions_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        "Analyze the following medical conditions and allergies. Provide a list of dietary restrictions and medical cautions that must be considered while creating a meal plan.",
+        {'Medical Conditions': state['medical_conditions'], 'Allergies': state['allergies']},
+        '{"restrictions":[...],"warnings":[...]}',
+    )
+
+
+def _medical_conditions_result(state: Dietplan_State, response_json: dict) -> dict:
+    return {'restrictions': response_json.get('restrictions', None), 'warnings': response_json.get('warnings', None)}
+
+
+def medical_conditions(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Filters meals or suggestions based on medical conditions.
+    """
+    return _run_llm_node('medical_conditions', state, config, _medical_conditions_prompt, _medical_conditions_result)
+
+
+async def amedical_conditions(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of medical_conditions().
+    """
+    return await _arun_llm_node('medical_conditions', state, config, _medical_conditions_prompt, _medical_conditions_result)
+
+
+
+
+def _habits_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        "Given the patient’s eating habits and preferences, generate a list of food preferences, cultural restrictions, and foods to avoid to achieve his goal.",
+        {
+            'Patient Goal': state['primary_goal'],
+            'Diet Type': state['diet_type'],
+            'Likes': state['likes'],
+            'Dislikes': state['dislikes'],
+            'Snacks at supper': state['supper_snacks'],
+            'Breakfast': state['breakfast'],
+            'Lunch': state['lunch'],
+            'Dinner': state['dinner'],
+        },
+        '{"preferences":[...],"avoid":[...]}',
+    )
+
+
+def _habits_result(state: Dietplan_State, response_json: dict) -> dict:
+    return {'preferences': response_json.get('preferences', None), 'avoid': response_json.get('avoid', None)}
+
+
+def habits(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Analyzes user habits like meal preferences, allergies, etc.
+    """
+    return _run_llm_node('habits', state, config, _habits_prompt, _habits_result)
+
+
+async def ahabits(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of habits().
+    """
+    return await _arun_llm_node('habits', state, config, _habits_prompt, _habits_result)
+
+
+
+
+def _activity_level_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        "Classify the patient’s physical activity level as one of: sedentary, light, moderate, active, very_active. "
+        "Also suggest a protein intake multiplier (between 1.0–2.0) based on activity.",
+        {'Activity Description': state['activity_level_description']},
+        '{"activity_level":"...","protein_multiplier":...}',
+    )
+
+
+def _activity_level_local(state: Dietplan_State) -> dict:
+    # only used when the LLM reply is unusable: the description is read as a level name, else MODERATE
+    level = normalize_activity(state['activity_level_description'])
+    return {'activity_level': level, 'protein_multiplier': PROTEIN_MULTIPLIERS[level]}
+
+
+def _activity_level_result(state: Dietplan_State, response_json: dict) -> dict:
+    return {'activity_level': response_json.get('activity_level', None), 'protein_multiplier': response_json.get('protein_multiplier', None)}
+
+
+def activity_level(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Adjusts nutrition based on the patient's activity level.
+    """
+    return _run_llm_node('activity_level', state, config, _activity_level_prompt, _activity_level_result, _activity_level_local)
+
+
+async def aactivity_level(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of activity_level().
+    """
+    return await _arun_llm_node('activity_level', state, config, _activity_level_prompt, _activity_level_result, _activity_level_local)
+
+
+
+
+def _routine_time_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        "Based on the patient's wake and sleep times and number of meals per day, create an ideal daily meal schedule with meal names and suggested times.",
+        {'Wake Time': state['wake_time'], 'Sleep Time': state['sleep_time'], 'Meal Frequency': state['meal_frequency']},
+        '{"meal_schedule":{"breakfast":"...","lunch":"...","dinner":"...","snack_1":"...",...}}',
+    )
+
+
+def _routine_time_local(state: Dietplan_State) -> dict:
+    return {'meal_schedule': build_meal_schedule(state['wake_time'], state['sleep_time'], state['meal_frequency'])}
+
+
+def _routine_time_result(state: Dietplan_State, response_json: dict) -> dict:
+    if not response_json.get('meal_schedule'):
+        return _routine_time_local(state)
+    return {'meal_schedule': response_json['meal_schedule']}
+
+
+def routine_time(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Uses wake/sleep time and meal frequency to estimate meal timings.
+
+    The schedule comes from the local scheduler in scheduler.py; the LLM is only asked when
+    "routine_time" is listed in the run's llm_overrides.
+    """
+    if use_llm(config, 'routine_time'):
+        return _run_llm_node('routine_time', state, config, _routine_time_prompt, _routine_time_result, _routine_time_local)
+    return _routine_time_local(state)
+
+
+async def aroutine_time(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of routine_time().
+    """
+    if use_llm(config, 'routine_time'):
+        return await _arun_llm_node('routine_time', state, config, _routine_time_prompt, _routine_time_result, _routine_time_local)
+    return _routine_time_local(state)
+
+
+
+
+def _nutrient_need_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        "Estimate the daily calorie target and macro- and micronutrient needs for the patient based on their profile.",
+        {
+            'Age': state['age'],
+            'Gender': state['gender'],
+            'Weight': f"{state['weight_kg']} kg",
+            'Height': f"{state['height_m']} m",
+            'BMI': state['bmi'],
+            'Goal Class': state['goal_class'],
+            'Activity Level': state['activity_level'],
+            'Protein Multiplier': f"{state['protein_multiplier']} g/kg",
+            'Diet Type': state['diet_type'],
+        },
+        '{"target_calories":...,"macros_target":{"protein":"...g","carbs":"...g","fat":"...g"},"micros_needed":["calcium","iron","vitamin D","fiber",...]}',
+    )
+
+
+def _nutrient_need_local(state: Dietplan_State) -> dict:
+    targets = compute_targets(state)
+    return {
+        'target_calories': targets['target_calories'],
+        'macros_target': targets['macros_target'],
+        'micros_needed': micronutrient_focus(state['age'], state['gender'], state['diet_type'], state['goal_class']),
+    }
+
+
+def _nutrient_need_result(state: Dietplan_State, response_json: dict) -> dict:
+    # the LLM reply overrides the computed values it provides; anything missing keeps the local value
+    update = _nutrient_need_local(state)
+    calories = parse_grams(response_json.get('target_calories'))
+    if calories:
+        update['target_calories'] = int(calories)
+    macros = response_json.get('macros_target') or {}
+    for macro in update['macros_target']:
+        grams = parse_grams(macros.get(macro))
+        if grams is not None:
+            update['macros_target'][macro] = int(round(grams))
+    if response_json.get('micros_needed'):
+        update['micros_needed'] = response_json['micros_needed']
+    return update
+
+
+def nutrient_need(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Calculates the patient's required calories and macronutrient distribution.
+
+    Uses the closed-form energy and macro equations in nutrition.py; the LLM estimate is only
+    requested when "nutrient_need" is listed in the run's llm_overrides.
+    """
+    if use_llm(config, 'nutrient_need'):
+        return _run_llm_node('nutrient_need', state, config, _nutrient_need_prompt, _nutrient_need_result, _nutrient_need_local)
+    return _nutrient_need_local(state)
+
+
+async def anutrient_need(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of nutrient_need().
+    """
+    if use_llm(config, 'nutrient_need'):
+        return await _arun_llm_node('nutrient_need', state, config, _nutrient_need_prompt, _nutrient_need_result, _nutrient_need_local)
+    return _nutrient_need_local(state)
+
+
+
+
+def _meal_filter_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        "Filter the allowed meals based on the patient’s dislikes, allergies, preferences and medical restrictions.",
+        {
+            'Preferences': state['preferences'],
+            'Restrictions': state['restrictions'],
+            'Avoid': state['avoid'],
+            'Likes': state['likes'],
+            'Dislikes': state['dislikes'],
+        },
+        '{"allowed_meals":["grilled chicken","lentils",...]}',
+    )
+
+
+def _meal_filter_local(state: Dietplan_State) -> dict:
+    allowed_meals = filter_meals(
+        diet_type=state['diet_type'],
+        allergies=state['allergies'],
+        restrictions=state['restrictions'],
+        avoid=state['avoid'],
+        dislikes=state['dislikes'],
+        likes=state['likes'],
+        preferences=state['preferences'],
+    )
+    if not allowed_meals:
+        logger.warning("No catalog meal satisfies the patient's restrictions")
+    return {'allowed_meals': allowed_meals}
+
+
+def _meal_filter_result(state: Dietplan_State, response_json: dict) -> dict:
+    return {'allowed_meals': response_json.get('allowed_meals', None)}
+
+
+def meal_filter(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Filters meals based on dislikes, allergies, preferences (veg/non-veg).
+
+    Uses the allergen/diet bitmask index over the bundled meal catalog (meal_catalog.py); the LLM
+    is only asked when "meal_filter" is listed in the run's llm_overrides.
+    """
+    if use_llm(config, 'meal_filter'):
+        return _run_llm_node('meal_filter', state, config, _meal_filter_prompt, _meal_filter_result, _meal_filter_local)
+    return _meal_filter_local(state)
+
+
+async def ameal_filter(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of meal_filter().
+    """
+    if use_llm(config, 'meal_filter'):
+        return await _arun_llm_node('meal_filter', state, config, _meal_filter_prompt, _meal_filter_result, _meal_filter_local)
+    return _meal_filter_local(state)
+
+
+
+
+def _personalized_meals_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        "Create a full-day meal plan using the allowed meals, nutrient needs, and meal timing schedule.",
+        {
+            'Goal': state['goal_class'],
+            'Target Calories': state['target_calories'],
+            'Meal Schedule': state['meal_schedule'],
+            'Allowed Meals': state['allowed_meals'],
+            'Macros Target': state['macros_target'],
+            'Micros Needed': state['micros_needed'],
+        },
+        '{"meals":{"breakfast":{"time":"...","items":[...],"calories":...},"lunch":{...},"dinner":{...},"snacks":[...]}}',
+    )
+
+
+def _personalized_meals_result(state: Dietplan_State, response_json: dict) -> dict:
+    return {'meals': response_json.get('meals', None)}
+
+
+def personalized_meals(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Selects personalized meal suggestions for breakfast, lunch, dinner, and snacks.
+    """
+    return _run_llm_node('personalized_meals', state, config, _personalized_meals_prompt, _personalized_meals_result)
+
+
+async def apersonalized_meals(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of personalized_meals().
+    """
+    return await _arun_llm_node('personalized_meals', state, config, _personalized_meals_prompt, _personalized_meals_result)
+
+
+
+
+def _calorie_macro_ai_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        "Calculate the total calorie count and macro breakdown for the provided meals. Compare it with the target and return recommendations.",
+        {
+            'Target Calories': state['target_calories'],
+            'Macros Target': state['macros_target'],
+            'Micros Needed': state['micros_needed'],
+            'Meal Plan': meal_calories(state['meals']),
+        },
+        '{"total_calories":...,"actual_macros":{"protein":"...g","carbs":"...g","fat":"...g"},"recommendation":"..."}',
+    )
+
+
+def _calorie_macro_ai_local(state: Dietplan_State) -> dict:
+    totals = meal_totals(state['meals'])
+    return {
+        'total_calories': totals['total_calories'],
+        'actual_macros': totals['actual_macros'],
+        'recommendation': compare_with_targets(totals, state['target_calories'], state['macros_target']),
+    }
+
+
+def _calorie_macro_ai_result(state: Dietplan_State, response_json: dict) -> dict:
+    return {
+        'total_calories': response_json.get('total_calories', None),
+        'actual_macros': response_json.get('actual_macros', None),
+        'recommendation': response_json.get('recommendation', None),
+    }
+
+
+def calorie_macro_ai(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Finalizes calorie and macronutrient mapping to selected meals.
+
+    Totals come from the bundled food-composition table (food_table.py) and are compared with the
+    targets locally; the LLM is only asked when "calorie_macro_ai" is listed in the run's llm_overrides.
+    """
+    if use_llm(config, 'calorie_macro_ai'):
+        return _run_llm_node('calorie_macro_ai', state, config, _calorie_macro_ai_prompt, _calorie_macro_ai_result, _calorie_macro_ai_local)
+    return _calorie_macro_ai_local(state)
+
+
+async def acalorie_macro_ai(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of calorie_macro_ai().
+    """
+    if use_llm(config, 'calorie_macro_ai'):
+        return await _arun_llm_node('calorie_macro_ai', state, config, _calorie_macro_ai_prompt, _calorie_macro_ai_result, _calorie_macro_ai_local)
+    return _calorie_macro_ai_local(state)
+
+
+
+
+def _supplement_advisor_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        "Based on the meal plan and patient profile, recommend any nutritional supplements that may help achieve the goal.",
+        {
+            'Medical Conditions': state['medical_conditions'],
+            'Diet Type': state['diet_type'],
+            'Allergies': state['allergies'],
+            'Macros Target': state['macros_target'],
+            'Micronutrient Needs': state['micros_needed'],
+            'Goal Class': state['goal_class'],
+            'Meal Plan': meal_items(state['meals']),
+        },
+        '{"supplements":[...],"notes":"..."}',
+    )
+
+
+def _supplement_advisor_result(state: Dietplan_State, response_json: dict) -> dict:
+    return {'supplements': response_json.get('supplements', None), 'notes': response_json.get('notes', None)}
+
+
+def supplement_advisor(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Suggests supplements based on deficiencies, goal, and medical conditions.
+    """
+    return _run_llm_node('supplement_advisor', state, config, _supplement_advisor_prompt, _supplement_advisor_result)
+
+
+async def asupplement_advisor(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of supplement_advisor().
+    """
+    return await _arun_llm_node('supplement_advisor', state, config, _supplement_advisor_prompt, _supplement_advisor_result)
+
+
+
+
+def _hydration_tips_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        "Suggest personalized hydration advice and 2-3 lifestyle tips for wellness.",
+        {'BMI': state['bmi'], 'Climate': 'monsoon', 'Activity Level': state['activity_level']},
+        '{"water_intake":"... liters/day","tips":["...","...","..."]}',
+    )
+
+
+def _hydration_tips_result(state: Dietplan_State, response_json: dict) -> dict:
+    return {'water_intake': response_json.get('water_intake', None), 'tips': response_json.get('tips', None)}
+
+
+def hydration_tips(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Provides daily water intake tips based on activity and weather (optional live info).
+    """
+    return _run_llm_node('hydration_tips', state, config, _hydration_tips_prompt, _hydration_tips_result)
+
+
+async def ahydration_tips(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of hydration_tips().
+    """
+    return await _arun_llm_node('hydration_tips', state, config, _hydration_tips_prompt, _hydration_tips_result)
+
+
+
+
+def _motivation_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        "Write two short, warm motivational lines for the patient's diet plan report: one to open it and one to close it.",
+        {
+            'Name': state['name'],
+            'Health Goal': state['goal_class'],
+            'Stated Goal(by user)': state['primary_goal'],
+            'Medical Conditions': state['medical_conditions'],
+        },
+        '{"opening":"...","closing":"..."}',
+    )
+
+
+def _motivation_local(state: Dietplan_State) -> dict:
+    return {'motivation': default_motivation(state.get('goal_class'))}
+
+
+def _motivation_result(state: Dietplan_State, response_json: dict) -> dict:
+    if not (response_json.get('opening') and response_json.get('closing')):
+        return _motivation_local(state)
+    return {'motivation': {'opening': str(response_json['opening']), 'closing': str(response_json['closing'])}}
+
+
+def _use_motivation_llm(config: RunnableConfig) -> bool:
+    # the prose is only needed for the templated report, and runs can turn it off with "report_prose": False
+    configurable = (config or {}).get('configurable', {})
+    return configurable.get('report_prose', True) and not use_llm(config, 'pdf_generator')
+
+
+def motivation(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Writes the motivational opening and closing lines of the report.
+
+    This is the only prose the templated report asks the LLM for; it needs nothing but the profile,
+    so it runs alongside the planning nodes instead of at the end.
+    """
+    if _use_motivation_llm(config):
+        return _run_llm_node('motivation', state, config, _motivation_prompt, _motivation_result, _motivation_local)
+    return _motivation_local(state)
+
+
+async def amotivation(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of motivation().
+    """
+    if _use_motivation_llm(config):
+        return await _arun_llm_node('motivation', state, config, _motivation_prompt, _motivation_result, _motivation_local)
+    return _motivation_local(state)
+
+
+
+
+PDF_REPORT_INSTRUCTIONS = """
+    You are a professional assistant creating a comprehensive, friendly, and beautifully formatted **diet plan report** for a patient. The output will be used in a **PDF**, so make it visually structured, rich in details, and warm in tone.
+
+    Use headings and subheadings, bullet points, quotes and health facts, tables for meal plans, motivational messages and final health notes.
+
+    Use the following data (JSON values) to construct the report:
+    """
+
+PDF_REPORT_LAYOUT = """
+    Structure of the report:
+    1. Title with a quote
+    2. Patient summary
+    3. Medical warnings
+    4. Nutrition targets
+    5. Full meal plan as a table: | Meal | Time | Items | Calories |
+    6. Supplements and guidance
+    7. Water and lifestyle advice
+    8. Final motivational quote
+
+    Use markdown formatting and bullet points, e.g. > *"Let food be thy medicine and medicine be thy food."* - Hippocrates
+    Do not use emojis; the text is rendered to PDF.
+    """
+
+
+def _pdf_generator_prompt(state: Dietplan_State) -> str:
+    return build_prompt(
+        PDF_REPORT_INSTRUCTIONS,
+        {
+            'Name': state['name'],
+            'Age': state['age'],
+            'Gender': state['gender'],
+            'BMI': state['bmi'],
+            'Activity Level': state['activity_level'],
+            'Diet Type': state['diet_type'],
+            'Health Goal': state['goal_class'],
+            'Medical Conditions': state['medical_conditions'],
+            'Allergies': state['allergies'],
+            'Restrictions': state['restrictions'],
+            'Warnings': state['warnings'],
+            'Likes': state['likes'],
+            'Dislikes': state['dislikes'],
+            'Meal Frequency': state['meal_frequency'],
+            'Target Calories (kcal/day)': state['target_calories'],
+            'Macros Target (g)': state['macros_target'],
+            'Micronutrients Focus': state['micros_needed'],
+            'Daily Meal Plan': state['meals'],
+            'Supplements': state['supplements'],
+            'Supplement Notes': state['notes'],
+            'Water Intake': state['water_intake'],
+            'Lifestyle Tips': state['tips'],
+        },
+        footer=PDF_REPORT_LAYOUT,
+    )
+
+
+def _pdf_update(rendered: Rendered) -> dict:
+    """
+    Turns a render result into the pdf_generator state update, logging when the PDF came from the fallback.
+    """
+    if rendered.fallback_reason:
+        logger.warning("diet plan PDF rendered with the %s backend: %s", rendered.backend, rendered.fallback_reason)
+    return {'diet_plan_pdf': rendered.pdf, 'pdf_backend': rendered.backend, 'pdf_fallback': rendered.fallback_reason}
+
+
+def pdf_generator(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Compiles the full diet plan into a downloadable or shareable PDF.
+
+    The report is laid out from the state with the templates in report.py. Listing
+    "pdf_generator" in the run's llm_overrides has the LLM write the whole report instead; it is
+    then streamed to the run's on_report_chunk callback while it is generated.
+    """
+
+    on_chunk = report_callback(config)
+    if not use_llm(config, 'pdf_generator'):
+        with phase('report'):
+            response = build_report(state)
+        if on_chunk is not None:
+            on_chunk(response)
+    elif on_chunk is not None:
+        response = stream_response(_pdf_generator_prompt(state), config, on_chunk, 'pdf_generator')
+    else:
+        response = get_response(_pdf_generator_prompt(state), config, 'pdf_generator')
+
+    with phase('render'):
+        rendered = get_render_pool().render(render_page(response))
+    return _pdf_update(rendered)
+
+
+async def apdf_generator(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of pdf_generator(). The PDF is rendered on the render pool's workers, so the loop is not blocked.
+    """
+
+    on_chunk = report_callback(config)
+    if not use_llm(config, 'pdf_generator'):
+        with phase('report'):
+            response = build_report(state)
+        if on_chunk is not None:
+            on_chunk(response)
+    elif on_chunk is not None:
+        response = await astream_response(_pdf_generator_prompt(state), config, on_chunk, 'pdf_generator')
+    else:
+        response = await aget_response(_pdf_generator_prompt(state), config, 'pdf_generator')
+
+    with phase('render'):
+        rendered = await asyncio.wrap_future(get_render_pool().submit(render_page(response)))
+    return _pdf_update(rendered)
+
+
+
+# Prompt fusion: the five nodes that only read patient inputs can be answered by one request.
+# Each entry is (instruction, JSON shape) for one section of the fused reply; sections are
+# validated with the same schemas as the separate nodes' replies.
+FUSED_SECTIONS = {
+    'goal_class': (
+        "Classify the primary health goal as one of weight_loss, muscle_gain, maintenance, child_diet, clinical_diet.",
+        '{"goal_class":"..."}',
+    ),
+    'medical_conditions': (
+        "List the dietary restrictions and medical cautions to consider for the medical conditions and allergies.",
+        '{"restrictions":[...],"warnings":[...]}',
+    ),
+    'habits': (
+        "From the eating habits and preferences, list food preferences, cultural restrictions and foods to avoid to achieve the goal.",
+        '{"preferences":[...],"avoid":[...]}',
+    ),
+    'activity_level': (
+        "Classify the physical activity level as sedentary, light, moderate, active or very_active and suggest a protein intake multiplier (1.0-2.0).",
+        '{"activity_level":"...","protein_multiplier":...}',
+    ),
+    'routine_time': (
+        "Create an ideal daily meal schedule from the wake and sleep times and meal frequency, with meal names (breakfast, lunch, dinner, snack_1, ...) and suggested times.",
+        '{"meal_schedule":{"breakfast":"...","lunch":"...","dinner":"...","snack_1":"..."}}',
+    ),
+}
+FUSED_NODE = 'profile_analysis'
+# Nodes whose section is asked of the LLM by default; the others join only through llm_overrides.
+_FUSED_LOCAL_NODES = ('goal_class', 'routine_time')
+
+
+def _fused_sections(config: RunnableConfig) -> list:
+    return [name for name in FUSED_SECTIONS if name not in _FUSED_LOCAL_NODES or use_llm(config, name)]
+
+
+def _profile_analysis_prompt(state: Dietplan_State, sections: list) -> str:
+    bmi = calculate_bmi(state['weight_kg'], state['height_m'])
+    tasks = '\n'.join(f'- "{name}": {FUSED_SECTIONS[name][0]}' for name in sections)
+    shape = ','.join(f'"{name}":{FUSED_SECTIONS[name][1]}' for name in sections)
+    return build_prompt(
+        "You are a clinical dietitian. Answer every task below for this patient.",
+        {
+            'Age': state['age'],
+            'Gender': state['gender'],
+            'BMI': f"{bmi:.1f}",
+            'Stated Goal(by user)': state['primary_goal'],
+            'Diet Type': state['diet_type'],
+            'Medical Conditions': state['medical_conditions'],
+            'Allergies': state['allergies'],
+            'Likes': state['likes'],
+            'Dislikes': state['dislikes'],
+            'Snacks at supper': state['supper_snacks'],
+            'Breakfast': state['breakfast'],
+            'Lunch': state['lunch'],
+            'Dinner': state['dinner'],
+            'Activity Description': state['activity_level_description'],
+            'Wake Time': state['wake_time'],
+            'Sleep Time': state['sleep_time'],
+            'Meal Frequency': state['meal_frequency'],
+        },
+        f"{{{shape}}} (one object per task)",
+        footer=f"Tasks:\n{tasks}",
+    )
+
+
+def _valid_section(name: str, section) -> dict:
+    """
+    Validates one section of the fused reply against the node's schema.
+
+    Returns:
+        dict: The validated section, or None when it is missing or invalid.
+    """
+    try:
+        return validate_output(name, section)
+    except ValueError:
+        return None
+
+
+def _split_fused(state: Dietplan_State, config: RunnableConfig, sections: list, response_json: dict):
+    """
+    Maps the valid sections of the fused reply onto state keys.
+
+    Returns:
+        tuple: (state update, names of the sections that must be asked again one by one)
+    """
+    update, retry = {}, []
+    for name in sections:
+        section = _valid_section(name, (response_json or {}).get(name))
+        if section is not None:
+            update.update(_FUSED_PARSERS[name](state, section))
+        else:
+            logger.warning("%s: section '%s' failed validation, asking %s separately", FUSED_NODE, name, name)
+            record_error('invalid_section')
+            retry.append(name)
+    # sections that are local by default are computed here, not asked of the LLM
+    for name in FUSED_SECTIONS:
+        if name not in sections:
+            update.update(NODES[name][0](state, config))
+    return update, retry
+
+
+def profile_analysis(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Answers goal_class, medical_conditions, habits, activity_level and routine_time with one LLM call.
+
+    The reply is split back into the same state keys the separate nodes write. Any section that is
+    missing or fails validation falls back to its own node, so a partial answer costs only the
+    calls for the sections it got wrong.
+    """
+    sections = _fused_sections(config)
+    try:
+        response = get_response(_profile_analysis_prompt(state, sections), config, FUSED_NODE, extract_json)
+        with phase('parse'):
+            response_json = get_JSON(response)
+    except Exception as e:
+        logger.error("Error in %s: %s", FUSED_NODE, e)
+        record_error('fallback')
+        response_json = {}
+
+    update, retry = _split_fused(state, config, sections, response_json)
+    for name in retry:
+        update.update(NODES[name][0](state, config) or {})
+    return update
+
+
+async def aprofile_analysis(state: Dietplan_State, config: RunnableConfig = None) -> Dietplan_State:
+    """
+    Async variant of profile_analysis(); failed sections are retried concurrently.
+    """
+    sections = _fused_sections(config)
+    try:
+        response = await aget_response(_profile_analysis_prompt(state, sections), config, FUSED_NODE, extract_json)
+        with phase('parse'):
+            response_json = get_JSON(response)
+    except Exception as e:
+        logger.error("Error in %s: %s", FUSED_NODE, e)
+        record_error('fallback')
+        response_json = {}
+
+    update, retry = _split_fused(state, config, sections, response_json)
+    for result in await asyncio.gather(*(NODES[name][1](state, config) for name in retry)):
+        update.update(result or {})
+    return update
+
+
+_FUSED_PARSERS = {
+    'goal_class': _goal_class_result,
+    'medical_conditions': _medical_conditions_result,
+    'habits': _habits_result,
+    'activity_level': _activity_level_result,
+    'routine_time': _routine_time_result,
+}
+
+
+
+# Node name -> (sync node, async node), in the order they are added to the graph.
+NODES = {
+    'goal_class': (goal_class, agoal_class),
+    'medical_conditions': (medical_conditions, amedical_conditions),
+    'habits': (habits, ahabits),
+    'activity_level': (activity_level, aactivity_level),
+    'routine_time': (routine_time, aroutine_time),
+    'nutrient_need': (nutrient_need, anutrient_need),
+    'meal_filter': (meal_filter, ameal_filter),
+    'personalized_meals': (personalized_meals, apersonalized_meals),
+    'calorie_macro_ai': (calorie_macro_ai, acalorie_macro_ai),
+    'supplement_advisor': (supplement_advisor, asupplement_advisor),
+    'hydration_tips': (hydration_tips, ahydration_tips),
+    'motivation': (motivation, amotivation),
+    'pdf_generator': (pdf_generator, apdf_generator),
+}
+
+
+
+# State keys each node reads and writes. Get_workflow() derives the graph edges from these,
+# so a node's prompt and its entry here must change together. "llm" marks nodes that make a
+# model round-trip by default and is used to weigh the critical path.
+NODE_IO = {
+    'goal_class': {
+        'reads': ('age', 'gender', 'weight_kg', 'height_m', 'primary_goal'),
+        'writes': ('goal_class', 'bmi'),
+        'llm': False,
+    },
+    'medical_conditions': {
+        'reads': ('medical_conditions', 'allergies'),
+        'writes': ('restrictions', 'warnings'),
+        'llm': True,
+    },
+    'habits': {
+        'reads': ('primary_goal', 'diet_type', 'likes', 'dislikes', 'supper_snacks', 'breakfast', 'lunch', 'dinner'),
+        'writes': ('preferences', 'avoid'),
+        'llm': True,
+    },
+    'activity_level': {
+        'reads': ('activity_level_description',),
+        'writes': ('activity_level', 'protein_multiplier'),
+        'llm': True,
+    },
+    'routine_time': {
+        'reads': ('wake_time', 'sleep_time', 'meal_frequency'),
+        'writes': ('meal_schedule',),
+        'llm': False,
+    },
+    'nutrient_need': {
+        'reads': ('age', 'gender', 'weight_kg', 'height_m', 'bmi', 'goal_class', 'activity_level', 'protein_multiplier', 'diet_type'),
+        'writes': ('target_calories', 'macros_target', 'micros_needed'),
+        'llm': False,
+    },
+    'meal_filter': {
+        'reads': ('diet_type', 'allergies', 'preferences', 'restrictions', 'avoid', 'likes', 'dislikes'),
+        'writes': ('allowed_meals',),
+        'llm': False,
+    },
+    'personalized_meals': {
+        'reads': ('goal_class', 'target_calories', 'meal_schedule', 'allowed_meals', 'macros_target', 'micros_needed'),
+        'writes': ('meals',),
+        'llm': True,
+    },
+    'calorie_macro_ai': {
+        'reads': ('target_calories', 'macros_target', 'micros_needed', 'meals'),
+        'writes': ('total_calories', 'actual_macros', 'recommendation'),
+        'llm': False,
+    },
+    'supplement_advisor': {
+        'reads': ('medical_conditions', 'diet_type', 'allergies', 'macros_target', 'micros_needed', 'goal_class', 'meals'),
+        'writes': ('supplements', 'notes'),
+        'llm': True,
+    },
+    'hydration_tips': {
+        'reads': ('bmi', 'activity_level'),
+        'writes': ('water_intake', 'tips'),
+        'llm': True,
+    },
+    'motivation': {
+        'reads': ('name', 'goal_class', 'primary_goal', 'medical_conditions'),
+        'writes': ('motivation',),
+        'llm': True,
+    },
+    'pdf_generator': {
+        'reads': (
+            'name', 'age', 'gender', 'bmi', 'activity_level', 'diet_type', 'goal_class',
+            'medical_conditions', 'allergies', 'restrictions', 'warnings', 'avoid', 'likes', 'dislikes',
+            'meal_frequency', 'meal_schedule', 'target_calories', 'macros_target', 'micros_needed', 'meals',
+            'total_calories', 'actual_macros', 'recommendation', 'supplements', 'notes', 'water_intake',
+            'tips', 'motivation',
+        ),
+        'writes': ('diet_plan_pdf', 'pdf_backend', 'pdf_fallback'),
+        'llm': False,
+    },
+}
+
+
+
+# The fused node reads and writes everything the nodes it replaces do.
+FUSED_NODE_IO = {
+    'reads': tuple(dict.fromkeys(key for name in FUSED_SECTIONS for key in NODE_IO[name]['reads'])),
+    'writes': tuple(dict.fromkeys(key for name in FUSED_SECTIONS for key in NODE_IO[name]['writes'])),
+    'llm': True,
+}
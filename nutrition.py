@@ -0,0 +1,195 @@
+import re
+
+import numpy as np
+
+
+# Mifflin-St Jeor sex constant (kcal/day); genders without a sex-specific equation use the midpoint.
+SEX_OFFSETS = {'MALE': 5.0, 'FEMALE': -161.0}
+DEFAULT_SEX_OFFSET = -78.0
+
+ACTIVITY_FACTORS = {'SEDENTARY': 1.2, 'LIGHT': 1.375, 'MODERATE': 1.55, 'ACTIVE': 1.725, 'VERY_ACTIVE': 1.9}
+DEFAULT_ACTIVITY = 'MODERATE'
+
+# Protein grams per kg of body weight when the activity node gives no multiplier.
+PROTEIN_MULTIPLIERS = {'SEDENTARY': 0.8, 'LIGHT': 1.0, 'MODERATE': 1.2, 'ACTIVE': 1.5, 'VERY_ACTIVE': 1.8}
+PROTEIN_MULTIPLIER_RANGE = (0.8, 2.2)
+
+GOAL_CLASSES = {'LOSE_WEIGHT': 'WEIGHT_LOSS', 'GAIN_WEIGHT': 'WEIGHT_GAIN', 'MAINTAIN_WEIGHT': 'MAINTENANCE', 'MUSCLE_GAIN': 'WEIGHT_GAIN'}
+GOAL_ADJUSTMENTS = {'WEIGHT_LOSS': -500.0, 'WEIGHT_GAIN': 350.0, 'MAINTENANCE': 0.0, 'CLINICAL_DIET': 0.0, 'CHILD_DIET': 0.0}
+CHILD_AGE = 18
+
+MIN_CALORIES = {'MALE': 1500.0, 'FEMALE': 1200.0}
+DEFAULT_MIN_CALORIES = 1200.0
+FAT_ENERGY_SHARE = 0.28
+MIN_CARBS_G = 100.0
+
+KCAL_PER_G = {'protein': 4.0, 'carbs': 4.0, 'fat': 9.0}
+
+
+def _enum(value, default: str = None) -> str:
+    """
+    Normalizes free-form labels such as "Lose weight" or "very active" to the enum style used in the state.
+    """
+    if value is None:
+        return default
+    label = re.sub(r'[\s\-]+', '_', str(value).strip()).upper()
+    return label or default
+
+
+def normalize_gender(gender) -> str:
+    return _enum(gender, 'OTHER')
+
+
+def normalize_activity(activity_level) -> str:
+    label = _enum(activity_level, DEFAULT_ACTIVITY)
+    return label if label in ACTIVITY_FACTORS else DEFAULT_ACTIVITY
+
+
+def normalize_diet_type(diet_type) -> str:
+    return _enum(diet_type, 'NON_VEGETARIAN')
+
+
+def normalize_goal_class(goal) -> str:
+    label = _enum(goal, 'MAINTENANCE')
+    if label in GOAL_ADJUSTMENTS:
+        return label
+    return GOAL_CLASSES.get(label, 'MAINTENANCE')
+
+
+def classify_goal(primary_goal, age) -> str:
+    """
+    Maps the user's stated goal to a goal class. Children always get CHILD_DIET.
+
+    Args:
+        primary_goal (str): The stated goal, e.g. "LOSE_WEIGHT" or "Lose weight".
+        age (int): The patient's age in years.
+
+    Returns:
+        str: One of the Dietplan_State goal_class values.
+    """
+    if age is not None and age < CHILD_AGE:
+        return 'CHILD_DIET'
+    return normalize_goal_class(primary_goal)
+
+
+def parse_grams(value) -> float:
+    """
+    Reads a gram amount that may come back from the LLM as a number or a string like "120g".
+
+    Returns:
+        float: The amount in grams, or None when it cannot be read.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r'\d+(?:\.\d+)?', str(value or ''))
+    return float(match.group(0)) if match else None
+
+
+def compute_targets_batch(profiles: list) -> dict:
+    """
+    Computes BMI, daily calorie targets and macro targets for many profiles at once.
+
+    Energy uses the Mifflin-St Jeor BMR times an activity factor plus a goal delta, floored at a
+    safe minimum. Protein is protein_multiplier x weight, fat a fixed share of energy and carbs the
+    remainder (with a floor; fat absorbs the difference when protein is high).
+
+    Args:
+        profiles (list): Dicts with age, gender, height_m, weight_kg, goal_class, activity_level
+            and optionally protein_multiplier.
+
+    Returns:
+        dict: Arrays keyed by "bmi", "target_calories", "protein", "carbs" and "fat", aligned with profiles.
+    """
+    n = len(profiles)
+    age = np.empty(n)
+    height = np.empty(n)
+    weight = np.empty(n)
+    sex_offset = np.empty(n)
+    floor = np.empty(n)
+    factor = np.empty(n)
+    delta = np.empty(n)
+    multiplier = np.empty(n)
+
+    for i, profile in enumerate(profiles):
+        gender = normalize_gender(profile.get('gender'))
+        activity = normalize_activity(profile.get('activity_level'))
+        goal = normalize_goal_class(profile.get('goal_class'))
+
+        age[i] = profile['age']
+        height[i] = profile['height_m']
+        weight[i] = profile['weight_kg']
+        sex_offset[i] = SEX_OFFSETS.get(gender, DEFAULT_SEX_OFFSET)
+        floor[i] = MIN_CALORIES.get(gender, DEFAULT_MIN_CALORIES)
+        factor[i] = ACTIVITY_FACTORS[activity]
+        delta[i] = GOAL_ADJUSTMENTS.get(goal, 0.0)
+        multiplier[i] = profile.get('protein_multiplier') or PROTEIN_MULTIPLIERS[activity]
+
+    if np.any(height <= 0):
+        raise ValueError("Height cannot be zero or negative.")
+
+    bmi = weight / height ** 2
+    bmr = 10.0 * weight + 625.0 * height - 5.0 * age + sex_offset
+    calories = np.maximum(bmr * factor + delta, floor)
+
+    protein = weight * np.clip(multiplier, *PROTEIN_MULTIPLIER_RANGE)
+    fat = calories * FAT_ENERGY_SHARE / KCAL_PER_G['fat']
+    carbs = (calories - protein * KCAL_PER_G['protein'] - fat * KCAL_PER_G['fat']) / KCAL_PER_G['carbs']
+
+    # keep a minimum of carbohydrate and take the shortfall out of fat
+    shortfall = np.maximum(MIN_CARBS_G - carbs, 0.0)
+    carbs = carbs + shortfall
+    fat = np.maximum(fat - shortfall * KCAL_PER_G['carbs'] / KCAL_PER_G['fat'], 0.0)
+
+    return {
+        'bmi': np.round(bmi, 1),
+        'target_calories': np.round(calories / 10.0) * 10.0,
+        'protein': np.round(protein),
+        'carbs': np.round(carbs),
+        'fat': np.round(fat),
+    }
+
+
+def compute_targets(profile: dict) -> dict:
+    """
+    Computes the targets for a single profile.
+
+    Args:
+        profile (dict): See compute_targets_batch().
+
+    Returns:
+        dict: {"bmi": float, "target_calories": int, "macros_target": {"protein": int, "carbs": int, "fat": int}}
+    """
+    result = compute_targets_batch([profile])
+    return {
+        'bmi': float(result['bmi'][0]),
+        'target_calories': int(result['target_calories'][0]),
+        'macros_target': {macro: int(result[macro][0]) for macro in ('protein', 'carbs', 'fat')},
+    }
+
+
+def micronutrient_focus(age, gender, diet_type, goal_class) -> list:
+    """
+    Lists the micronutrients to emphasise for a profile, following common dietary reference guidance.
+
+    Returns:
+        list[str]: Micronutrient names, most general first.
+    """
+    gender = normalize_gender(gender)
+    diet_type = normalize_diet_type(diet_type)
+    goal_class = normalize_goal_class(goal_class)
+
+    micros = ['fiber', 'calcium', 'vitamin D', 'potassium']
+    if gender == 'FEMALE' and 12 <= age <= 50:
+        micros += ['iron', 'folate']
+    if age >= 50:
+        micros += ['vitamin B12']
+    if diet_type in ('VEGAN', 'VEGETARIAN'):
+        micros += ['vitamin B12', 'iron', 'zinc']
+    if diet_type == 'VEGAN':
+        micros += ['omega-3', 'iodine']
+    if goal_class == 'WEIGHT_GAIN':
+        micros += ['magnesium']
+    if goal_class == 'CHILD_DIET':
+        micros += ['iron', 'zinc']
+
+    return list(dict.fromkeys(micros))
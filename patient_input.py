@@ -0,0 +1,62 @@
+import re
+
+from pydantic import ConfigDict, ValidationError, create_model
+
+from methods import Dietplan_State
+from scheduler import parse_clock
+from schemas import describe_error
+
+
+# Dietplan_State fields a patient record may set; everything else is computed by the workflow.
+INPUT_FIELDS = (
+    'name', 'age', 'gender', 'height_m', 'weight_kg', 'primary_goal', 'diet_type', 'allergies',
+    'medical_conditions', 'activity_level_description', 'wake_time', 'sleep_time', 'meal_frequency',
+    'supper_snacks', 'breakfast', 'lunch', 'dinner', 'likes', 'dislikes', 'water_intake',
+)
+# Input annotations that differ from Dietplan_State, where the key doubles as an output field.
+INPUT_TYPES = {'water_intake': float}
+ENUM_FIELDS = ('gender', 'primary_goal', 'diet_type')
+LIST_FIELDS = ('allergies', 'medical_conditions', 'likes', 'dislikes', 'supper_snacks', 'breakfast', 'lunch', 'dinner')
+
+
+def _input_model():
+    """
+    Builds a pydantic model of the input part of Dietplan_State, reusing its Field constraints and defaults.
+    """
+    fields = {}
+    for key in INPUT_FIELDS:
+        annotation = INPUT_TYPES.get(key, Dietplan_State.__annotations__[key])
+        fields[key] = (annotation, Dietplan_State.__dict__[key])
+    return create_model('PatientRecord', __config__=ConfigDict(extra='ignore'), **fields)
+
+
+PatientRecord = _input_model()
+
+
+def validate_record(record: dict) -> dict:
+    """
+    Validates a patient record against the input fields of Dietplan_State.
+
+    Enum fields are normalized first ("Non-vegetarian" -> "NON_VEGETARIAN"), and wake and sleep
+    times must be readable by the scheduler.
+
+    Args:
+        record (dict): The raw record.
+
+    Returns:
+        dict: The workflow's input state.
+
+    Raises:
+        ValueError: With a one-line description of everything that is wrong with the record.
+    """
+    record = dict(record)
+    for key in ENUM_FIELDS:
+        if isinstance(record.get(key), str):
+            record[key] = re.sub(r'[\s\-]+', '_', record[key].strip()).upper()
+    try:
+        state = PatientRecord.model_validate(record).model_dump()
+    except ValidationError as e:
+        raise ValueError(describe_error(e)) from None
+    for key in ('wake_time', 'sleep_time'):
+        parse_clock(state[key])
+    return state
@@ -0,0 +1,385 @@
+import concurrent.futures
+import logging
+import os
+import queue
+import shutil
+import textwrap
+import threading
+from html.parser import HTMLParser
+from typing import NamedTuple
+
+from instrumentation import profiled
+
+
+logger = logging.getLogger(__name__)
+
+
+# Locations the app used before the path became configurable; still tried when nothing else is set.
+LEGACY_WKHTMLTOPDF_PATHS = (
+    r"C:\Users\hassan\Desktop\Dietetian Agent\wkhtmltopdf\bin\wkhtmltopdf.exe",
+    r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe",
+)
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_TIMEOUT = 120.0
+# documents never need local files; this keeps file:// URLs in a report from being read into the PDF
+WKHTMLTOPDF_OPTIONS = {'encoding': 'UTF-8', 'quiet': '', 'disable-local-file-access': ''}
+
+
+def find_wkhtmltopdf(path: str = None) -> str:
+    """
+    Locates the wkhtmltopdf executable: the given path, WKHTMLTOPDF_PATH, the PATH, then the legacy locations.
+
+    Returns:
+        str: The executable path, or None when it is not installed.
+    """
+    for candidate in (path, os.environ.get('WKHTMLTOPDF_PATH')):
+        if candidate:
+            return candidate
+    found = shutil.which('wkhtmltopdf')
+    if found:
+        return found
+    return next((legacy for legacy in LEGACY_WKHTMLTOPDF_PATHS if os.path.exists(legacy)), None)
+
+
+class WkhtmltopdfBackend:
+    """
+    Renders HTML with wkhtmltopdf through pdfkit (one short-lived process per document).
+    """
+    name = 'wkhtmltopdf'
+
+    def __init__(self, path: str = None):
+        import pdfkit
+
+        self.path = find_wkhtmltopdf(path)
+        if not self.path:
+            raise RuntimeError("wkhtmltopdf not found; set WKHTMLTOPDF_PATH or install it on the PATH.")
+        self._pdfkit = pdfkit
+        self._configuration = pdfkit.configuration(wkhtmltopdf=self.path)
+
+    def render(self, html: str) -> bytes:
+        return self._pdfkit.from_string(html, False, configuration=self._configuration, options=WKHTMLTOPDF_OPTIONS)
+
+
+class WeasyPrintBackend:
+    """
+    Renders HTML in-process with WeasyPrint, when it is installed; preferred by make_backend("auto")
+    since the pool's long-lived workers then render without starting a process per document.
+    """
+    name = 'weasyprint'
+
+    def __init__(self):
+        import weasyprint
+
+        self._weasyprint = weasyprint
+
+    @staticmethod
+    def _fetch(url: str, *args, **kwargs):
+        # the page is self-contained; like wkhtmltopdf's disable-local-file-access, nothing is loaded
+        raise ValueError(f"not loading {url} into the PDF")
+
+    def render(self, html: str) -> bytes:
+        return self._weasyprint.HTML(string=html, url_fetcher=self._fetch).write_pdf()
+
+
+class _TextExtractor(HTMLParser):
+    """
+    Flattens HTML into (style, text) blocks: headings, paragraphs, list items and table rows.
+    """
+    BLOCKS = {'p', 'div', 'li', 'tr', 'blockquote', 'pre', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+    SKIP = {'head', 'style', 'script', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []
+        self._text = []
+        self._style = 'body'
+        self._skip = 0
+
+    def _flush(self):
+        text = ' '.join(''.join(self._text).split())
+        if text:
+            self.blocks.append((self._style, text))
+        self._text = []
+        self._style = 'body'
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip += 1
+        elif tag in self.BLOCKS:
+            self._flush()
+            self._style = tag if tag in ('h1', 'h2', 'h3') else 'bold' if tag in ('h4', 'h5', 'h6') else 'body'
+            if tag == 'li':
+                self._text.append('\u2022 ')
+        elif tag in ('td', 'th') and ''.join(self._text).strip():
+            self._text.append(' | ')
+        elif tag == 'br':
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skip = max(self._skip - 1, 0)
+        elif tag in self.BLOCKS:
+            self._flush()
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._text.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+class TextPdfBackend:
+    """
+    Dependency-free fallback: lays the document's text out on A4 pages with the built-in Helvetica fonts.
+
+    Styling, tables and images are reduced to plain text, and characters outside Windows-1252
+    (emoji) are dropped, but the plan is always delivered even without a PDF engine installed.
+    """
+    name = 'text'
+
+    PAGE_WIDTH, PAGE_HEIGHT, MARGIN = 595, 842, 50
+    STYLES = {'h1': ('F2', 18), 'h2': ('F2', 14), 'h3': ('F2', 12), 'bold': ('F2', 10), 'body': ('F1', 10)}
+
+    @staticmethod
+    def _escape(text: str) -> bytes:
+        data = text.encode('cp1252', errors='ignore')
+        return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+    def _pages(self, blocks: list) -> list:
+        pages, lines = [], []
+        y = self.PAGE_HEIGHT - self.MARGIN
+        for style, text in blocks:
+            font, size = self.STYLES[style]
+            # Helvetica averages about half an em per character
+            width = max(int((self.PAGE_WIDTH - 2 * self.MARGIN) / (size * 0.5)), 20)
+            if style != 'body':
+                y -= size * 0.6
+            for line in textwrap.wrap(text, width) or ['']:
+                if y - size * 1.4 < self.MARGIN:
+                    pages.append(lines)
+                    lines, y = [], self.PAGE_HEIGHT - self.MARGIN
+                y -= size * 1.4
+                lines.append(b'BT /%s %d Tf %d %.1f Td (%s) Tj ET' % (font.encode(), size, self.MARGIN, y, self._escape(line)))
+            y -= size * 0.4
+        pages.append(lines)
+        return pages
+
+    def render(self, html: str) -> bytes:
+        extractor = _TextExtractor()
+        extractor.feed(html)
+        extractor.close()
+        pages = self._pages(extractor.blocks)
+
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            None,  # page tree, filled in once the page objects are numbered
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+        ]
+        kids = []
+        for lines in pages:
+            stream = b'\n'.join(lines)
+            objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+            objects.append(
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>'
+                % (self.PAGE_WIDTH, self.PAGE_HEIGHT, len(objects))
+            )
+            kids.append(b'%d 0 R' % len(objects))
+        objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(kids), len(kids))
+
+        out = bytearray(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(out))
+            out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+        xref = len(out)
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+        out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+        return bytes(out)
+
+
+BACKENDS = {'weasyprint': WeasyPrintBackend, 'wkhtmltopdf': WkhtmltopdfBackend, 'text': TextPdfBackend}
+
+
+def make_backend(name: str = None, wkhtmltopdf_path: str = None):
+    """
+    Creates a rendering backend.
+
+    Args:
+        name (str): "weasyprint", "wkhtmltopdf", "text" or "auto" (default, also read from
+            PDF_RENDER_BACKEND), which picks the first one available in that order: WeasyPrint
+            renders in the pool's worker threads, wkhtmltopdf starts a process per document.
+        wkhtmltopdf_path (str): Explicit wkhtmltopdf executable, see find_wkhtmltopdf().
+
+    Returns:
+        The backend; it has a name and a render(html) -> bytes method.
+    """
+    name = name or os.environ.get('PDF_RENDER_BACKEND', 'auto')
+    if name == 'wkhtmltopdf':
+        return WkhtmltopdfBackend(wkhtmltopdf_path)
+    if name != 'auto':
+        return BACKENDS[name]()
+
+    try:
+        return WeasyPrintBackend()
+    except (ImportError, OSError):
+        pass
+    try:
+        return WkhtmltopdfBackend(wkhtmltopdf_path)
+    except (ImportError, RuntimeError, OSError):
+        pass
+    logger.warning("No HTML to PDF engine found, using the plain-text PDF backend")
+    return TextPdfBackend()
+
+
+class Rendered(NamedTuple):
+    pdf: bytes
+    backend: str                 # name of the backend that produced the PDF
+    fallback_reason: str = None  # why the pool's own backend was not used, when it failed
+
+
+class RenderPool:
+    """
+    A fixed set of long-lived worker threads that render HTML documents taken from a queue.
+
+    The backend is created once and shared by the workers, so the executable lookup and engine
+    setup happen once per process; the queue smooths bursts when many plans finish together and
+    workers bounds how many documents render at the same time. When the backend fails on a
+    document, it is rendered with the plain-text fallback instead; the result says so (see Rendered).
+    """
+
+    def __init__(self, backend=None, workers: int = DEFAULT_WORKERS, fallback=None):
+        self.backend = backend or make_backend()
+        self.fallback = fallback if fallback is not None else (TextPdfBackend() if self.backend.name != 'text' else None)
+        self.workers = max(1, workers)
+
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._counters = {'rendered': 0, 'fallbacks': 0, 'failed': 0}
+
+    def _ensure_started(self) -> None:
+        if not self._threads:
+            with self._lock:
+                while len(self._threads) < self.workers:
+                    thread = threading.Thread(target=self._work, name=f'pdf-render-{len(self._threads)}', daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            html, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with profiled(f'pdf:{self.backend.name}'):
+                    result = Rendered(self.backend.render(html), self.backend.name)
+                counter = 'rendered'
+            except Exception as e:
+                if self.fallback is None:
+                    with self._lock:
+                        self._counters['failed'] += 1
+                    future.set_exception(e)
+                    continue
+                logger.warning("%s failed (%s); rendering with the %s backend", self.backend.name, e, self.fallback.name)
+                try:
+                    with profiled(f'pdf:{self.fallback.name}'):
+                        result = Rendered(self.fallback.render(html), self.fallback.name, f"{self.backend.name} failed: {e}")
+                    counter = 'fallbacks'
+                except Exception as fallback_error:
+                    with self._lock:
+                        self._counters['failed'] += 1
+                    future.set_exception(fallback_error)
+                    continue
+            with self._lock:
+                self._counters[counter] += 1
+            future.set_result(result)
+
+    def submit(self, html: str) -> concurrent.futures.Future:
+        """
+        Queues a document for rendering.
+
+        Returns:
+            concurrent.futures.Future: Resolves to a Rendered (the PDF bytes and the backend used).
+        """
+        self._ensure_started()
+        future = concurrent.futures.Future()
+        self._queue.put((html, future))
+        return future
+
+    def render(self, html: str, timeout: float = DEFAULT_TIMEOUT) -> Rendered:
+        """
+        Renders one HTML document and waits for the PDF.
+        """
+        return self.submit(html).result(timeout=timeout)
+
+    def render_many(self, documents, timeout: float = DEFAULT_TIMEOUT) -> list:
+        """
+        Renders many HTML documents in one call, spread over all workers.
+
+        Args:
+            documents (iterable[str]): The HTML documents.
+            timeout (float): Seconds to wait for each document.
+
+        Returns:
+            list[Rendered]: The PDFs, in the order of the documents.
+        """
+        futures = [self.submit(html) for html in documents]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(backend=self.backend.name, workers=self.workers, queued=self._queue.qsize())
+        return stats
+
+    def shutdown(self) -> None:
+        """
+        Stops the workers after the documents already queued.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_render_pool() -> RenderPool:
+    """
+    Returns the process-wide render pool. PDF_RENDER_BACKEND, PDF_RENDER_WORKERS and
+    WKHTMLTOPDF_PATH configure it on first use.
+    """
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                workers = int(os.environ.get('PDF_RENDER_WORKERS', DEFAULT_WORKERS))
+                _POOL = RenderPool(make_backend(), workers=workers)
+    return _POOL
+
+
+def configure_render_pool(backend: str = None, workers: int = DEFAULT_WORKERS, wkhtmltopdf_path: str = None) -> RenderPool:
+    """
+    Replaces the process-wide render pool, e.g. from a CLI flag or at app start-up.
+
+    Returns:
+        RenderPool: The new pool.
+    """
+    global _POOL
+    pool = RenderPool(make_backend(backend, wkhtmltopdf_path), workers=workers)
+    with _POOL_LOCK:
+        previous, _POOL = _POOL, pool
+    if previous is not None:
+        previous.shutdown()
+    return pool
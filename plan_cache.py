@@ -0,0 +1,405 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from scheduler import parse_clock
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PLAN_DIR = os.environ.get(
+    'DIET_PLAN_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'plans'),
+)
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MEMORY_PLANS = 128
+PRUNE_INTERVAL_SECONDS = 3600
+# Set on a coalesced run's future when its leader was cancelled: the waiters try again themselves.
+_RETRY = object()
+_CANCELLED = (asyncio.CancelledError, concurrent.futures.CancelledError)
+# Bump when a change to the workflow should invalidate every stored plan.
+PLAN_CACHE_VERSION = 1
+
+# Dietplan_State input fields and how each is canonicalized. Floats are bucketed so that
+# entries differing only by form rounding (1.75 m vs 1.751 m) share a plan.
+FLOAT_BUCKETS = {'height_m': 0.01, 'weight_kg': 0.5, 'water_intake': 0.25, 'water_intake_liters': 0.25}
+ENUM_FIELDS = ('gender', 'primary_goal', 'diet_type')
+TEXT_FIELDS = ('activity_level_description',)
+LIST_FIELDS = ('allergies', 'medical_conditions', 'likes', 'dislikes', 'supper_snacks', 'breakfast', 'lunch', 'dinner')
+TIME_FIELDS = ('wake_time', 'sleep_time')
+INT_FIELDS = ('age', 'meal_frequency')
+# The name is printed on the PDF, so only its spacing is normalized.
+DISPLAY_FIELDS = ('name',)
+
+
+def _text(value) -> str:
+    return re.sub(r'\s+', ' ', str(value)).strip().lower()
+
+
+def _bucket(value, step: float) -> float:
+    return round(round(float(value) / step) * step, 4)
+
+
+def canonical_profile(state: dict) -> dict:
+    """
+    Reduces the input part of a Dietplan_State to a canonical form.
+
+    Text is lower-cased with whitespace collapsed (enum-like fields also map "Non-vegetarian"
+    and "NON_VEGETARIAN" together), list fields are de-duplicated and sorted,
+    times become minutes since midnight and floats are bucketed. Output fields are ignored.
+
+    Args:
+        state (dict): The submitted state.
+
+    Returns:
+        dict: The canonical profile; equal profiles produce equal dicts.
+    """
+    profile = {}
+    for key in DISPLAY_FIELDS:
+        if state.get(key) is not None:
+            profile[key] = re.sub(r'\s+', ' ', str(state[key])).strip()
+    for key in ENUM_FIELDS:
+        if state.get(key) is not None:
+            profile[key] = re.sub(r'[\s\-]+', '_', _text(state[key]))
+    for key in TEXT_FIELDS:
+        if state.get(key) is not None:
+            profile[key] = _text(state[key])
+    for key in LIST_FIELDS:
+        value = state.get(key)
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = [value]
+        profile[key] = sorted({_text(v) for v in value if str(v).strip()})
+    for key in TIME_FIELDS:
+        if state.get(key) is not None:
+            try:
+                profile[key] = parse_clock(state[key])
+            except ValueError:
+                profile[key] = _text(state[key])
+    for key in INT_FIELDS:
+        if state.get(key) is not None:
+            profile[key] = int(state[key])
+    for key, step in FLOAT_BUCKETS.items():
+        if state.get(key) is not None:
+            profile[key] = _bucket(state[key], step)
+    return profile
+
+
+def profile_key(state: dict, config: dict = None) -> str:
+    """
+    Hashes the canonical profile together with the model settings of the run config.
+
+    Returns:
+        str: A hex SHA-256 digest identifying the plan.
+    """
+    configurable = (config or {}).get('configurable', {})
+    payload = {
+        'version': PLAN_CACHE_VERSION,
+        'profile': canonical_profile(state),
+        'model': configurable.get('model'),
+        'provider': configurable.get('provider'),
+        'llm_overrides': sorted(configurable.get('llm_overrides', ())),
+        'report_prose': configurable.get('report_prose', True),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class PlanCache:
+    """
+    Stores finished plans by profile key in a content-addressed blob store.
+
+    The final state (as JSON) and the PDF are written once as blobs named by the SHA-256 of their
+    bytes; a small index file maps each profile key to its two blobs. Recently used plans are also
+    kept in memory. Concurrent runs for the same key are coalesced: the first caller runs the
+    workflow and the others wait for its result. If that caller is cancelled, the first waiter
+    takes over and runs the workflow instead of failing with it. Expired plans are deleted when read, and by a
+    background prune() at most every PRUNE_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, directory: str = DEFAULT_PLAN_DIR, ttl: float = DEFAULT_TTL_SECONDS, max_memory_plans: int = DEFAULT_MEMORY_PLANS):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_memory_plans = max_memory_plans
+
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0, 'stores': 0, 'expired': 0}
+        self._next_prune = 0.0
+
+    # ---- blob store ----------------------------------------------------
+
+    def _path(self, kind: str, name: str) -> str:
+        return os.path.join(self.directory, kind, name[:2], name)
+
+    def _write(self, path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+    def _put_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path('blobs', digest)
+        if os.path.exists(path):
+            # refresh the age, so a blob a live plan still uses never looks expired
+            os.utime(path)
+        else:
+            self._write(path, data)
+        return digest
+
+    def _get_blob(self, digest: str) -> bytes:
+        with open(self._path('blobs', digest), 'rb') as f:
+            return f.read()
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _expire(self, key: str, index: dict) -> None:
+        """
+        Deletes an expired plan's index file, and its blobs unless a newer plan stored them since.
+        """
+        self._remove(self._path('index', key))
+        cutoff = time.time() - self.ttl
+        for digest in (index.get('state'), index.get('pdf')):
+            path = self._path('blobs', digest) if digest else None
+            try:
+                if path and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._counters['expired'] += 1
+
+    # ---- plans ---------------------------------------------------------
+
+    def _remember(self, key: str, expires: float, state: dict) -> None:
+        with self._lock:
+            self._memory[key] = (expires, state)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_plans:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """
+        Returns the stored final state (including diet_plan_pdf) for a profile key, or None.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] >= now:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return dict(entry[1])
+            self._memory.pop(key, None)
+
+        try:
+            with open(self._path('index', key), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index['expires'] < now:
+                self._expire(key, index)
+                return None
+            state = json.loads(self._get_blob(index['state']).decode('utf-8'))
+            if index.get('pdf'):
+                state['diet_plan_pdf'] = self._get_blob(index['pdf'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+        with self._lock:
+            self._counters['disk_hits'] += 1
+        self._remember(key, index['expires'], state)
+        return dict(state)
+
+    def set(self, key: str, state: dict) -> None:
+        """
+        Stores a finished plan. The PDF is kept as its own blob; everything else as JSON.
+        """
+        self._maybe_prune()
+        state = dict(state)
+        pdf = state.pop('diet_plan_pdf', None)
+        expires = time.time() + self.ttl
+        index = {
+            'state': self._put_blob(json.dumps(state, sort_keys=True, default=str).encode('utf-8')),
+            'pdf': self._put_blob(pdf) if pdf else None,
+            'expires': expires,
+        }
+        self._write(self._path('index', key), json.dumps(index).encode('utf-8'))
+        if pdf:
+            state['diet_plan_pdf'] = pdf
+        self._remember(key, expires, state)
+        with self._lock:
+            self._counters['stores'] += 1
+
+    def prune(self) -> int:
+        """
+        Deletes expired plans and the blobs no live plan has stored within the TTL.
+
+        Returns:
+            int: The number of plans deleted.
+        """
+        now = time.time()
+        removed = 0
+        for root, _, files in os.walk(os.path.join(self.directory, 'index')):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        expired = json.load(f)['expires'] < now
+                except (ValueError, KeyError):
+                    expired = os.path.getmtime(path) < now - self.ttl
+                except FileNotFoundError:
+                    continue
+                if expired:
+                    self._remove(path)
+                    removed += 1
+
+        cutoff = now - self.ttl
+        for root, _, files in os.walk(os.path.join(self.directory, 'blobs')):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+        logger.info("pruned %d cached plans", removed)
+        return removed
+
+    def _maybe_prune(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_prune:
+                return
+            self._next_prune = now + PRUNE_INTERVAL_SECONDS
+        threading.Thread(target=self._prune_quietly, name='plan-cache-prune', daemon=True).start()
+
+    def _prune_quietly(self) -> None:
+        try:
+            self.prune()
+        except OSError as e:
+            logger.warning("could not prune cached plans: %s", e)
+
+    # ---- coalesced runs ------------------------------------------------
+
+    def _claim(self, key: str):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._counters['coalesced'] += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self._inflight[key] = future
+            self._counters['misses'] += 1
+            return future, True
+
+    def _settle(self, key: str, future, result=None, error: BaseException = None) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        if isinstance(error, _CANCELLED):
+            # the leader's cancellation is its own; waiters re-claim the key and one of them runs
+            future.set_result(_RETRY)
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _store_if_complete(self, key: str, result: dict) -> None:
+        # only complete plans are cached; one without a PDF, with a node that fell back to a local
+        # or empty result, or with a PDF from the fallback renderer is produced again next time
+        if not result or not result.get('diet_plan_pdf'):
+            return
+        if result.get('degraded') or result.get('pdf_fallback'):
+            logger.info("not caching a degraded plan (pdf_fallback: %s)", result.get('pdf_fallback'))
+            return
+        self.set(key, result)
+
+    def get_or_run(self, state: dict, run, config: dict = None) -> dict:
+        """
+        Returns the cached plan for a profile, running the workflow once on a miss.
+
+        Args:
+            state (dict): The submitted Dietplan_State inputs.
+            run (callable): Runs the workflow and returns the final state.
+            config (dict): The run config; its model settings are part of the key.
+
+        Returns:
+            dict: The final state, including diet_plan_pdf.
+        """
+        key = profile_key(state, config)
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            future, leader = self._claim(key)
+            if leader:
+                break
+            result = future.result()
+            if result is not _RETRY:
+                return dict(result)
+        try:
+            result = run()
+            self._store_if_complete(key, result)
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result
+
+    async def aget_or_run(self, state: dict, run, config: dict = None) -> dict:
+        """
+        Async variant of get_or_run(); run is an async callable.
+        """
+        key = profile_key(state, config)
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            future, leader = self._claim(key)
+            if leader:
+                break
+            # shielded, so a waiter being cancelled does not cancel the shared future
+            result = await asyncio.shield(asyncio.wrap_future(future))
+            if result is not _RETRY:
+                return dict(result)
+        try:
+            result = await run()
+            self._store_if_complete(key, result)
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_plans'] = len(self._memory)
+        return stats
+
+
+_PLAN_CACHE = None
+_PLAN_CACHE_LOCK = threading.Lock()
+
+
+def get_plan_cache() -> PlanCache:
+    """
+    Returns the process-wide plan cache.
+    """
+    global _PLAN_CACHE
+    if _PLAN_CACHE is None:
+        with _PLAN_CACHE_LOCK:
+            if _PLAN_CACHE is None:
+                _PLAN_CACHE = PlanCache()
+    return _PLAN_CACHE
@@ -0,0 +1,186 @@
+import contextvars
+import json
+import textwrap
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from instrumentation import record_llm_call
+
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for budgeting and quota accounting (about four characters per token).
+    """
+    return len(text or '') // CHARS_PER_TOKEN + 1
+
+
+def compact(value) -> str:
+    """
+    Serializes a state value for a prompt: text as-is with whitespace collapsed, anything else as
+    minified JSON (no spaces, no ASCII escaping), which is far shorter than a Python repr.
+    """
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def build_prompt(instruction: str, fields: dict, respond: str = None, footer: str = None) -> str:
+    """
+    Lays out a node prompt: the dedented instruction, one "Label: value" line per field, then
+    the expected JSON reply.
+
+    Args:
+        instruction (str): What the model should do.
+        fields (dict): Label -> state value; only the fields the node needs.
+        respond (str): The JSON shape of the reply, e.g. '{"tips":[...]}'.
+        footer (str): Further instructions placed after the data.
+
+    Returns:
+        str: The prompt.
+    """
+    parts = [textwrap.dedent(instruction).strip(), '\n'.join(f"{label}: {compact(value)}" for label, value in fields.items())]
+    if footer:
+        parts.append(textwrap.dedent(footer).strip())
+    if respond:
+        parts.append(f"Respond in JSON: {respond}")
+    return '\n\n'.join(parts)
+
+
+def meal_items(meals: dict) -> dict:
+    """
+    Reduces a meal plan to {meal: [items]} for prompts that only need what is eaten.
+    """
+    reduced = {}
+    for name, details in (meals or {}).items():
+        reduced[name] = details.get('items', []) if isinstance(details, dict) else details
+    return reduced
+
+
+def meal_calories(meals: dict) -> dict:
+    """
+    Reduces a meal plan to {meal: {"items", "calories"}}, dropping the times.
+    """
+    reduced = {}
+    for name, details in (meals or {}).items():
+        if isinstance(details, dict):
+            reduced[name] = {key: details[key] for key in ('items', 'calories') if key in details}
+        else:
+            reduced[name] = details
+    return reduced
+
+
+def response_text(response) -> str:
+    """
+    Returns the text of a chat model reply, which may be a message or already a string
+    (batched and cached replies).
+    """
+    return getattr(response, 'content', response)
+
+
+def usage_tokens(prompt: str, response) -> tuple:
+    """
+    Returns (input tokens, output tokens) of one call: the provider's count from the reply's
+    usage_metadata when it carries one, else estimate_tokens() of the prompt and the reply text.
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    if usage:
+        return usage.get('input_tokens', 0), usage.get('output_tokens', 0)
+    return estimate_tokens(prompt), estimate_tokens(response_text(response))
+
+
+class TokenLedger:
+    """
+    Counts calls and input/output tokens per node (reported by the provider where available).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes = defaultdict(lambda: {'calls': 0, 'input_tokens': 0, 'output_tokens': 0})
+
+    def record(self, node: str, input_tokens: int, output_tokens: int) -> None:
+        with self._lock:
+            entry = self._nodes[node or 'llm']
+            entry['calls'] += 1
+            entry['input_tokens'] += input_tokens
+            entry['output_tokens'] += output_tokens
+
+    def snapshot(self) -> dict:
+        """
+        Returns {"nodes": {node: {"calls", "input_tokens", "output_tokens"}}, "total": {...}}.
+        """
+        with self._lock:
+            nodes = {node: dict(entry) for node, entry in self._nodes.items()}
+        total = {key: sum(entry[key] for entry in nodes.values()) for key in ('calls', 'input_tokens', 'output_tokens')}
+        return {'nodes': nodes, 'total': total}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._nodes.clear()
+
+
+_TOTALS = TokenLedger()
+_PLAN_LEDGER = contextvars.ContextVar('plan_token_ledger', default=None)
+
+
+def get_token_ledger() -> TokenLedger:
+    """
+    Returns the process-wide ledger (all plans since start-up).
+    """
+    return _TOTALS
+
+
+@contextmanager
+def plan_ledger():
+    """
+    Counts the tokens of the LLM calls made inside the block, e.g. one workflow run.
+
+    The ledger travels in a context variable, so calls from the run's threads and tasks are
+    included as long as they were started inside the block.
+
+    Yields:
+        TokenLedger: The plan's ledger.
+    """
+    ledger = TokenLedger()
+    token = _PLAN_LEDGER.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _PLAN_LEDGER.reset(token)
+
+
+def record_tokens(node: str, prompt: str, response, seconds: float = 0.0) -> None:
+    input_tokens, output_tokens = usage_tokens(prompt, response)
+    _TOTALS.record(node, input_tokens, output_tokens)
+    plan = _PLAN_LEDGER.get()
+    if plan is not None:
+        plan.record(node, input_tokens, output_tokens)
+    record_llm_call(node, input_tokens, output_tokens, seconds)
+
+
+def metered_call(node: str, prompt: str, call):
+    """
+    Makes an LLM call and records its input and output tokens and latency for the node
+    (the latter in the node's span, see instrumentation.py).
+
+    Wrap each single request, so every attempt that answers is counted, and let it return the
+    model's message: its usage_metadata is recorded instead of the estimate (see usage_tokens()).
+    """
+    started = time.perf_counter()
+    response = call()
+    record_tokens(node, prompt, response, time.perf_counter() - started)
+    return response
+
+
+async def ametered_call(node: str, prompt: str, acall):
+    """
+    Async variant of metered_call(); acall is an async callable.
+    """
+    started = time.perf_counter()
+    response = await acall()
+    record_tokens(node, prompt, response, time.perf_counter() - started)
+    return response
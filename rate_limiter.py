@@ -0,0 +1,331 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from prompts import estimate_tokens, usage_tokens
+
+
+# Priority classes; lower goes first. Calls that finish an almost-done plan are served before
+# calls that start new plans, so plans complete at the full quota rate instead of all slowing down.
+FINISHING = 0
+PLANNING = 1
+FAN_OUT = 2
+
+NODE_PRIORITIES = {
+    'pdf_generator': FINISHING,
+    'hydration_tips': FINISHING,
+    'supplement_advisor': PLANNING,
+    'calorie_macro_ai': PLANNING,
+    'personalized_meals': PLANNING,
+    'motivation': PLANNING,
+    'meal_filter': PLANNING,
+    'nutrient_need': PLANNING,
+}
+PRIORITY_NAMES = {FINISHING: 'finishing', PLANNING: 'planning', FAN_OUT: 'fan_out'}
+
+DEFAULT_OUTPUT_TOKENS = 300
+# Expected reply size per node, added to the prompt estimate when reserving TPM budget.
+NODE_OUTPUT_TOKENS = {'personalized_meals': 800, 'pdf_generator': 2500, 'profile_analysis': 600}
+# Buckets hold this share of a minute's quota, which bounds the burst after an idle period.
+BURST_SECONDS = 10.0
+WAIT_WINDOW = 500
+
+
+def node_priority(node: str) -> int:
+    return NODE_PRIORITIES.get(node, FAN_OUT)
+
+
+class TokenBucket:
+    """
+    Refills at rate_per_minute / 60 units per second up to capacity. The level may go negative
+    when a request is charged more than was reserved; later requests then wait it out.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, self.rate * BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # a request larger than the bucket waits for a full bucket, then drives it negative
+        shortfall = min(amount, self.capacity) - self.level
+        return max(0.0, shortfall / self.rate)
+
+
+class _Ticket:
+    __slots__ = ('key', 'tokens', 'wake', 'cancelled')
+
+    def __init__(self, priority: int, seq: int, tokens: int, wake):
+        self.key = (priority, seq)
+        self.tokens = tokens
+        self.wake = wake
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class RateLimiter:
+    """
+    Client-side requests-per-minute and tokens-per-minute limiter with priority classes.
+
+    Waiting calls are queued by (priority, arrival); only the head of the queue may take
+    capacity, so a call from a higher class overtakes everything queued below it. The head
+    sleeps until both buckets can cover it, everyone else sleeps until they become the head.
+    Works for threads and coroutines alike.
+    """
+
+    def __init__(self, rpm: float = None, tpm: float = None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+        self._queue = []
+        self._seq = itertools.count()
+        self._waits = defaultdict(lambda: deque(maxlen=WAIT_WINDOW))
+        self._counters = defaultdict(int)
+
+    # ---- core (called with the lock held) ------------------------------
+
+    def _head(self):
+        while self._queue and self._queue[0].cancelled:
+            heapq.heappop(self._queue)
+        return self._queue[0] if self._queue else None
+
+    def _try_take(self, ticket: _Ticket) -> float:
+        """
+        Grants the ticket if it is the head and both buckets cover it.
+
+        Returns:
+            float: 0.0 when granted, seconds to wait when it is the head, None otherwise.
+        """
+        if self._head() is not ticket:
+            return None
+        now = time.monotonic()
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, ticket.tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(amount))
+        if wait > 0:
+            return wait
+        for bucket, amount in ((self.requests, 1), (self.tokens, ticket.tokens)):
+            if bucket is not None:
+                bucket.level -= amount
+        heapq.heappop(self._queue)
+        head = self._head()
+        if head is not None:
+            head.wake()
+        return 0.0
+
+    def _enqueue(self, node: str, tokens: int, wake) -> _Ticket:
+        ticket = _Ticket(node_priority(node), next(self._seq), tokens, wake)
+        with self._lock:
+            heapq.heappush(self._queue, ticket)
+            self._counters['queued'] += 1
+        return ticket
+
+    def _leave(self, ticket: _Ticket) -> None:
+        # a waiter gave up; let the next one in line re-check
+        with self._lock:
+            ticket.cancelled = True
+            self._counters['abandoned'] += 1
+            head = self._head()
+            if head is not None:
+                head.wake()
+
+    def _granted(self, node: str, started: float) -> None:
+        with self._lock:
+            self._waits[node_priority(node)].append(time.monotonic() - started)
+            self._counters['granted'] += 1
+
+    # ---- public API ----------------------------------------------------
+
+    def acquire(self, node: str = None, tokens: int = 0, timeout: float = None) -> None:
+        """
+        Blocks until the call may be sent.
+
+        Args:
+            node (str): The calling node; selects the priority class.
+            tokens (int): Estimated tokens for the call (prompt plus expected reply).
+            timeout (float): Seconds to wait at most.
+
+        Raises:
+            TimeoutError: If the call could not be scheduled in time.
+        """
+        started = time.monotonic()
+        event = threading.Event()
+        ticket = self._enqueue(node, tokens, event.set)
+        while True:
+            with self._lock:
+                wait = self._try_take(ticket)
+            if wait == 0.0:
+                self._granted(node, started)
+                return
+            if timeout is not None:
+                remaining = started + timeout - time.monotonic()
+                if remaining <= 0:
+                    self._leave(ticket)
+                    raise TimeoutError(f"{node}: rate limiter queue did not clear within {timeout:.1f}s")
+                wait = remaining if wait is None else min(wait, remaining)
+            event.wait(wait)
+            event.clear()
+
+    async def aacquire(self, node: str = None, tokens: int = 0, timeout: float = None) -> None:
+        """
+        Async variant of acquire(); waits without blocking the event loop.
+        """
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        wakeup = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: wakeup.done() or wakeup.set_result(None))
+
+        ticket = self._enqueue(node, tokens, wake)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_take(ticket)
+                if wait == 0.0:
+                    self._granted(node, started)
+                    return
+                if timeout is not None:
+                    remaining = started + timeout - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"{node}: rate limiter queue did not clear within {timeout:.1f}s")
+                    wait = remaining if wait is None else min(wait, remaining)
+                try:
+                    await asyncio.wait_for(asyncio.shield(wakeup), wait)
+                except asyncio.TimeoutError:
+                    pass
+                wakeup = loop.create_future()
+        except BaseException:
+            self._leave(ticket)
+            raise
+
+    def charge(self, tokens: int) -> None:
+        """
+        Corrects the token budget once the real size of a call is known (positive charges more).
+        """
+        if self.tokens is None or not tokens:
+            return
+        with self._lock:
+            self.tokens.refill(time.monotonic())
+            self.tokens.level -= tokens
+
+    def stats(self) -> dict:
+        """
+        Returns queue depth per priority class, counters and wait times (mean, p95, max, seconds).
+        """
+        with self._lock:
+            depth = defaultdict(int)
+            for ticket in self._queue:
+                if not ticket.cancelled:
+                    depth[PRIORITY_NAMES.get(ticket.key[0], ticket.key[0])] += 1
+            waits = {priority: list(samples) for priority, samples in self._waits.items()}
+            stats = dict(self._counters)
+        stats['queue_depth'] = sum(depth.values())
+        stats['queue_depth_by_class'] = dict(depth)
+        stats['wait_seconds'] = {}
+        for priority, samples in waits.items():
+            ordered = sorted(samples)
+            stats['wait_seconds'][PRIORITY_NAMES.get(priority, priority)] = {
+                'mean': sum(ordered) / len(ordered),
+                'p95': ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+                'max': ordered[-1],
+            }
+        return stats
+
+
+_LIMITER = None
+_LIMITER_LOCK = threading.Lock()
+_CONFIGURED = False
+
+
+def configure_rate_limiter(rpm: float = None, tpm: float = None) -> RateLimiter:
+    """
+    Installs the process-wide limiter every LLM call goes through.
+
+    Args:
+        rpm (float): Requests per minute; None for no request limit.
+        tpm (float): Tokens per minute (estimated); None for no token limit.
+
+    Returns:
+        RateLimiter: The new limiter, or None when both limits are None (limiting off).
+    """
+    global _LIMITER, _CONFIGURED
+    with _LIMITER_LOCK:
+        _LIMITER = RateLimiter(rpm, tpm) if (rpm or tpm) else None
+        _CONFIGURED = True
+    return _LIMITER
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Returns the shared limiter, set up from DIET_LLM_RPM / DIET_LLM_TPM on first use.
+
+    Limiting is off (None) unless one of them is set or configure_rate_limiter() was called.
+    """
+    global _LIMITER, _CONFIGURED
+    if not _CONFIGURED:
+        with _LIMITER_LOCK:
+            if not _CONFIGURED:
+                rpm, tpm = os.environ.get('DIET_LLM_RPM'), os.environ.get('DIET_LLM_TPM')
+                _LIMITER = RateLimiter(float(rpm) if rpm else None, float(tpm) if tpm else None) if (rpm or tpm) else None
+                _CONFIGURED = True
+    return _LIMITER
+
+
+def call_tokens(node: str, prompt: str) -> int:
+    """
+    Tokens to reserve for a call: the prompt estimate plus the node's expected reply size.
+    """
+    return estimate_tokens(prompt) + NODE_OUTPUT_TOKENS.get(node, DEFAULT_OUTPUT_TOKENS)
+
+
+def limited_call(node: str, prompt: str, call):
+    """
+    Waits for the shared limiter (if any), makes the call and charges the real reply size.
+
+    Wrap each single request with it, not a retrying call: a retry or hedged duplicate is
+    another request and must queue and be charged like one (see resilience.call_with_policy()).
+
+    Args:
+        node (str): The calling node; selects the priority class.
+        prompt (str): The prompt, for the token estimate.
+        call (callable): Makes one request and returns the response (text or message).
+
+    Returns:
+        The response, charged at its reported usage when it carries usage_metadata.
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return call()
+    reserved = call_tokens(node, prompt)
+    limiter.acquire(node, reserved)
+    response = call()
+    limiter.charge(sum(usage_tokens(prompt, response)) - reserved)
+    return response
+
+
+async def alimited_call(node: str, prompt: str, acall):
+    """
+    Async variant of limited_call(); acall is an async callable.
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return await acall()
+    reserved = call_tokens(node, prompt)
+    await limiter.aacquire(node, reserved)
+    response = await acall()
+    limiter.charge(sum(usage_tokens(prompt, response)) - reserved)
+    return response
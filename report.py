@@ -0,0 +1,157 @@
+import os
+import re
+import threading
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
+from markdown2 import markdown
+from markupsafe import Markup
+
+from instrumentation import profiled
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'report')
+REPORT_TEMPLATE = 'report.md.j2'
+PAGE_TEMPLATE = 'page.html.j2'
+MARKDOWN_EXTRAS = ["tables", "fenced-code-blocks"]
+# Raw HTML in the markdown (from the profile or the LLM) is shown as text, never passed to the PDF engine.
+MARKDOWN_SAFE_MODE = "escape"
+_MARKDOWN_SPECIAL = re.compile(r'([\\`*_{}\[\]#+!])')
+MACROS = (('protein', 'Protein'), ('carbs', 'Carbohydrates'), ('fat', 'Fats'))
+
+# Used when the motivation node is off or its LLM call fails; picked per goal class.
+DEFAULT_MOTIVATION = {
+    'WEIGHT_LOSS': ("Small, steady changes add up to lasting results.", "Every balanced meal is a step toward a lighter, healthier you."),
+    'WEIGHT_GAIN': ("Strength is built one nourishing meal at a time.", "Consistency feeds progress; keep fuelling your goals."),
+    'MAINTENANCE': ("Balance is not something you find, it is something you create.", "Keep the habits that keep you well."),
+    'CLINICAL_DIET': ("Let food be thy medicine and medicine be thy food. (Hippocrates)", "Caring for your diet is caring for your health, every single day."),
+    'CHILD_DIET': ("Healthy habits grow with every colourful plate.", "Good food today builds a strong tomorrow."),
+}
+
+
+def _escape(value) -> str:
+    """
+    Prints a state value into the report markdown as plain text, so profile fields cannot add
+    links, images or HTML. Set as the environment's finalize, it applies to every {{ ... }}.
+    """
+    if isinstance(value, Markup):
+        return value
+    text = str(value).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return _MARKDOWN_SPECIAL.sub(r'\\\1', text)
+
+
+def _cell(value) -> str:
+    """
+    Makes a value safe inside a markdown table cell.
+    """
+    return ' '.join(str(value if value is not None else '').split()).replace('|', '/')
+
+
+def _label(value) -> str:
+    """
+    Turns enum-style values such as "NON_VEGETARIAN" or "snack_1" into "Non Vegetarian" / "Snack 1".
+    """
+    return _cell(value).replace('_', ' ').title() if value else '-'
+
+
+_ENV = None
+_ENV_LOCK = threading.Lock()
+
+
+def get_environment() -> Environment:
+    """
+    Returns the Jinja environment for the report templates, compiling every template once per process.
+    """
+    global _ENV
+    if _ENV is None:
+        with _ENV_LOCK:
+            if _ENV is None:
+                env = Environment(
+                    loader=FileSystemLoader(TEMPLATE_DIR),
+                    trim_blocks=True,
+                    lstrip_blocks=True,
+                    keep_trailing_newline=True,
+                    undefined=StrictUndefined,
+                    finalize=_escape,
+                    auto_reload=False,
+                    cache_size=-1,
+                )
+                env.filters.update(cell=_cell, label=_label)
+                for name in env.list_templates():
+                    if name.endswith('.j2'):
+                        env.get_template(name)
+                _ENV = env
+    return _ENV
+
+
+class _StateView(dict):
+    """
+    Gives templates attribute access to state keys, with None for keys the run did not produce.
+    """
+
+    def __getattr__(self, key):
+        return self.get(key)
+
+
+def meal_rows(state: dict) -> list:
+    """
+    Flattens state['meals'] into table rows, taking missing times from the meal schedule.
+
+    Returns:
+        list[dict]: {"name", "time", "items", "calories"} per meal, in plan order.
+    """
+    schedule = state.get('meal_schedule') or {}
+    rows = []
+    for name, details in (state.get('meals') or {}).items():
+        if isinstance(details, dict):
+            items, time, calories = details.get('items') or [], details.get('time'), details.get('calories')
+        elif isinstance(details, list):
+            items, time, calories = details, None, None
+        else:
+            items, time, calories = [details], None, None
+        if isinstance(items, str):
+            items = [items]
+        rows.append({'name': name, 'time': time or schedule.get(name, ''), 'items': [str(i) for i in items], 'calories': calories})
+    return rows
+
+
+def default_motivation(goal_class) -> dict:
+    opening, closing = DEFAULT_MOTIVATION.get(str(goal_class or '').upper(), DEFAULT_MOTIVATION['MAINTENANCE'])
+    return {'opening': opening, 'closing': closing}
+
+
+def build_report(state: dict) -> str:
+    """
+    Lays out the diet plan report as markdown, straight from the workflow state.
+
+    The profile, warnings, nutrition targets, meal table, supplements and hydration sections are
+    separate templates under templates/report; only the motivation lines come from the LLM
+    (state['motivation']), with a fixed quote per goal class otherwise.
+
+    Args:
+        state (dict): The final Dietplan_State.
+
+    Returns:
+        str: The report markdown.
+    """
+    motivation = state.get('motivation') or default_motivation(state.get('goal_class'))
+    with profiled('jinja'):
+        return get_environment().get_template(REPORT_TEMPLATE).render(
+            state=_StateView(state), meals=meal_rows(state), macros=MACROS, motivation=motivation,
+        )
+
+
+def render_page(report: str) -> str:
+    """
+    Converts report markdown into the complete, styled HTML page that is rendered to PDF.
+
+    Args:
+        report (str): The report markdown (from build_report() or the LLM).
+
+    Returns:
+        str: The HTML document.
+    """
+    with profiled('markdown'):
+        body = markdown(report, extras=MARKDOWN_EXTRAS, safe_mode=MARKDOWN_SAFE_MODE)
+    with profiled('jinja'):
+        return get_environment().get_template(PAGE_TEMPLATE).render(body=Markup(body))
+
@@ -0,0 +1,325 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from typing import NamedTuple
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_TIMEOUT = 60.0          # seconds per attempt
+DEFAULT_DEADLINE = 150.0        # seconds for all attempts of one call
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.5           # first retry waits up to this long; doubles per attempt
+DEFAULT_MAX_BACKOFF = 8.0
+HEDGE_MIN_SAMPLES = 20          # latencies a node needs before its p95 is trusted for hedging
+HEDGE_MIN_DELAY = 0.05
+LATENCY_WINDOW = 200            # recent successful attempts kept per node
+MAX_CALL_THREADS = 64
+
+# Errors worth another attempt: timeouts, dropped connections, rate limits and server errors.
+# Matched by class name so the provider SDKs need not be imported here.
+RETRYABLE_ERRORS = {
+    'TimeoutError', 'ConnectionError', 'ConnectError', 'ReadTimeout', 'ConnectTimeout', 'RemoteProtocolError',
+    'ServiceUnavailable', 'InternalServerError', 'TooManyRequests', 'ResourceExhausted', 'DeadlineExceeded',
+    'GatewayTimeout', 'BadGateway', 'RateLimitError', 'APIConnectionError', 'APITimeoutError',
+}
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Outcomes recorded per attempt.
+OK = 'ok'
+ERROR = 'error'
+TIMEOUT = 'timeout'
+ABANDONED = 'abandoned'
+
+
+class CallPolicy(NamedTuple):
+    timeout: float = DEFAULT_TIMEOUT
+    deadline: float = DEFAULT_DEADLINE
+    retries: int = DEFAULT_RETRIES
+    backoff: float = DEFAULT_BACKOFF
+    max_backoff: float = DEFAULT_MAX_BACKOFF
+    hedge: bool = False
+
+
+def call_policy(config: dict = None, node: str = None) -> CallPolicy:
+    """
+    Reads a node's timeout, retry and hedging settings from the run config.
+
+    Settings live under {"configurable": {"resilience": {...}}} with the CallPolicy field names;
+    "deadlines" and "timeouts" map node names to per-node overrides, e.g.
+    {"resilience": {"retries": 3, "hedge": True, "deadlines": {"personalized_meals": 90}}}.
+    "resilience": False sends every call once, with no timeout.
+
+    Returns:
+        CallPolicy: The policy, or None when resilience is turned off for the run.
+    """
+    setting = (config or {}).get('configurable', {}).get('resilience', True)
+    if not setting:
+        return None
+    setting = setting if isinstance(setting, dict) else {}
+    values = {key: setting[key] for key in CallPolicy._fields if key in setting}
+    if node in setting.get('timeouts', {}):
+        values['timeout'] = setting['timeouts'][node]
+    if node in setting.get('deadlines', {}):
+        values['deadline'] = setting['deadlines'][node]
+    return CallPolicy(**values)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Tells whether a failed LLM call may succeed when sent again.
+    """
+    for cls in type(error).__mro__:
+        if cls.__name__ in RETRYABLE_ERRORS:
+            return True
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    if callable(status):
+        status = status()
+    return getattr(status, 'value', status) in RETRYABLE_STATUS
+
+
+def backoff_delay(policy: CallPolicy, attempt: int) -> float:
+    """
+    Full-jitter exponential backoff: a random wait between 0 and backoff * 2**attempt, capped.
+    """
+    return random.uniform(0, min(policy.max_backoff, policy.backoff * (2 ** attempt)))
+
+
+def _percentile(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CallMetrics:
+    """
+    Records every LLM attempt per node: outcome counts, retries, hedges and recent latencies.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: defaultdict(int))
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, node: str, outcome: str, elapsed: float, hedged: bool = False) -> None:
+        with self._lock:
+            counters = self._counters[node]
+            counters['attempts'] += 1
+            counters[outcome] += 1
+            counters['hedges'] += hedged
+            if outcome == OK:
+                self._latencies[node].append(elapsed)
+                counters['hedge_wins'] += hedged
+
+    def count(self, node: str, counter: str) -> None:
+        with self._lock:
+            self._counters[node][counter] += 1
+
+    def hedge_delay(self, node: str) -> float:
+        """
+        Returns how long to wait before hedging a call to this node: its observed p95 latency,
+        or None while fewer than HEDGE_MIN_SAMPLES attempts have succeeded.
+        """
+        with self._lock:
+            samples = list(self._latencies[node])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, _percentile(samples, 0.95))
+
+    def snapshot(self) -> dict:
+        """
+        Returns {node: {"attempts", "ok", "error", "timeout", "abandoned", "retries", "hedges",
+        "hedge_wins", "p50", "p95", "p99"}} with latencies in seconds.
+        """
+        with self._lock:
+            nodes = {node: (dict(counters), list(self._latencies[node])) for node, counters in self._counters.items()}
+        snapshot = {}
+        for node, (counters, samples) in nodes.items():
+            stats = {key: counters.get(key, 0) for key in ('attempts', OK, ERROR, TIMEOUT, ABANDONED, 'retries', 'hedges', 'hedge_wins')}
+            stats.update(p50=_percentile(samples, 0.50), p95=_percentile(samples, 0.95), p99=_percentile(samples, 0.99))
+            snapshot[node] = stats
+        return snapshot
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._latencies.clear()
+
+
+_METRICS = CallMetrics()
+# Sync attempts run here so they can be timed out and hedged; a timed-out call cannot be
+# interrupted, so its thread finishes in the background and the result is dropped.
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CALL_THREADS, thread_name_prefix='llm-call')
+
+
+def get_call_metrics() -> CallMetrics:
+    return _METRICS
+
+
+def _submit(call) -> concurrent.futures.Future:
+    # run in a copy of the caller's context so context variables set by the node are visible
+    return _EXECUTOR.submit(contextvars.copy_context().run, call)
+
+
+def _wait_sync(node: str, call, policy: CallPolicy, timeout: float):
+    """
+    Runs one attempt, plus a hedged duplicate once the node's p95 has passed without an answer.
+    """
+    start = time.monotonic()
+    end = start + timeout
+    hedge_after = _METRICS.hedge_delay(node) if policy.hedge else None
+    attempts = {_submit(call): (False, start)}     # future -> (hedged, started at)
+    pending = set(attempts)
+    error = None
+    while pending:
+        now = time.monotonic()
+        wait_for = end - now
+        if hedge_after is not None and len(attempts) == 1:
+            wait_for = min(wait_for, start + hedge_after - now)
+        done, pending = concurrent.futures.wait(pending, timeout=max(0.0, wait_for), return_when=concurrent.futures.FIRST_COMPLETED)
+        now = time.monotonic()
+        for future in done:
+            hedged, started = attempts[future]
+            if future.exception() is None:
+                _METRICS.record(node, OK, now - started, hedged)
+                for other in pending:
+                    other.cancel()
+                    _METRICS.record(node, ABANDONED, now - attempts[other][1], attempts[other][0])
+                return future.result()
+            _METRICS.record(node, ERROR, now - started, hedged)
+            error = future.exception()
+        if done:
+            continue
+        if now >= end:
+            for future in pending:
+                future.cancel()
+                _METRICS.record(node, TIMEOUT, now - attempts[future][1], attempts[future][0])
+            raise TimeoutError(f"{node}: no LLM answer within {timeout:.1f}s")
+        if hedge_after is not None and len(attempts) == 1:
+            hedged = _submit(call)
+            attempts[hedged] = (True, now)
+            pending.add(hedged)
+    raise error
+
+
+async def _wait_async(node: str, acall, policy: CallPolicy, timeout: float):
+    """
+    Async variant of _wait_sync(); losing and timed-out tasks are cancelled.
+    """
+    start = time.monotonic()
+    end = start + timeout
+    hedge_after = _METRICS.hedge_delay(node) if policy.hedge else None
+    attempts = {asyncio.ensure_future(acall()): (False, start)}
+    pending = set(attempts)
+    error = None
+    try:
+        while pending:
+            now = time.monotonic()
+            wait_for = end - now
+            if hedge_after is not None and len(attempts) == 1:
+                wait_for = min(wait_for, start + hedge_after - now)
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, wait_for), return_when=asyncio.FIRST_COMPLETED)
+            now = time.monotonic()
+            for task in done:
+                hedged, started = attempts[task]
+                if task.exception() is None:
+                    _METRICS.record(node, OK, now - started, hedged)
+                    for other in pending:
+                        _METRICS.record(node, ABANDONED, now - attempts[other][1], attempts[other][0])
+                    return task.result()
+                _METRICS.record(node, ERROR, now - started, hedged)
+                error = task.exception()
+            if done:
+                continue
+            if now >= end:
+                for task in pending:
+                    _METRICS.record(node, TIMEOUT, now - attempts[task][1], attempts[task][0])
+                raise TimeoutError(f"{node}: no LLM answer within {timeout:.1f}s")
+            if hedge_after is not None and len(attempts) == 1:
+                hedged = asyncio.ensure_future(acall())
+                attempts[hedged] = (True, now)
+                pending.add(hedged)
+        raise error
+    finally:
+        for task in attempts:
+            if not task.done():
+                task.cancel()
+
+
+def _next_delay(node: str, policy: CallPolicy, attempt: int, error: BaseException, deadline: float) -> float:
+    """
+    Returns the backoff before the next attempt, or None when the error should be raised instead.
+    """
+    if attempt >= policy.retries or not is_retryable(error):
+        return None
+    delay = backoff_delay(policy, attempt)
+    if time.monotonic() + delay >= deadline:
+        return None
+    _METRICS.count(node, 'retries')
+    logger.warning("%s: attempt %d failed (%s: %s), retrying in %.2fs", node, attempt + 1, type(error).__name__, error, delay)
+    return delay
+
+
+def call_with_policy(node: str, call, config: dict = None):
+    """
+    Calls the LLM under the node's policy: a timeout per attempt, an overall deadline, jittered
+    exponential retries on retryable errors and, when enabled, a hedged duplicate request once the
+    node's observed p95 latency has passed. The first successful answer wins.
+
+    Args:
+        node (str): The node name; selects per-node settings and latency history.
+        call (callable): Makes one request and returns the response.
+        config (dict): The run config (see call_policy()).
+
+    Returns:
+        The first successful response.
+
+    Raises:
+        TimeoutError: If no attempt answered before the deadline.
+        Exception: The last error when it is not retryable or the retries are used up.
+    """
+    node = node or 'llm'
+    policy = call_policy(config, node)
+    if policy is None:
+        return call()
+    deadline = time.monotonic() + policy.deadline
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            return _wait_sync(node, call, policy, min(policy.timeout, remaining))
+        except Exception as e:
+            delay = _next_delay(node, policy, attempt, e, deadline)
+            if delay is None:
+                raise
+        time.sleep(delay)
+        attempt += 1
+
+
+async def acall_with_policy(node: str, acall, config: dict = None):
+    """
+    Async variant of call_with_policy(); acall is an async callable.
+    """
+    node = node or 'llm'
+    policy = call_policy(config, node)
+    if policy is None:
+        return await acall()
+    deadline = time.monotonic() + policy.deadline
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            return await _wait_async(node, acall, policy, min(policy.timeout, remaining))
+        except Exception as e:
+            delay = _next_delay(node, policy, attempt, e, deadline)
+            if delay is None:
+                raise
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,187 @@
+import logging
+import queue
+import time
+from typing import NamedTuple
+
+from checkpoints import checkpoint_config
+from instrumentation import plan_trace, trace_dir
+from prompts import plan_ledger
+
+
+logger = logging.getLogger(__name__)
+
+
+# Event kinds pushed by the runner.
+STARTED = 'started'
+FINISHED = 'finished'
+FAILED = 'failed'
+REPORT = 'report'
+DONE = 'done'
+
+STREAM_MODES = ['tasks', 'updates']
+
+
+class NodeEvent(NamedTuple):
+    kind: str
+    node: str = None
+    elapsed: float = 0.0
+    at: float = 0.0
+    detail: str = None
+
+
+class _Tracker:
+    """
+    Turns "tasks" and "updates" stream chunks into NodeEvents and folds the updates into the final state.
+    """
+
+    def __init__(self, state: dict, events: queue.Queue):
+        self.state = dict(state)
+        self.events = events
+        self.started = {}
+        self.start = time.monotonic()
+
+    def handle(self, mode: str, chunk: dict) -> None:
+        now = time.monotonic()
+        if mode == 'updates':
+            # the only reducer (degraded, an or) is only ever written True, so applying each
+            # node's update in turn reproduces the final state
+            for update in chunk.values():
+                self.state.update(update or {})
+        elif 'triggers' in chunk:
+            self.started[chunk['id']] = now
+            self.events.put(NodeEvent(STARTED, chunk['name'], 0.0, now - self.start))
+        else:
+            elapsed = now - self.started.pop(chunk['id'], now)
+            error = chunk.get('error')
+            if error is not None:
+                self.events.put(NodeEvent(FAILED, chunk['name'], elapsed, now - self.start, str(error)))
+                return
+            # a PDF rendered by the fallback backend still finishes the node, but the event says why
+            fallback = dict(chunk.get('result') or ()).get('pdf_fallback')
+            self.events.put(NodeEvent(FINISHED, chunk['name'], elapsed, now - self.start, fallback))
+
+    def done(self, ledger, error: BaseException = None) -> None:
+        now = time.monotonic()
+        total = ledger.snapshot()['total']
+        logger.info("plan tokens: %d in / %d out over %d LLM calls", total['input_tokens'], total['output_tokens'], total['calls'])
+        self.events.put(NodeEvent(DONE, None, now - self.start, now - self.start, None if error is None else str(error)))
+
+
+def _stream(graph, graph_input, state: dict, config: dict, events: queue.Queue) -> dict:
+    thread_id = config['configurable']['thread_id']
+    if graph.checkpointer and graph_input is not None:
+        # a fresh run must not inherit state keys from an earlier run on the same thread
+        graph.checkpointer.delete_thread(thread_id)
+    tracker = _Tracker(state, events)
+    with plan_ledger() as ledger, plan_trace(config['configurable']['thread_id'], trace_dir(config)):
+        try:
+            for mode, chunk in graph.stream(graph_input, config=config, stream_mode=STREAM_MODES):
+                tracker.handle(mode, chunk)
+        except BaseException as e:
+            tracker.done(ledger, e)
+            raise
+    if graph.checkpointer:
+        # only failed runs are resumed; a finished run's checkpoints would just take up space
+        graph.checkpointer.delete_thread(thread_id)
+    tracker.done(ledger)
+    return tracker.state
+
+
+async def _astream(graph, graph_input, state: dict, config: dict, events: queue.Queue) -> dict:
+    thread_id = config['configurable']['thread_id']
+    if graph.checkpointer and graph_input is not None:
+        await graph.checkpointer.adelete_thread(thread_id)
+    tracker = _Tracker(state, events)
+    with plan_ledger() as ledger, plan_trace(config['configurable']['thread_id'], trace_dir(config)):
+        try:
+            async for mode, chunk in graph.astream(graph_input, config=config, stream_mode=STREAM_MODES):
+                tracker.handle(mode, chunk)
+        except BaseException as e:
+            tracker.done(ledger, e)
+            raise
+    if graph.checkpointer:
+        await graph.checkpointer.adelete_thread(thread_id)
+    tracker.done(ledger)
+    return tracker.state
+
+
+def run_with_events(graph, state: dict, config: dict, events: queue.Queue) -> dict:
+    """
+    Runs the workflow via graph.stream and pushes a NodeEvent whenever a node starts or finishes.
+    The run's LLM token usage is counted in a plan ledger (see prompts.py) and logged at the end;
+    its node spans are collected in a plan trace, written to the run's trace_dir when one is set
+    (see instrumentation.py). Both are named by the configurable "thread_id" (a new one when the
+    config has none). A graph compiled with checkpoint=True also checkpoints every step under
+    that id, so a failed run can be continued with resume_with_events(); the checkpoints of a
+    run that finishes are deleted.
+
+    Args:
+        graph (CompiledStateGraph): The compiled (sync) workflow.
+        state (dict): The input state.
+        config (dict): The run config.
+        events (queue.Queue): Receives NodeEvents; the last one is always DONE.
+
+    Returns:
+        dict: The final state.
+    """
+    return _stream(graph, state, state, checkpoint_config(config), events)
+
+
+async def arun_with_events(graph, state: dict, config: dict, events: queue.Queue) -> dict:
+    """
+    Async variant of run_with_events(), consuming graph.astream.
+    """
+    return await _astream(graph, state, state, checkpoint_config(config), events)
+
+
+def _checkpointed_state(snapshot, config: dict) -> dict:
+    thread_id = config['configurable']['thread_id']
+    if not snapshot.values:
+        raise LookupError(f"no checkpoint for run {thread_id}")
+    logger.info("resuming run %s at %s", thread_id, ', '.join(snapshot.next) or 'its end')
+    return snapshot.values
+
+
+def _resume_config(graph, config: dict) -> dict:
+    if not graph.checkpointer:
+        raise ValueError("the workflow was compiled without a checkpointer (checkpoint=True)")
+    if not (config or {}).get('configurable', {}).get('thread_id'):
+        raise ValueError("resuming needs the run's configurable thread_id")
+    return checkpoint_config(config)
+
+
+def resume_with_events(graph, config: dict, events: queue.Queue) -> dict:
+    """
+    Continues a failed run from its last checkpoint. Nodes that finished before the failure,
+    including those running alongside the failed one, are not run (or billed) again.
+
+    Args:
+        graph (CompiledStateGraph): The compiled (sync) workflow of the failed run, built with checkpoint=True.
+        config (dict): The run config; its configurable "thread_id" names the run to continue.
+        events (queue.Queue): Receives NodeEvents for the nodes that still run; the last one is always DONE.
+
+    Returns:
+        dict: The final state.
+
+    Raises:
+        LookupError: If no checkpoint exists for the thread_id (it never ran, or it finished).
+    """
+    config = _resume_config(graph, config)
+    state = _checkpointed_state(graph.get_state(config), config)
+    return _stream(graph, None, state, config, events)
+
+
+async def aresume_with_events(graph, config: dict, events: queue.Queue) -> dict:
+    """
+    Async variant of resume_with_events(), consuming graph.astream.
+    """
+    config = _resume_config(graph, config)
+    state = _checkpointed_state(await graph.aget_state(config), config)
+    return await _astream(graph, None, state, config, events)
+
+
+def report_events(events: queue.Queue):
+    """
+    Returns an on_report_chunk callback that forwards the streamed PDF report as REPORT events.
+    """
+    return lambda text: events.put(NodeEvent(REPORT, 'pdf_generator', detail=text))
@@ -0,0 +1,123 @@
+import datetime
+import re
+
+
+MINUTES_PER_DAY = 24 * 60
+DEFAULT_AWAKE_MINUTES = 16 * 60
+
+# Preferred spacing from wake-up to the first meal and from the last meal to bedtime.
+FIRST_MEAL_DELAY = 45
+LAST_MEAL_BUFFER = 150
+# Tightest spacing used when the preferred one does not leave room for every meal.
+MIN_FIRST_MEAL_DELAY = 15
+MIN_LAST_MEAL_BUFFER = 60
+
+MIN_GAP_MINUTES = 90
+ROUND_TO_MINUTES = 15
+
+
+def parse_clock(value) -> int:
+    """
+    Reads a time of day such as "07:00", "7:00 AM", "7 pm" or a datetime.time.
+
+    Args:
+        value (str | datetime.time): The time to parse.
+
+    Returns:
+        int: Minutes since midnight.
+    """
+    if isinstance(value, datetime.time):
+        return value.hour * 60 + value.minute
+
+    match = re.fullmatch(r'\s*(\d{1,2})(?:[:.](\d{2}))?\s*([AaPp]\.?[Mm]\.?)?\s*', str(value))
+    if not match:
+        raise ValueError(f"Unrecognized time of day: {value!r}")
+
+    hour, minute = int(match.group(1)), int(match.group(2) or 0)
+    meridiem = (match.group(3) or '').lower().replace('.', '')
+    if meridiem:
+        if not 1 <= hour <= 12:
+            raise ValueError(f"Unrecognized time of day: {value!r}")
+        hour = hour % 12 + (12 if meridiem == 'pm' else 0)
+    if hour > 23 or minute > 59:
+        raise ValueError(f"Unrecognized time of day: {value!r}")
+    return hour * 60 + minute
+
+
+def format_clock(minutes: int) -> str:
+    """
+    Formats minutes since midnight (wrapping past midnight) like "08:00 AM".
+    """
+    minutes = int(minutes) % MINUTES_PER_DAY
+    return datetime.time(minutes // 60, minutes % 60).strftime('%I:%M %p')
+
+
+def _meal_names(count: int, times: list, midday: float) -> list:
+    """
+    Names the meals: the first is breakfast, the last dinner, the one nearest midday lunch and the rest snacks.
+    """
+    if count == 1:
+        return ['lunch']
+    if count == 2:
+        return ['breakfast', 'dinner']
+
+    lunch = min(range(1, count - 1), key=lambda i: abs(times[i] - midday))
+    names, snack = [], 0
+    for i in range(count):
+        if i == 0:
+            names.append('breakfast')
+        elif i == count - 1:
+            names.append('dinner')
+        elif i == lunch:
+            names.append('lunch')
+        else:
+            snack += 1
+            names.append(f'snack_{snack}')
+    return names
+
+
+def build_meal_schedule(wake_time, sleep_time, meal_frequency: int, min_gap: int = MIN_GAP_MINUTES) -> dict:
+    """
+    Spreads the day's meals evenly over the waking window.
+
+    Sleep times at or before the wake time are taken to be after midnight. The first meal comes
+    shortly after waking and the last one well before bed; when that window is too short for the
+    requested number of meals at min_gap apart, the buffers shrink and, as a last resort, meals
+    are dropped rather than packed closer together.
+
+    Args:
+        wake_time (str): Wake-up time, e.g. "07:00" or "7:00 AM".
+        sleep_time (str): Bedtime, e.g. "23:00" or "12:30 AM".
+        meal_frequency (int): Number of meals per day.
+        min_gap (int): Minimum minutes between two meals.
+
+    Returns:
+        dict: Meal name -> time (e.g. {"breakfast": "07:45 AM", ...}) in chronological order,
+        the same shape routine_time used to get from the LLM.
+    """
+    wake = parse_clock(wake_time)
+    sleep = parse_clock(sleep_time)
+    if sleep == wake:
+        sleep = wake + DEFAULT_AWAKE_MINUTES
+    elif sleep < wake:
+        sleep += MINUTES_PER_DAY
+
+    count = max(1, int(meal_frequency))
+    start, end = wake + FIRST_MEAL_DELAY, sleep - LAST_MEAL_BUFFER
+    if end - start < (count - 1) * min_gap:
+        start, end = wake + MIN_FIRST_MEAL_DELAY, sleep - MIN_LAST_MEAL_BUFFER
+    if end < start:
+        start = end = (wake + sleep) // 2
+    if end - start < (count - 1) * min_gap:
+        count = 1 + (end - start) // min_gap
+
+    start = -(-start // ROUND_TO_MINUTES) * ROUND_TO_MINUTES
+    if count == 1:
+        times = [(wake + sleep) // 2 // ROUND_TO_MINUTES * ROUND_TO_MINUTES]
+    else:
+        gap = (end - start) / (count - 1)
+        step = max(int(gap // ROUND_TO_MINUTES) * ROUND_TO_MINUTES, min_gap)
+        times = [start + i * step for i in range(count)]
+
+    names = _meal_names(count, times, (start + end) / 2)
+    return {name: format_clock(minutes) for name, minutes in zip(names, times)}
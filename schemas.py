@@ -0,0 +1,342 @@
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Annotated, Optional, Union
+
+from langchain_core.language_models import BaseChatModel
+from pydantic import BaseModel, BeforeValidator, Field, StringConstraints, ValidationError
+
+from nutrition import ACTIVITY_FACTORS, parse_grams
+
+
+logger = logging.getLogger(__name__)
+
+# Longest slice of a malformed reply that is quoted back in a repair prompt.
+MAX_REPAIR_ECHO = 4000
+MAX_STRUCTURED_MODELS = 64
+# HTTP statuses with which a provider refuses a request's schema or tool definition
+SCHEMA_REJECTED_STATUS = (400, 422)
+
+_FENCE = re.compile(r'```(?:json|JSON)?\s*(.*?)```', re.S)
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+_DECODER = json.JSONDecoder()
+
+
+# ---- field types -----------------------------------------------------------
+# LLM replies drift in small ways ("1.4x", a single string where a list was asked for,
+# "very active"); these coerce the harmless variants and reject the rest.
+
+def _as_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value.strip() if isinstance(value, str) else value
+
+
+def _as_text_list(value):
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        value = [value]
+    if not isinstance(value, list):
+        return value
+    items = []
+    for item in value:
+        if isinstance(item, dict):
+            item = ' '.join(str(part) for part in item.values() if part not in (None, ''))
+        if item not in (None, ''):
+            items.append(str(item).strip())
+    return items
+
+
+def _as_number(value):
+    if isinstance(value, str):
+        number = parse_grams(value)
+        return value if number is None else number
+    return value
+
+
+def _as_int(value):
+    value = _as_number(value)
+    return int(round(value)) if isinstance(value, float) else value
+
+
+def _as_activity(value):
+    # "very active" -> "VERY_ACTIVE"; unlike normalize_activity() this keeps unknown labels so they fail validation
+    return re.sub(r'[\s\-]+', '_', value.strip()).upper() if isinstance(value, str) else value
+
+
+Text = Annotated[str, BeforeValidator(_as_text), StringConstraints(min_length=1)]
+TextList = Annotated[list[str], BeforeValidator(_as_text_list)]
+Number = Annotated[float, BeforeValidator(_as_number), Field(gt=0)]
+Calories = Annotated[int, BeforeValidator(_as_int), Field(gt=0)]
+Amounts = Annotated[dict[str, Union[int, float, str]], Field(min_length=1)]
+ActivityLevel = Annotated[str, BeforeValidator(_as_activity), StringConstraints(pattern='^(' + '|'.join(ACTIVITY_FACTORS) + ')$')]
+
+
+# ---- per-node reply models -------------------------------------------------
+
+class GoalClassOutput(BaseModel):
+    goal_class: Text
+
+
+class MedicalConditionsOutput(BaseModel):
+    restrictions: TextList
+    warnings: TextList
+
+
+class HabitsOutput(BaseModel):
+    preferences: TextList
+    avoid: TextList
+
+
+class ActivityLevelOutput(BaseModel):
+    activity_level: ActivityLevel
+    protein_multiplier: Number
+
+
+class RoutineTimeOutput(BaseModel):
+    meal_schedule: Annotated[dict[str, Text], Field(min_length=1)]
+
+
+class NutrientNeedOutput(BaseModel):
+    target_calories: Optional[Calories] = None
+    macros_target: Amounts
+    micros_needed: TextList = []
+
+
+class MealFilterOutput(BaseModel):
+    allowed_meals: Annotated[TextList, Field(min_length=1)]
+
+
+class Meal(BaseModel):
+    time: Annotated[str, BeforeValidator(_as_text)] = ''
+    items: TextList
+    calories: Optional[Calories] = None
+
+
+class PersonalizedMealsOutput(BaseModel):
+    meals: Annotated[dict[str, Union[Meal, TextList]], Field(min_length=1)]
+
+
+class CalorieMacroOutput(BaseModel):
+    total_calories: Calories
+    actual_macros: Amounts
+    recommendation: Annotated[str, BeforeValidator(_as_text)] = ''
+
+
+class SupplementAdvisorOutput(BaseModel):
+    supplements: TextList
+    notes: Annotated[str, BeforeValidator(_as_text)] = ''
+
+
+class HydrationTipsOutput(BaseModel):
+    water_intake: Text
+    tips: TextList
+
+
+class MotivationOutput(BaseModel):
+    opening: Text
+    closing: Text
+
+
+# Node name -> the model its JSON reply must satisfy.
+NODE_SCHEMAS = {
+    'goal_class': GoalClassOutput,
+    'medical_conditions': MedicalConditionsOutput,
+    'habits': HabitsOutput,
+    'activity_level': ActivityLevelOutput,
+    'routine_time': RoutineTimeOutput,
+    'nutrient_need': NutrientNeedOutput,
+    'meal_filter': MealFilterOutput,
+    'personalized_meals': PersonalizedMealsOutput,
+    'calorie_macro_ai': CalorieMacroOutput,
+    'supplement_advisor': SupplementAdvisorOutput,
+    'hydration_tips': HydrationTipsOutput,
+    'motivation': MotivationOutput,
+}
+
+# Neutral state updates for LLM-only nodes whose reply could not be used even after the repair
+# call, so the rest of the plan (and the report) can still be produced.
+EMPTY_OUTPUTS = {
+    'medical_conditions': {'restrictions': [], 'warnings': []},
+    'habits': {'preferences': [], 'avoid': []},
+    'personalized_meals': {'meals': {}},
+    'supplement_advisor': {'supplements': [], 'notes': ''},
+    'hydration_tips': {'water_intake': '', 'tips': []},
+}
+
+
+def empty_output(name: str) -> dict:
+    return json.loads(json.dumps(EMPTY_OUTPUTS[name]))
+
+
+# ---- extraction and validation ---------------------------------------------
+
+def _first_object(text: str):
+    start = text.find('{')
+    while start != -1:
+        try:
+            value, _ = _DECODER.raw_decode(text, start)
+            return value
+        except ValueError:
+            start = text.find('{', start + 1)
+    return None
+
+
+def extract_json(response: str) -> dict:
+    """
+    Pulls the JSON object out of an LLM reply.
+
+    Fenced ```json blocks are tried first, then the whole reply; in each, the first "{" that starts
+    a complete object wins (json.JSONDecoder.raw_decode, so prose or a second object after it does
+    not matter). Trailing commas, the most common slip, are dropped before giving up.
+
+    Args:
+        response (str): The raw reply text.
+
+    Returns:
+        dict: The parsed object.
+
+    Raises:
+        ValueError: If the reply contains no JSON object.
+    """
+    if isinstance(response, dict):
+        return response
+    text = response or ''
+    candidates = [match.group(1) for match in _FENCE.finditer(text)] + [text]
+    for lenient in (False, True):
+        for candidate in candidates:
+            value = _first_object(_TRAILING_COMMA.sub(r'\1', candidate) if lenient else candidate)
+            if isinstance(value, dict):
+                return value
+    raise ValueError("no JSON object found in the reply")
+
+
+def validate_output(name: str, data) -> dict:
+    """
+    Validates a node's reply against its schema.
+
+    Args:
+        name (str): The node name (a key of NODE_SCHEMAS).
+        data (dict): The parsed reply.
+
+    Returns:
+        dict: The reply with coerced types and without unknown keys.
+
+    Raises:
+        pydantic.ValidationError: If required fields are missing or unusable.
+    """
+    return NODE_SCHEMAS[name].model_validate(data).model_dump()
+
+
+def parse_output(name: str, response: str) -> dict:
+    """
+    Extracts and validates a node's reply in one step.
+
+    Raises:
+        ValueError: If there is no JSON object or it fails validation (ValidationError is a ValueError).
+    """
+    return validate_output(name, extract_json(response))
+
+
+def describe_error(error: Exception) -> str:
+    """
+    Summarizes a parsing or validation error in one line, e.g. "meals.lunch.items: Field required".
+    """
+    if isinstance(error, ValidationError):
+        return '; '.join(f"{'.'.join(str(part) for part in e['loc']) or 'reply'}: {e['msg']}" for e in error.errors()[:8])
+    return str(error)
+
+
+def repair_prompt(name: str, response: str, error: Exception) -> str:
+    """
+    Builds the single follow-up prompt sent when a node's reply is malformed.
+
+    It quotes the reply, names what was wrong with it and gives the expected JSON schema, so the
+    model only has to fix the reply rather than redo the task.
+    """
+    schema = json.dumps(NODE_SCHEMAS[name].model_json_schema(), separators=(',', ':'))
+    return f"""Your previous reply could not be used: {describe_error(error)}.
+
+             Previous reply:
+             {(response or '')[:MAX_REPAIR_ECHO]}
+
+             Return only the corrected JSON object, with no other text, matching this JSON schema:
+             {schema}
+             """
+
+
+# ---- native structured output ----------------------------------------------
+
+def supports_structured_output(llm) -> bool:
+    """
+    Tells whether a chat model has a provider-native structured-output mode (tool calling or JSON mode).
+    """
+    if not isinstance(llm, BaseChatModel):
+        return False
+    cls = type(llm)
+    return cls.with_structured_output is not BaseChatModel.with_structured_output or cls.bind_tools is not BaseChatModel.bind_tools
+
+
+# id(llm) -> (llm, {node name: structured runnable, or None once the provider rejected it})
+_STRUCTURED = OrderedDict()
+_STRUCTURED_LOCK = threading.Lock()
+
+
+def structured_model(llm, name: str):
+    """
+    Returns llm.with_structured_output() bound to the node's schema, built once per model and node.
+
+    Args:
+        llm (BaseChatModel): The chat model.
+        name (str): The node name.
+
+    Returns:
+        Runnable: Returns {"raw", "parsed", "parsing_error"} with parsed an instance of NODE_SCHEMAS[name],
+        or None when the model has no native mode or it failed before (see disable_structured_output()).
+    """
+    if name not in NODE_SCHEMAS or not supports_structured_output(llm):
+        return None
+    key = id(llm)
+    with _STRUCTURED_LOCK:
+        entry = _STRUCTURED.get(key)
+        if entry is not None and name in entry[1]:
+            _STRUCTURED.move_to_end(key)
+            return entry[1][name]
+    try:
+        # the raw reply is kept for its usage_metadata (see methods._structured_reply())
+        runnable = llm.with_structured_output(NODE_SCHEMAS[name], include_raw=True)
+    except (NotImplementedError, ValueError, TypeError) as e:
+        logger.info("%s: no native structured output for this model (%s)", name, e)
+        runnable = None
+    with _STRUCTURED_LOCK:
+        entry = _STRUCTURED.setdefault(key, (llm, {}))
+        runnable = entry[1].setdefault(name, runnable)
+        _STRUCTURED.move_to_end(key)
+        while len(_STRUCTURED) > MAX_STRUCTURED_MODELS:
+            _STRUCTURED.popitem(last=False)
+    return runnable
+
+
+def rejects_structured_output(error: BaseException) -> bool:
+    """
+    Tells whether a failed structured-output call means the provider rejected the schema or the
+    feature (worth turning it off for), rather than a timeout, 429 or 5xx that says nothing about it.
+    """
+    # ValueError covers pydantic's ValidationError and LangChain's OutputParserException
+    if isinstance(error, (NotImplementedError, ValueError, TypeError)):
+        return True
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    if callable(status):
+        status = status()
+    return getattr(status, 'value', status) in SCHEMA_REJECTED_STATUS
+
+
+def disable_structured_output(llm, name: str) -> None:
+    """
+    Stops using native structured output for a model and node, e.g. after the provider rejected the schema.
+    """
+    with _STRUCTURED_LOCK:
+        _STRUCTURED.setdefault(id(llm), (llm, {}))[1][name] = None
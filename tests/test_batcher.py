@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+import types
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+import batcher as batcher_module
+from batcher import MicroBatcher, batcher_for, has_batch_endpoint
+from fake_llm import FakeChatModel
+
+
+class EchoModel:
+    """
+    Answers every prompt with "re: <prompt>" in one batch call; prompts starting with "fail" get an error.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.batches = []
+
+    def batch(self, prompts, return_exceptions: bool = False):
+        self.batches.append(list(prompts))
+        time.sleep(self.delay)
+        return [ValueError(prompt) if prompt.startswith('fail') else types.SimpleNamespace(content=f"re: {prompt}")
+                for prompt in prompts]
+
+
+def invoke_all(batcher, prompts):
+    results = {}
+
+    def run(prompt):
+        try:
+            results[prompt] = batcher.invoke(prompt, timeout=5)
+        except Exception as e:
+            results[prompt] = e
+
+    threads = [threading.Thread(target=run, args=(prompt,)) for prompt in prompts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_prompts_share_a_batch_and_get_their_own_answer():
+    llm = EchoModel()
+    batcher = MicroBatcher(llm, window_ms=200, max_batch=16)
+    prompts = [f"prompt {i}" for i in range(8)]
+    try:
+        results = invoke_all(batcher, prompts)
+    finally:
+        batcher.shutdown()
+
+    assert results == {prompt: f"re: {prompt}" for prompt in prompts}
+    assert len(llm.batches) == 1
+    assert batcher.stats()['batches'] == 1
+    assert batcher.stats()['mean_batch_size'] == 8
+
+
+def test_max_batch_splits_the_window():
+    llm = EchoModel()
+    batcher = MicroBatcher(llm, window_ms=200, max_batch=3)
+    try:
+        results = invoke_all(batcher, [f"prompt {i}" for i in range(7)])
+    finally:
+        batcher.shutdown()
+
+    assert all(result == f"re: {prompt}" for prompt, result in results.items())
+    assert all(len(batch) <= 3 for batch in llm.batches)
+    assert sum(len(batch) for batch in llm.batches) == 7
+
+
+def test_an_error_reaches_only_its_caller():
+    batcher = MicroBatcher(EchoModel(), window_ms=200)
+    try:
+        results = invoke_all(batcher, ['ok 1', 'fail 2', 'ok 3'])
+    finally:
+        batcher.shutdown()
+
+    assert isinstance(results['fail 2'], ValueError)
+    assert results['ok 1'] == 're: ok 1' and results['ok 3'] == 're: ok 3'
+    assert batcher.stats()['errors'] == 1
+
+
+def test_a_caller_that_gives_up_is_left_out_of_the_batch():
+    llm = EchoModel()
+    batcher = MicroBatcher(llm, window_ms=300)
+    try:
+        abandoned = batcher.submit('gave up')
+        kept = batcher.submit('still waiting')
+        assert abandoned.cancel()
+        assert kept.result(timeout=5) == 're: still waiting'
+    finally:
+        batcher.shutdown()
+
+    assert llm.batches == [['still waiting']]
+    assert batcher.stats()['abandoned'] == 1
+
+
+def test_invoke_times_out_and_abandons_its_prompt():
+    batcher = MicroBatcher(EchoModel(), window_ms=500)
+    try:
+        with pytest.raises(TimeoutError):
+            batcher.invoke('too slow', timeout=0.05)
+    finally:
+        batcher.shutdown()
+
+    assert batcher.stats()['abandoned'] == 1
+    assert batcher.stats()['batches'] == 0
+
+
+def test_ainvoke_routes_answers():
+    llm = EchoModel()
+    batcher = MicroBatcher(llm, window_ms=100)
+
+    async def run():
+        return await asyncio.gather(*(batcher.ainvoke(f"prompt {i}", timeout=5) for i in range(4)))
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        batcher.shutdown()
+
+    assert results == [f"re: prompt {i}" for i in range(4)]
+    assert len(llm.batches) == 1
+
+
+def test_fake_model_replies_are_routed_to_their_node():
+    llm = FakeChatModel(median_ms=10, sigma=0.0)
+    batcher = MicroBatcher(llm, window_ms=100)
+    prompts = {'goal_class': 'Classify the goal. Respond in JSON: {"goal_class": "..."}',
+               'pdf_generator': 'Write the report in markdown.'}
+    try:
+        results = invoke_all(batcher, list(prompts.values()))
+    finally:
+        batcher.shutdown()
+
+    assert '"goal_class"' in results[prompts['goal_class']]
+    assert results[prompts['pdf_generator']].startswith('#')
+    assert batcher.stats()['batches'] == 1
+
+
+def test_retired_batcher_stops_its_threads_once_idle(monkeypatch):
+    monkeypatch.setattr(batcher_module, 'RETIRED_IDLE_SECONDS', 0.1)
+    retired = MicroBatcher(EchoModel(), window_ms=10)
+    assert retired.invoke('before', timeout=5) == 're: before'
+    retired.retire()
+    for _ in range(50):
+        if retired._thread is None:
+            break
+        time.sleep(0.05)
+    assert retired._thread is None and retired._executor is None
+
+    # a caller still holding it is served; the collector starts again
+    assert retired.invoke('after', timeout=5) == 're: after'
+    retired.shutdown()
+
+
+def test_only_models_with_a_batch_endpoint_are_batched():
+    config = {'configurable': {'batching': True}}
+    assert not has_batch_endpoint(FakeListChatModel)
+    assert batcher_for(FakeListChatModel(responses=['x']), config) is None
+
+    llm = FakeChatModel()
+    try:
+        assert has_batch_endpoint(FakeChatModel)
+        assert batcher_for(llm, config) is batcher_for(llm, config)
+        assert batcher_for(llm, {'configurable': {}}) is None
+    finally:
+        batcher_module.clear_batchers()
@@ -0,0 +1,25 @@
+import json
+
+import pytest
+
+from prompt_budget import BUDGET_PATH, PROMPTS, measure
+
+
+with open(BUDGET_PATH, encoding='utf-8') as f:
+    BUDGET = json.load(f)
+
+SIZES = measure()
+
+
+def test_every_prompt_has_a_budget():
+    assert set(PROMPTS) == set(BUDGET)
+
+
+@pytest.mark.parametrize('node', sorted(PROMPTS))
+def test_prompt_fits_its_budget(node):
+    # after an intended change, record the new sizes with: python benchmarks/prompt_budget.py --update
+    assert SIZES[node] <= BUDGET[node], f"{node} prompt grew to {SIZES[node]} tokens (budget {BUDGET[node]})"
+
+
+def test_prompts_are_deterministic():
+    assert measure() == SIZES
@@ -0,0 +1,166 @@
+import asyncio
+import time
+
+import pytest
+
+from fake_llm import FakeChatModel, ServiceUnavailable
+from resilience import (HEDGE_MIN_SAMPLES, OK, acall_with_policy, call_policy, call_with_policy,
+                        get_call_metrics, is_retryable)
+
+
+FAST = {'backoff': 0.01, 'max_backoff': 0.02}
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    get_call_metrics().reset()
+    yield
+    get_call_metrics().reset()
+
+
+def run_config(**resilience):
+    return {'configurable': {'resilience': {**FAST, **resilience}}}
+
+
+def scripted(*steps):
+    """
+    Returns a call that plays one step per attempt: an exception to raise, or (seconds, reply).
+    """
+    steps = iter(steps)
+
+    def call():
+        step = next(steps)
+        if isinstance(step, BaseException):
+            raise step
+        seconds, reply = step
+        time.sleep(seconds)
+        return reply
+
+    return call
+
+
+def ascripted(*steps):
+    steps = iter(steps)
+
+    async def acall():
+        step = next(steps)
+        if isinstance(step, BaseException):
+            raise step
+        seconds, reply = step
+        await asyncio.sleep(seconds)
+        return reply
+
+    return acall
+
+
+def prime_latency(node, seconds):
+    for _ in range(HEDGE_MIN_SAMPLES):
+        get_call_metrics().record(node, OK, seconds)
+
+
+def test_policy_from_config():
+    assert call_policy({'configurable': {'resilience': False}}, 'habits') is None
+    policy = call_policy({'configurable': {'resilience': {'retries': 4, 'timeouts': {'habits': 3}}}}, 'habits')
+    assert policy.retries == 4 and policy.timeout == 3
+    assert call_policy({}, 'habits').timeout != 3
+
+
+def test_retryable_errors():
+    assert is_retryable(ServiceUnavailable('503'))
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(ValueError('bad prompt'))
+
+
+def test_retries_a_retryable_error():
+    call = scripted(ServiceUnavailable('503'), (0, 'answer'))
+    assert call_with_policy('habits', call, run_config()) == 'answer'
+    stats = get_call_metrics().snapshot()['habits']
+    assert stats['retries'] == 1 and stats['error'] == 1 and stats['ok'] == 1
+
+
+def test_does_not_retry_other_errors():
+    call = scripted(ValueError('bad prompt'), (0, 'never sent'))
+    with pytest.raises(ValueError):
+        call_with_policy('habits', call, run_config())
+    assert get_call_metrics().snapshot()['habits']['retries'] == 0
+
+
+def test_retries_a_timed_out_attempt():
+    call = scripted((0.5, 'too late'), (0, 'answer'))
+    assert call_with_policy('habits', call, run_config(timeout=0.1)) == 'answer'
+    stats = get_call_metrics().snapshot()['habits']
+    assert stats['timeout'] == 1 and stats['ok'] == 1
+
+
+def test_gives_up_at_the_deadline_when_the_model_stalls():
+    llm = FakeChatModel(median_ms=5, sigma=0.0, slow_rate=1.0, slow_ms=400)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        call_with_policy('habits', lambda: llm.invoke('stall').content, run_config(timeout=0.1, deadline=0.35, retries=5))
+    assert time.monotonic() - started < 0.4
+    stats = get_call_metrics().snapshot()['habits']
+    assert stats['ok'] == 0 and stats['timeout'] == stats['attempts'] >= 2
+
+
+def test_raises_the_last_error_when_retries_are_used_up():
+    llm = FakeChatModel(median_ms=5, sigma=0.0, error_rate=1.0)
+    with pytest.raises(ServiceUnavailable):
+        call_with_policy('habits', lambda: llm.invoke('fail').content, run_config(retries=2))
+    assert llm.requests['pdf_generator'] == 3
+    assert get_call_metrics().snapshot()['habits']['retries'] == 2
+
+
+def test_hedge_answers_when_the_first_attempt_stalls():
+    prime_latency('habits', 0.05)
+    call = scripted((1.0, 'stalled'), (0, 'hedged'))
+    started = time.monotonic()
+    assert call_with_policy('habits', call, run_config(hedge=True, timeout=2)) == 'hedged'
+    assert time.monotonic() - started < 0.5
+    stats = get_call_metrics().snapshot()['habits']
+    assert stats['hedges'] == 1 and stats['hedge_wins'] == 1 and stats['abandoned'] == 1
+
+
+def test_no_hedge_without_latency_history():
+    # a hedge would have answered first
+    call = scripted((0.2, 'first'), (0, 'hedged'))
+    assert call_with_policy('habits', call, run_config(hedge=True, timeout=2)) == 'first'
+    assert get_call_metrics().snapshot()['habits']['hedges'] == 0
+
+
+def test_async_retries_a_timed_out_attempt():
+    acall = ascripted((0.5, 'too late'), (0, 'answer'))
+    assert asyncio.run(acall_with_policy('habits', acall, run_config(timeout=0.1))) == 'answer'
+    stats = get_call_metrics().snapshot()['habits']
+    assert stats['timeout'] == 1 and stats['retries'] == 1
+
+
+def test_async_hedge_cancels_the_stalled_attempt():
+    prime_latency('habits', 0.05)
+    llm = FakeChatModel(median_ms=5, sigma=0.0)
+    cancelled = []
+
+    async def stalled():
+        try:
+            await asyncio.sleep(1.0)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def fast():
+        return (await llm.ainvoke('report')).content
+
+    attempts = iter((stalled, fast))
+
+    async def run():
+        return await acall_with_policy('habits', lambda: next(attempts)(), run_config(hedge=True, timeout=2))
+
+    assert asyncio.run(run()).startswith('#')
+    assert cancelled == [True]
+    assert get_call_metrics().snapshot()['habits']['hedge_wins'] == 1
+
+
+def test_resilience_off_sends_once():
+    llm = FakeChatModel(median_ms=5, sigma=0.0, error_rate=1.0)
+    with pytest.raises(ServiceUnavailable):
+        call_with_policy('habits', lambda: llm.invoke('fail').content, {'configurable': {'resilience': False}})
+    assert llm.requests['pdf_generator'] == 1
@@ -0,0 +1,22 @@
+from langchain_core.messages import AIMessage
+
+from prompts import estimate_tokens, metered_call, plan_ledger
+
+
+PROMPT = 'Classify the goal. Respond in JSON: {"goal_class":"..."}'
+
+
+def test_reported_usage_is_recorded():
+    reply = AIMessage(content='{"goal_class":"WEIGHT_LOSS"}',
+                      usage_metadata={'input_tokens': 31, 'output_tokens': 9, 'total_tokens': 40})
+    with plan_ledger() as ledger:
+        assert metered_call('goal_class', PROMPT, lambda: reply) is reply
+    assert ledger.snapshot()['nodes']['goal_class'] == {'calls': 1, 'input_tokens': 31, 'output_tokens': 9}
+
+
+def test_estimate_without_usage():
+    reply = '{"goal_class":"WEIGHT_LOSS"}'
+    with plan_ledger() as ledger:
+        metered_call('goal_class', PROMPT, lambda: reply)
+    assert ledger.snapshot()['nodes']['goal_class'] == {
+        'calls': 1, 'input_tokens': estimate_tokens(PROMPT), 'output_tokens': estimate_tokens(reply)}